@@ -1,12 +1,23 @@
 import os
-import tiktoken
+import asyncio
+import concurrent.futures
+import threading
 import openai
 import anthropic
-from typing import Dict, List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional, Iterator
 import json
+import time
+import hashlib
 import logging
 from datetime import datetime
 from models_config import get_all_models, get_model_info, get_provider_for_model
+from token_counting import token_counter
+import generation_cache
+import context_budget
+from request_coalescing import request_coalescer, PAPEL_SEGUIDOR
+import provider_routing
+from provider_routing import ProviderRouter, erro_repetivel
+from rate_limiter import rate_limiter
 import pprint
 from sqlalchemy import text
 from google import genai
@@ -16,11 +27,34 @@ from google.genai import types
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Intervalo mínimo entre verificações das chaves de API no banco (segundos)
+# Chaves alteradas em /admin/api_keys chegam aos outros workers após esse prazo
+API_KEY_CHECK_INTERVAL = 30
+
+# Prompt caching: multiplicadores sobre o preço de entrada para tokens lidos/gravados
+# no cache de cada provedor (a tabela ai_model só tem o preço cheio de entrada)
+CACHE_PRICE_MULTIPLIERS = {
+    'anthropic': {'read': 0.1, 'write': 1.25},
+    'openai': {'read': 0.5, 'write': 1.0},
+    'google': {'read': 0.25, 'write': 1.0}
+}
+
+# Cache explícito do Gemini (cached_content): só compensa para casos grandes
+GEMINI_CACHE_MIN_TOKENS = int(os.getenv('GEMINI_CACHE_MIN_TOKENS', '32768'))  # tokens estimados do prefixo
+GEMINI_CACHE_TTL = int(os.getenv('GEMINI_CACHE_TTL', '900'))  # segundos
+
+# Variáveis de ambiente usadas quando não há chave ativa no banco
+API_KEY_ENV_VARS = {
+    'openai': 'OPENAI_API_KEY',
+    'anthropic': 'ANTHROPIC_API_KEY',
+    'google': 'GOOGLE_API_KEY'
+}
+
 class TokenUsageManager:
     """Gerenciador de uso de tokens e custos para múltiplas APIs"""
     
     def __init__(self):
-        self.token_counter = TokenCounter()
+        self.token_counter = token_counter
     
     def calculate_cost_from_api_response(self, usage_data: Dict, model: str) -> Dict:
         """
@@ -39,16 +73,28 @@ class TokenUsageManager:
             input_tokens = usage_data.get('input_tokens', 0)
             output_tokens = usage_data.get('output_tokens', 0)
             
+            # input_tokens inclui os tokens lidos/gravados no cache de prompt,
+            # que são cobrados com desconto/acréscimo sobre o preço de entrada
+            cache_creation = usage_data.get('cache_creation_tokens', 0) or 0
+            cache_read = usage_data.get('cache_read_tokens', 0) or 0
+            uncached_tokens = max(0, input_tokens - cache_creation - cache_read)
+            
             # Calcular custo usando a função existente
-            cost_info = calculate_cost(input_tokens, output_tokens, model)
+            cost_info = calculate_cost(uncached_tokens, output_tokens, model)
             
-            # Adicionar informações de cache se disponíveis
-            cache_creation = usage_data.get('cache_creation_tokens', 0)
-            cache_read = usage_data.get('cache_read_tokens', 0)
+            if cache_creation or cache_read:
+                multipliers = CACHE_PRICE_MULTIPLIERS.get(get_provider_for_model(model), {'read': 1.0, 'write': 1.0})
+                price_input = cost_info.get('price_input', 0)
+                cache_cost = (cache_read * multipliers['read'] + cache_creation * multipliers['write']) * price_input / 1_000_000
+                cost_info['input_cost'] = cost_info.get('input_cost', 0) + cache_cost
+                cost_info['total_cost'] = cost_info.get('total_cost', 0) + cache_cost
+                cost_info['cache_savings'] = cache_read * (1 - multipliers['read']) * price_input / 1_000_000
             
             cost_info.update({
-                'cache_creation_input_tokens': cache_creation,
-                'cache_read_input_tokens': cache_read,
+                'input_tokens': input_tokens,
+                'output_tokens': output_tokens,
+                'cache_creation_tokens': cache_creation,
+                'cache_read_tokens': cache_read,
                 'api_provided': True
             })
             
@@ -60,7 +106,7 @@ class TokenUsageManager:
     
     def calculate_cost_from_estimation(self, prompt: str, response: str, model: str) -> Dict:
         """
-        Calcula custo baseado em estimativa com tiktoken (fallback)
+        Calcula custo baseado em estimativa local de tokens (fallback)
         
         Args:
             prompt: Texto do prompt
@@ -130,166 +176,205 @@ class TokenUsageManager:
             'estimated': cost_info.get('estimated', False),
             'cache_info': {
                 'creation_tokens': cost_info.get('cache_creation_tokens', 0),
-                'read_tokens': cost_info.get('cache_read_tokens', 0)
+                'read_tokens': cost_info.get('cache_read_tokens', 0),
+                'savings_usd': f"${cost_info.get('cache_savings', 0):.6f}"
             }
         }
 
-class TokenCounter:
-    """Classe para contar tokens usando tiktoken"""
+class AsyncLoopRunner:
+    """
+    Event loop asyncio dedicado, executado em uma thread de fundo de cada processo
+    
+    As chamadas aos provedores rodam neste loop com os clientes assíncronos
+    compartilhados; as threads do worker web apenas aguardam o resultado, então
+    um processo mantém várias gerações longas em andamento ao mesmo tempo
+    """
     
     def __init__(self):
-        self.encoders = {}
+        self._loop = None
+        self._pid = None
+        self._lock = threading.Lock()
     
-    def get_encoder(self, model: str) -> tiktoken.Encoding:
-        """Obtém o encoder apropriado para o modelo"""
-        if model not in self.encoders:
-            try:
-                # Obter informações do modelo
-                model_info = get_model_info(model)
-                if model_info:
-                    provider = model_info["provider"]
-                    # Obter encoder do banco de dados
-                    try:
-                        from app import app, AIModel
-                        with app.app_context():
-                            model = AIModel.query.filter_by(provider=provider).first()
-                            encoder_type = model.encoder if model and hasattr(model, 'encoder') else "gpt"
-                    except Exception as e:
-                        print(f"⚠️  Erro ao buscar encoder do provedor {provider}: {e}")
-                        encoder_type = "gpt"  # Fallback
-                    
-                    if encoder_type == "gpt":
-                        # Usar encoder específico do modelo GPT/O
-                        try:
-                            self.encoders[model] = tiktoken.encoding_for_model(model)
-                        except:
-                            # Fallback para cl100k_base se modelo não for reconhecido
-                            self.encoders[model] = tiktoken.get_encoding("cl100k_base")
-                    else:
-                        # Usar encoder padrão (cl100k_base para Claude e Gemini)
-                        self.encoders[model] = tiktoken.get_encoding("cl100k_base")
-                else:
-                    # Fallback para cl100k_base
-                    self.encoders[model] = tiktoken.get_encoding("cl100k_base")
-            except Exception as e:
-                logger.warning(f"Erro ao obter encoder para {model}: {e}")
-                # Fallback para cl100k_base
-                self.encoders[model] = tiktoken.get_encoding("cl100k_base")
-        
-        return self.encoders[model]
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        """Retorna o loop, iniciando a thread no primeiro uso (e após um fork do gunicorn)"""
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='ai-async-loop', daemon=True).start()
+                self._loop = loop
+                self._pid = os.getpid()
+                logger.info("[ASYNC] Event loop das APIs de IA iniciado")
+            return self._loop
     
-    def count_tokens(self, text: str, model: str) -> int:
-        """Conta tokens em um texto para um modelo específico"""
+    def run(self, coro):
+        """Executa a corrotina no loop de fundo e aguarda o resultado (chamar fora do loop)"""
+        loop = self._get_loop()
         try:
-            if text is None:
-                text = ""
-            encoder = self.get_encoder(model)
-            return len(encoder.encode(text))
-        except Exception as e:
-            logger.error(f"Erro ao contar tokens: {e}")
-            # Fallback: estimativa aproximada (1 token ≈ 4 caracteres)
-            return len(text) // 4
+            loop_atual = asyncio.get_running_loop()
+        except RuntimeError:
+            loop_atual = None
+        if loop_atual is loop:
+            # Bloquear aqui travaria o próprio loop
+            coro.close()
+            raise RuntimeError("AsyncLoopRunner.run chamado de dentro do loop de fundo; use await")
+        return self.submit(coro).result()
+    
+    def submit(self, coro) -> concurrent.futures.Future:
+        """Agenda a corrotina no loop de fundo sem aguardar (cancel() no Future cancela a tarefa)"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
 
 class AIManager:
     """Gerenciador de APIs de IA"""
     
     def __init__(self):
-        self.token_counter = TokenCounter()
+        self.token_counter = token_counter
         self.token_usage_manager = TokenUsageManager()
         
-        # Configurar APIs
-        self.openai_client = None
-        self.anthropic_client = None
-        self.google_genai = None
+        # Encoders carregados uma vez (com preload_app do gunicorn, herdados pelos workers)
+        self.token_counter.preload()
         
-        self._setup_clients()
-    
-    def _setup_clients(self):
-        """Configura os clientes das APIs"""
-        # OpenAI
-        openai_api_key = self._get_api_key_from_db('openai')
-        if openai_api_key:
-            try:
-                self.openai_client = openai.OpenAI(api_key=openai_api_key)
-                logger.info("Cliente OpenAI configurado")
-            except Exception as e:
-                logger.error(f"Erro ao configurar OpenAI: {e}")
+        # Registro dos clientes das APIs: {provider: {'version', 'sync', 'async'}}
+        # Carregado no primeiro uso e trocado por inteiro quando uma chave muda
+        self._clients = {}
+        self._clients_pid = None
+        self._clients_checked_at = 0.0
+        self._clients_lock = threading.Lock()
         
-        # Anthropic
-        anthropic_api_key = self._get_api_key_from_db('anthropic')
-        logger.info(f"[ANTHROPIC-SETUP] API Key encontrada: {anthropic_api_key is not None}")
-        if anthropic_api_key:
-            try:
-                logger.info(f"[ANTHROPIC-SETUP] Configurando cliente com chave: {anthropic_api_key[:10]}...")
-                self.anthropic_client = anthropic.Anthropic(
-                    api_key=anthropic_api_key,
-                    timeout=600.0  # 10 minutos de timeout
-                )
-                logger.info("[ANTHROPIC-SETUP] Cliente Anthropic configurado com sucesso")
-            except Exception as e:
-                logger.error(f"[ANTHROPIC-SETUP] Erro ao configurar Anthropic: {type(e).__name__}: {str(e)}")
-                logger.error(f"[ANTHROPIC-SETUP] Traceback:", exc_info=True)
-        else:
-            logger.warning("[ANTHROPIC-SETUP] API Key não encontrada no banco de dados")
+        # Caches explícitos do Gemini criados por este processo: {hash do prefixo: {'name', 'expires_at'}}
+        self._gemini_caches = {}
+        self._gemini_caches_lock = threading.Lock()
         
-        # Google
-        google_api_key = self._get_api_key_from_db('google')
-        if google_api_key:
-            try:
-                # Nova API do Google Gemini não usa configure()
-                # A API key é passada diretamente no cliente
-                self.google_genai = genai
-                self.google_api_key = google_api_key
-                logger.info("Cliente Google configurado")
-            except Exception as e:
-                logger.error(f"Erro ao configurar Google: {e}")
+        self.async_runner = AsyncLoopRunner()
+        
+        # Repetição, fallback entre modelos e hedging (ver provider_routing.py)
+        self.router = ProviderRouter(self)
+        
+        # Limites de RPM/TPM por provedor e modelo, compartilhados entre os workers (ver rate_limiter.py)
+        self.rate_limiter = rate_limiter
     
-    def _get_api_key_from_db(self, provider):
-        """Obtém a chave de API do banco de dados"""
+    def _load_api_keys(self) -> Dict[str, Tuple[str, object]]:
+        """
+        Lê as chaves ativas de cada provedor com sua versão
+        
+        Returns:
+            Dict: {provider: (chave, versão)}; a versão é APIKey.updated_at
+            (ou 'env' para chaves lidas do .env como fallback)
+        """
+        keys = {}
         try:
-            # Importar aqui para evitar dependência circular
-            from flask import current_app
+            # Contexto próprio: pode ser chamado fora de uma requisição
+            from app import app, APIKey
+            with app.app_context():
+                for api_key in APIKey.query.filter_by(is_active=True).all():
+                    keys[api_key.provider] = (api_key.api_key, api_key.updated_at)
+        except Exception as e:
+            logger.warning(f"Erro ao obter chaves de API do banco: {e}")
+        
+        # Fallback para .env
+        from dotenv import load_dotenv
+        load_dotenv()
+        for provider, env_var in API_KEY_ENV_VARS.items():
+            if provider not in keys and os.getenv(env_var):
+                keys[provider] = (os.getenv(env_var), 'env')
+        return keys
+    
+    def _build_clients(self, provider: str, api_key: str) -> Dict:
+        """Cria os clientes síncrono e assíncrono de um provedor"""
+        if provider == 'openai':
+            return {
+                'sync': openai.OpenAI(api_key=api_key),
+                'async': openai.AsyncOpenAI(api_key=api_key)
+            }
+        if provider == 'anthropic':
+            return {
+                'sync': anthropic.Anthropic(api_key=api_key, timeout=600.0),  # 10 minutos de timeout
+                'async': anthropic.AsyncAnthropic(api_key=api_key, timeout=600.0)
+            }
+        if provider == 'google':
+            # O mesmo cliente Gemini atende as chamadas síncronas e as assíncronas (client.aio)
+            client = genai.Client(api_key=api_key)
+            return {'sync': client, 'async': client}
+        return None
+    
+    def refresh_clients(self, force: bool = False) -> Dict:
+        """
+        Recarrega os clientes cujas chaves mudaram no banco
+        
+        Verifica as versões no máximo a cada API_KEY_CHECK_INTERVAL segundos (ou
+        imediatamente com force=True). Só recria o cliente do provedor cuja chave
+        mudou; o registro é substituído por inteiro, então requisições em andamento
+        continuam com o cliente que já tinham
+        """
+        if (not force and self._clients_pid == os.getpid()
+                and time.monotonic() - self._clients_checked_at < API_KEY_CHECK_INTERVAL):
+            return self._clients
+        
+        with self._clients_lock:
+            # Outra thread pode ter recarregado enquanto esperávamos o lock
+            if (not force and self._clients_pid == os.getpid()
+                    and time.monotonic() - self._clients_checked_at < API_KEY_CHECK_INTERVAL):
+                return self._clients
             
-            # Verificar se estamos no contexto da aplicação Flask
-            if current_app and current_app.app_context():
-                # Importar dentro do contexto para evitar circular import
-                from app import db, APIKey
+            # Após um fork do gunicorn os clientes (e conexões) do processo pai não são reaproveitados
+            clients = dict(self._clients) if self._clients_pid == os.getpid() else {}
+            keys = self._load_api_keys()
+            
+            for provider in API_KEY_ENV_VARS:
+                if provider not in keys:
+                    if clients.pop(provider, None):
+                        logger.info(f"[CLIENTS] Cliente {provider} removido (chave desativada)")
+                    continue
                 
-                api_key = APIKey.query.filter_by(provider=provider, is_active=True).first()
-                return api_key.api_key if api_key else None
-            else:
-                # Se não estiver no contexto, tentar ler do .env como fallback
-                import os
-                from dotenv import load_dotenv
-                load_dotenv()
+                api_key, updated_at = keys[provider]
+                # A própria chave também entra na versão: updated_at pode não mudar em toda edição
+                version = (updated_at, hashlib.sha256(api_key.encode()).hexdigest())
+                if provider in clients and clients[provider]['version'] == version:
+                    continue
                 
-                if provider == 'openai':
-                    return os.getenv('OPENAI_API_KEY')
-                elif provider == 'anthropic':
-                    return os.getenv('ANTHROPIC_API_KEY')
-                elif provider == 'google':
-                    return os.getenv('GOOGLE_API_KEY')
-                return None
-        except Exception as e:
-            # Log apenas se for um erro real, não apenas falta de contexto
-            if "not registered" not in str(e) and "app_context" not in str(e):
-                logger.warning(f"Erro ao obter chave da API {provider} do banco: {e}")
+                try:
+                    entry = self._build_clients(provider, api_key)
+                    entry['version'] = version
+                    clients[provider] = entry
+                    logger.info(f"[CLIENTS] Cliente {provider} configurado (versão da chave: {updated_at})")
+                except Exception as e:
+                    logger.error(f"[CLIENTS] Erro ao configurar cliente {provider}: {type(e).__name__}: {str(e)}")
             
-            # Fallback para .env
-            try:
-                import os
-                from dotenv import load_dotenv
-                load_dotenv()
-                
-                if provider == 'openai':
-                    return os.getenv('OPENAI_API_KEY')
-                elif provider == 'anthropic':
-                    return os.getenv('ANTHROPIC_API_KEY')
-                elif provider == 'google':
-                    return os.getenv('GOOGLE_API_KEY')
-            except:
-                pass
-            return None
+            self._clients = clients
+            self._clients_pid = os.getpid()
+            self._clients_checked_at = time.monotonic()
+            return clients
+    
+    def _get_client(self, provider: str, kind: str = 'sync'):
+        """Retorna o cliente atual de um provedor (sem verificar o banco)"""
+        entry = self._clients.get(provider) if self._clients_pid == os.getpid() else None
+        return entry[kind] if entry else None
+    
+    @property
+    def openai_client(self):
+        return self._get_client('openai')
+    
+    @property
+    def async_openai_client(self):
+        return self._get_client('openai', 'async')
+    
+    @property
+    def anthropic_client(self):
+        return self._get_client('anthropic')
+    
+    @property
+    def async_anthropic_client(self):
+        return self._get_client('anthropic', 'async')
+    
+    @property
+    def google_genai(self):
+        return self._get_client('google')
+    
+    def _get_google_client(self) -> genai.Client:
+        """Retorna o cliente Gemini do processo (pool de conexões compartilhado entre requisições)"""
+        client = self._get_client('google')
+        if not client:
+            raise Exception("API key do Google não configurada")
+        return client
     
     def count_request_tokens(self, prompt: str, model: str) -> int:
         """Conta tokens da requisição (prompt)"""
@@ -299,12 +384,223 @@ class AIManager:
         """Conta tokens da resposta"""
         return self.token_counter.count_tokens(response, model)
     
-    def generate_response(self, prompt: str, model: str, max_tokens: int = 2000) -> Tuple[str, Dict]:
+    def _cabe_na_janela(self, prompt: str, max_tokens: int):
+        """Filtro da cadeia de fallback: cabe(modelo) diz se o prompt cabe na janela de contexto do modelo"""
+        def cabe(modelo):
+            model_info = get_model_info(modelo)
+            if not model_info or not model_info.get('context_window'):
+                return True
+            limite = context_budget.limite_entrada(model_info['context_window'], self.resolve_output_tokens(modelo, max_tokens))
+            return self.count_request_tokens(prompt, modelo) <= limite
+        return cabe
+    
+    def generate_response(self, prompt: str, model: str, max_tokens: int = 2000,
+                          cache_prefix: str = None, use_cache: bool = True, objetivo: str = None) -> Tuple[str, Dict]:
         """
         Gera resposta usando a API apropriada
         
+        A chamada roda no event loop de fundo (AsyncLoopRunner); a thread chamadora
+        apenas aguarda o resultado. Erros transitórios são repetidos e, se o modelo falhar,
+        os modelos da cadeia de fallback do objetivo são tentados (ver provider_routing.py)
+        
+        Args:
+            cache_prefix: Início do prompt que se repete entre chamadas (ex.: prompt com as
+                peças processuais); marcado para prompt caching no provedor
+            use_cache: Consultar o cache de gerações (quando habilitado na configuração) e
+                aguardar uma geração idêntica já em andamento; False força uma nova geração
+            objetivo: Objetivo da geração (escolhe a cadeia de fallback)
+        
+        Returns:
+            Tuple[str, Dict]: (resposta, metadados com contagem de tokens e custos;
+            cache_hit indica resposta reaproveitada, sem custo: do cache de gerações ou,
+            com coalesced, de uma geração idêntica simultânea)
+        """
+        # Instruções lidas aqui: dependem do contexto da aplicação Flask da thread chamadora
+        system_message = self._get_model_instructions(model)
+        
+        chave = self._generation_cache_key(prompt, system_message, model, max_tokens, use_cache)
+        usar_cache = chave is not None and generation_cache.cache_habilitado()
+        if usar_cache:
+            em_cache = generation_cache.buscar(chave)
+            if em_cache:
+                logger.info(f"[CACHE] Resposta de {model} reaproveitada do cache de gerações")
+                return em_cache[0], self._cache_hit_tokens_info(model, em_cache[1])
+        
+        geracao = self._entrar_geracao(chave, model)
+        if isinstance(geracao, tuple):
+            return geracao[0], self._cache_hit_tokens_info(model, geracao[1], coalesced=True)
+        
+        # Cadeia de fallback e configuração lidas aqui (contexto da aplicação da thread chamadora)
+        cadeia = provider_routing.cadeia_modelos(model, objetivo, self._cabe_na_janela(prompt, max_tokens))
+        hedge = provider_routing.hedging_habilitado()
+        
+        compartilhar = None
+        try:
+            response, tokens_info = self.async_runner.run(
+                self.router.agenerate(prompt, cadeia, max_tokens, system_message=system_message,
+                                      cache_prefix=cache_prefix, hedge=hedge)
+            )
+            tokens_info['cache_hit'] = False
+            sucesso = tokens_info.get('success') and not tokens_info.get('error')
+            if sucesso:
+                compartilhar = (response, generation_cache.resumo_tokens(tokens_info))
+        finally:
+            if geracao:
+                request_coalescer.concluir(geracao, compartilhar)
+        # Resposta de um modelo de fallback não fica no cache do modelo pedido
+        if usar_cache and sucesso and tokens_info.get('model_used') == model:
+            generation_cache.salvar(chave, model, response, tokens_info)
+        return response, tokens_info
+    
+    def _generation_cache_key(self, prompt: str, system_message: str, model: str, max_tokens: int,
+                              use_cache: bool) -> Optional[str]:
+        """Chave da geração no cache de gerações e na coalescência (None se use_cache for False)"""
+        if not use_cache:
+            return None
+        return generation_cache.chave_cache(prompt, system_message or None, model, self.resolve_output_tokens(model, max_tokens))
+    
+    def _entrar_geracao(self, chave: Optional[str], model: str):
+        """
+        Coalescência com gerações idênticas em andamento (ver request_coalescing.py)
+        
         Returns:
-            Tuple[str, Dict]: (resposta, metadados com contagem de tokens e custos)
+            Tuple[str, Dict] com (resposta, tokens da geração líder) se outra requisição gerou a
+            resposta; a geração em andamento se este chamador é o líder (deve chamar
+            request_coalescer.concluir); ou None se deve gerar sem coalescência
+        """
+        if not chave:
+            return None
+        papel, geracao = request_coalescer.entrar(chave)
+        if papel != PAPEL_SEGUIDOR:
+            return geracao
+        compartilhada = request_coalescer.aguardar(geracao)
+        if compartilhada is None:
+            # A geração líder falhou: gerar por conta própria
+            return None
+        logger.info(f"[SINGLE-FLIGHT] Resposta de {model} compartilhada com geração idêntica simultânea")
+        return compartilhada
+    
+    def _cache_hit_tokens_info(self, model: str, original: Dict, coalesced: bool = False) -> Dict:
+        """
+        Metadados de uma resposta reaproveitada (sem tokens cobrados)
+        
+        Args:
+            original: Tokens e custo da geração que produziu a resposta
+            coalesced: True se veio de uma geração idêntica simultânea, e não do cache de gerações
+        """
+        model_info = get_model_info(model) or {}
+        cost_info = {
+            'total_cost': 0,
+            'input_cost': 0,
+            'output_cost': 0,
+            'currency': 'USD',
+            'model_name': model_info.get('display_name', model),
+            'api_provided': False,
+            'estimated': False
+        }
+        return {
+            'request_tokens': 0,
+            'response_tokens': 0,
+            'total_tokens': 0,
+            'model_used': model,
+            'success': True,
+            'error': None,
+            'cost_info': cost_info,
+            'display_info': self.token_usage_manager.format_cost_for_display(cost_info),
+            'cache_hit': True,
+            'coalesced': coalesced,
+            # Tokens e custo da geração original (evitados por este reaproveitamento)
+            'cached_from': original
+        }
+    
+    def generate_responses(self, prompts: List[str], model: str, max_tokens: int = 2000,
+                           concurrency: int = 8) -> List[Tuple[str, Dict]]:
+        """
+        Gera respostas independentes em paralelo (ex.: resumo de cada peça processual)
+
+        Cada prompt passa por agenerate_response no event loop de fundo, com no máximo
+        concurrency chamadas simultâneas ao provedor
+
+        Returns:
+            List[Tuple[str, Dict]]: (resposta, metadados) na mesma ordem dos prompts
+        """
+        if not prompts:
+            return []
+        system_message = self._get_model_instructions(model)
+
+        async def gerar_todas():
+            semaforo = asyncio.Semaphore(max(1, concurrency))
+
+            async def gerar(prompt):
+                async with semaforo:
+                    return await self.agenerate_response(prompt, model, max_tokens, system_message=system_message)
+
+            return await asyncio.gather(*(gerar(prompt) for prompt in prompts))
+
+        return list(self.async_runner.run(gerar_todas()))
+
+    def generate_responses_models(self, prompt: str, models: List[str], max_tokens: int = 2000,
+                                  cache_prefix: str = None, deadline: float = None) -> Iterator[Tuple[str, str, Dict]]:
+        """
+        Gera o mesmo prompt em vários modelos em paralelo (comparação de minutas)
+        
+        As chamadas rodam juntas no event loop de fundo; cada resultado é entregue assim
+        que o modelo termina. Os modelos que não terminarem em deadline segundos são
+        cancelados e entregues por último, com erro e deadline_exceeded=True
+        
+        Yields:
+            Tuple[str, str, Dict]: (modelo, resposta, metadados no formato de generate_response)
+        """
+        # Instruções lidas aqui: dependem do contexto da aplicação Flask da thread chamadora
+        futuros = {}
+        for model in models:
+            system_message = self._get_model_instructions(model)
+            futuro = self.async_runner.submit(
+                self.agenerate_response(prompt, model, max_tokens, system_message=system_message, cache_prefix=cache_prefix)
+            )
+            futuros[futuro] = model
+        
+        pendentes = set(futuros)
+        try:
+            try:
+                for futuro in concurrent.futures.as_completed(futuros, timeout=deadline):
+                    pendentes.discard(futuro)
+                    model = futuros[futuro]
+                    try:
+                        response, tokens_info = futuro.result()
+                    except Exception as e:
+                        logger.error(f"[FANOUT] Erro ao gerar com {model}: {e}")
+                        response = f"Erro na geração: {str(e)}"
+                        tokens_info = self.build_stream_tokens_info(prompt, "", model, error=str(e))
+                    tokens_info['cache_hit'] = False
+                    yield model, response, tokens_info
+            except concurrent.futures.TimeoutError:
+                logger.warning(f"[FANOUT] Prazo de {deadline}s excedido; cancelando {len(pendentes)} geração(ões)")
+            
+            for futuro in [f for f in futuros if f in pendentes]:
+                # O cancelamento devolve a reserva do limite de taxa (_chamada_limitada)
+                futuro.cancel()
+                pendentes.discard(futuro)
+                model = futuros[futuro]
+                # Sem custo: a chamada pode nem ter chegado ao provedor (fila do limite de taxa)
+                tokens_info = self.build_stream_tokens_info(
+                    "", "", model, error=f"Prazo de {deadline:.0f}s excedido: geração cancelada"
+                )
+                tokens_info['cache_hit'] = False
+                tokens_info['deadline_exceeded'] = True
+                yield model, "", tokens_info
+        finally:
+            # Consumidor parou antes do fim (ex.: cliente desconectou): cancelar o que falta
+            for futuro in pendentes:
+                futuro.cancel()
+    
+    async def agenerate_response(self, prompt: str, model: str, max_tokens: int = 2000,
+                                 system_message: str = None, cache_prefix: str = None) -> Tuple[str, Dict]:
+        """
+        Versão assíncrona de generate_response (mesmo contrato de retorno)
+        
+        Args:
+            system_message: Instruções gerais; se None, são lidas do banco
         """
         tokens_info = {
             'request_tokens': 0,
@@ -327,45 +623,48 @@ class AIManager:
             provider = model_info["provider"]
             
             # Ajustar max_tokens baseado no provedor
-            if max_tokens == 2000:  # Valor padrão
-                if provider == "google":
-                    # Gemini precisa de mais tokens devido aos "pensamentos" internos
-                    max_tokens = 500  # Mínimo para Gemini funcionar
-                else:
-                    max_tokens = model_info.get("max_tokens", 2000)
+            max_tokens = self._resolve_max_tokens(model_info, max_tokens)
             
             # Aplicar instruções específicas do modelo (sem dependência do app.py)
-            system_message = self._get_model_instructions(model)
-            if system_message:
-                # Armazenar system message para uso nos métodos de chamada
-                self._current_system_message = system_message
+            if system_message is None:
+                system_message = self._get_model_instructions(model)
+            system_message = system_message or None
+            
+            # Clientes atualizados se alguma chave mudou (consulta ao banco fora do loop)
+            await asyncio.to_thread(self.refresh_clients)
             
             # Contar tokens após aplicar instruções (fallback)
-            tokens_info['request_tokens'] = self.count_request_tokens(prompt, model)
+            # Contagem fora do loop para não atrasar as outras gerações em andamento
+            tokens_info['request_tokens'] = await asyncio.to_thread(self.count_request_tokens, prompt, model)
+            # Reserva no limite de TPM: entrada estimada + limite de saída (o que sobrar é devolvido)
+            entrada = tokens_info['request_tokens']
             
-            if provider == "openai" and self.openai_client:
-                response, api_info = self._call_openai(prompt, model, max_tokens)
+            if provider == "openai" and self.async_openai_client:
+                response, api_info = await self._chamada_limitada(model, entrada, max_tokens, self._call_openai(prompt, model, max_tokens, system_message, cache_prefix))
                 # Usar informações da API se disponíveis, senão usar estimativa
                 if api_info.get('success') and api_info.get('usage_data'):
                     tokens_info.update(api_info)
                     tokens_info['request_tokens'] = api_info['usage_data']['input_tokens']
                     tokens_info['response_tokens'] = api_info['usage_data']['output_tokens']
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
+                    # Ajustar a estimativa local (Claude/Gemini) com a contagem real
+                    await asyncio.to_thread(self.token_counter.calibrate, model, [system_message, prompt], tokens_info['request_tokens'])
                 else:
                     # Fallback para estimativa
-                    tokens_info['response_tokens'] = self.count_response_tokens(response, model)
+                    tokens_info['response_tokens'] = await asyncio.to_thread(self.count_response_tokens, response, model)
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
                     tokens_info['success'] = api_info.get('success', False)
                     tokens_info['error'] = api_info.get('error')
+                    tokens_info['error_retryable'] = api_info.get('error_retryable', False)
                     tokens_info['cost_info'] = api_info.get('cost_info')
                     tokens_info['display_info'] = api_info.get('display_info')
                 return response, tokens_info
                 
-            elif provider == "anthropic" and self.anthropic_client:
+            elif provider == "anthropic" and self.async_anthropic_client:
                 if len(prompt) > 1000:
-                    response, api_info = self._call_anthropic_streaming(prompt, model, max_tokens, system_message)
+                    response, api_info = await self._chamada_limitada(model, entrada, max_tokens, self._call_anthropic_streaming(prompt, model, max_tokens, system_message, cache_prefix))
                 else:
-                    response, api_info = self._call_anthropic(prompt, model, max_tokens)
+                    response, api_info = await self._chamada_limitada(model, entrada, max_tokens, self._call_anthropic(prompt, model, max_tokens, system_message, cache_prefix))
                 
                 # Usar informações da API se disponíveis, senão usar estimativa
                 if api_info.get('success') and api_info.get('usage_data'):
@@ -373,30 +672,36 @@ class AIManager:
                     tokens_info['request_tokens'] = api_info['usage_data']['input_tokens']
                     tokens_info['response_tokens'] = api_info['usage_data']['output_tokens']
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
+                    # Ajustar a estimativa local (Claude/Gemini) com a contagem real
+                    await asyncio.to_thread(self.token_counter.calibrate, model, [system_message, prompt], tokens_info['request_tokens'])
                 else:
                     # Fallback para estimativa
-                    tokens_info['response_tokens'] = self.count_response_tokens(response, model)
+                    tokens_info['response_tokens'] = await asyncio.to_thread(self.count_response_tokens, response, model)
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
                     tokens_info['success'] = api_info.get('success', False)
                     tokens_info['error'] = api_info.get('error')
+                    tokens_info['error_retryable'] = api_info.get('error_retryable', False)
                     tokens_info['cost_info'] = api_info.get('cost_info')
                     tokens_info['display_info'] = api_info.get('display_info')
                 return response, tokens_info
                 
             elif provider == "google" and self.google_genai:
-                response, api_info = self._call_google(prompt, model, max_tokens)
+                response, api_info = await self._chamada_limitada(model, entrada, max_tokens, self._call_google(prompt, model, max_tokens, system_message, cache_prefix))
                 # Usar informações da API se disponíveis, senão usar estimativa
                 if api_info.get('success') and api_info.get('usage_data'):
                     tokens_info.update(api_info)
                     tokens_info['request_tokens'] = api_info['usage_data']['input_tokens']
                     tokens_info['response_tokens'] = api_info['usage_data']['output_tokens']
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
+                    # Ajustar a estimativa local (Claude/Gemini) com a contagem real
+                    await asyncio.to_thread(self.token_counter.calibrate, model, [system_message, prompt], tokens_info['request_tokens'])
                 else:
                     # Fallback para estimativa
-                    tokens_info['response_tokens'] = self.count_response_tokens(response, model)
+                    tokens_info['response_tokens'] = await asyncio.to_thread(self.count_response_tokens, response, model)
                     tokens_info['total_tokens'] = tokens_info['request_tokens'] + tokens_info['response_tokens']
                     tokens_info['success'] = api_info.get('success', False)
                     tokens_info['error'] = api_info.get('error')
+                    tokens_info['error_retryable'] = api_info.get('error_retryable', False)
                     tokens_info['cost_info'] = api_info.get('cost_info')
                     tokens_info['display_info'] = api_info.get('display_info')
                 return response, tokens_info
@@ -418,21 +723,459 @@ class AIManager:
             tokens_info['total_tokens'] = tokens_info['request_tokens']
             return f"Erro na geração: {str(e)}", tokens_info
     
-    def _call_openai(self, prompt: str, model: str, max_tokens: int) -> Tuple[str, Dict]:
-        """Chama API da OpenAI e retorna resposta com informações de tokens"""
-        import json
-        from datetime import datetime
-        # Verificar se há system message disponível
-        system_message = None
-        if hasattr(self, '_current_system_message'):
-            system_message = self._current_system_message
-            delattr(self, '_current_system_message')
-        
-        # Preparar mensagens
+    async def _chamada_limitada(self, model: str, entrada: int, max_tokens: int, chamada) -> Tuple[str, Dict]:
+        """
+        Aguarda a fila do limite de taxa (entrada estimada + limite de saída), executa a chamada
+        ao provedor e devolve os tokens não usados
+        """
+        reservados = entrada + max_tokens
+        try:
+            await self.rate_limiter.areservar(model, reservados)
+        except BaseException:
+            chamada.close()
+            raise
+        try:
+            response, api_info = await chamada
+        except BaseException:
+            # Cancelada (prazo do fan-out, hedging): a saída não foi gerada. Devolução em outra
+            # thread, sem aguardar: a tarefa já está sendo cancelada e a escrita no banco não
+            # pode bloquear o event loop das outras gerações
+            asyncio.get_running_loop().run_in_executor(None, self.rate_limiter.devolver, model, max_tokens)
+            raise
+        usage_data = api_info.get('usage_data')
+        if usage_data:
+            usados = usage_data.get('input_tokens', 0) + usage_data.get('output_tokens', 0)
+        else:
+            # Erro sem uso informado: a entrada pode ter sido cobrada, a saída não
+            usados = entrada
+        await asyncio.to_thread(self.rate_limiter.devolver, model, reservados - usados)
+        return response, api_info
+    
+    def _stream_limitado(self, model: str, entrada: int, max_tokens: int, stream: Iterator[Tuple[str, object]]) -> Iterator[Tuple[str, object]]:
+        """
+        Stream do provedor iniciado só depois da fila do limite de taxa (a espera conta como
+        tempo até o primeiro trecho para o hedging); devolve os tokens não usados ao final,
+        também quando o stream falha ou é fechado antes do fim (perdedor do hedging, job cancelado)
+        """
+        reservados = entrada + max_tokens
+        reservado = False
+        usados = None
+        try:
+            self.rate_limiter.reservar(model, reservados)
+            reservado = True
+            for kind, value in stream:
+                if kind == 'usage' and value:
+                    usados = value.get('input_tokens', 0) + value.get('output_tokens', 0)
+                yield kind, value
+        finally:
+            try:
+                stream.close()
+            finally:
+                if reservado:
+                    # Sem uso informado: a entrada pode ter sido cobrada, a saída não
+                    self.rate_limiter.devolver(model, reservados - (usados if usados is not None else entrada))
+    
+    def _resolve_max_tokens(self, model_info: Dict, max_tokens: int) -> int:
+        """Ajusta max_tokens baseado no provedor quando o valor padrão é usado"""
+        if max_tokens == 2000:  # Valor padrão
+            if model_info["provider"] == "google":
+                # Gemini precisa de mais tokens devido aos "pensamentos" internos
+                return 500  # Mínimo para Gemini funcionar
+            return model_info.get("max_tokens", 2000)
+        return max_tokens
+
+    def resolve_output_tokens(self, model: str, max_tokens: int = 2000) -> int:
+        """Limite de tokens de saída que será pedido ao provedor (reservado na janela de contexto)"""
+        model_info = get_model_info(model)
+        if not model_info:
+            return max_tokens
+        return self._resolve_max_tokens(model_info, max_tokens)
+
+    def generate_response_stream(self, prompt: str, model: str, max_tokens: int = 2000,
+                                 cache_prefix: str = None, use_cache: bool = True, objetivo: str = None) -> Iterator[Dict]:
+        """
+        Gera resposta em streaming usando a API apropriada (cache_prefix, use_cache e objetivo como em
+        generate_response; a troca de modelo por falha ou hedging só acontece antes do primeiro trecho)
+        
+        Yields:
+            Dict: {'type': 'delta', 'text': trecho} a cada trecho recebido do provedor e, por último,
+            {'type': 'done', 'response': texto completo, 'tokens_info': metadados no formato de generate_response}
+        """
+        model_info = get_model_info(model)
+        if not model_info:
+            tokens_info = self.build_stream_tokens_info(prompt, "", model, error=f"Modelo '{model}' não encontrado na configuração")
+            yield {'type': 'done', 'response': f"Erro: Modelo '{model}' não configurado", 'tokens_info': tokens_info}
+            return
+        
+        provider = model_info["provider"]
+        max_tokens_pedido = max_tokens
+        max_tokens = self._resolve_max_tokens(model_info, max_tokens)
+        system_message = self._get_model_instructions(model) or None
+        
+        chave = self._generation_cache_key(prompt, system_message, model, max_tokens, use_cache)
+        usar_cache = chave is not None and generation_cache.cache_habilitado()
+        if usar_cache:
+            em_cache = generation_cache.buscar(chave)
+            if em_cache:
+                # Resposta já gerada: enviada de uma vez
+                logger.info(f"[CACHE] Resposta de {model} reaproveitada do cache de gerações")
+                yield {'type': 'delta', 'text': em_cache[0]}
+                yield {'type': 'done', 'response': em_cache[0], 'tokens_info': self._cache_hit_tokens_info(model, em_cache[1])}
+                return
+        
+        geracao = self._entrar_geracao(chave, model)
+        if isinstance(geracao, tuple):
+            # Gerada por uma requisição idêntica simultânea: enviada de uma vez
+            yield {'type': 'delta', 'text': geracao[0]}
+            yield {'type': 'done', 'response': geracao[0], 'tokens_info': self._cache_hit_tokens_info(model, geracao[1], coalesced=True)}
+            return
+        
+        compartilhar = None
+        try:
+            self.refresh_clients()
+            
+            # Modelo pedido e cadeia de fallback do objetivo, só os com cliente do provedor configurado
+            cadeia = [
+                m for m in provider_routing.cadeia_modelos(model, objetivo, self._cabe_na_janela(prompt, max_tokens_pedido))
+                if self._stream_do_provedor(m)
+            ]
+            if not cadeia:
+                # Fallback: simulação (enviada de uma vez)
+                api_name = model_info.get("provider_name", provider)
+                fallback_response = self._simulate_response(prompt)
+                tokens_info = self.build_stream_tokens_info(
+                    prompt, fallback_response, model, provider,
+                    error=f"API {api_name} não configurada para modelo {model}"
+                )
+                yield {'type': 'delta', 'text': fallback_response}
+                yield {'type': 'done', 'response': fallback_response, 'tokens_info': tokens_info}
+                return
+            
+            def iniciar(modelo):
+                max_tokens_modelo = max_tokens if modelo == model else self._resolve_max_tokens(get_model_info(modelo), max_tokens_pedido)
+                stream = self._stream_do_provedor(modelo)(prompt, modelo, max_tokens_modelo, system_message, cache_prefix)
+                return self._stream_limitado(modelo, self.count_request_tokens(prompt, modelo), max_tokens_modelo, stream)
+            
+            full_response = ""
+            usage_data = None
+            try:
+                model_usado, chunks, roteamento = self.router.abrir_stream(iniciar, cadeia, provider_routing.hedging_habilitado())
+            except Exception as e:
+                logger.error(f"[{provider.upper()}-STREAMING] Nenhum modelo da cadeia respondeu: {type(e).__name__}: {str(e)}")
+                tokens_info = self.build_stream_tokens_info(prompt, "", model, provider, error=str(e))
+                yield {'type': 'done', 'response': f"Erro na geração: {str(e)}", 'tokens_info': tokens_info}
+                return
+            provider = get_provider_for_model(model_usado)
+            
+            try:
+                for kind, value in chunks:
+                    if kind == 'text':
+                        full_response += value
+                        yield {'type': 'delta', 'text': value}
+                    elif kind == 'usage':
+                        usage_data = value
+            except Exception as e:
+                logger.error(f"[{provider.upper()}-STREAMING] Erro durante o streaming: {type(e).__name__}: {str(e)}")
+                tokens_info = self.build_stream_tokens_info(prompt, full_response, model_usado, provider, error=str(e))
+                yield {'type': 'done', 'response': full_response or f"Erro na geração: {str(e)}", 'tokens_info': tokens_info}
+                return
+            finally:
+                # Fechar a conexão com o provedor também quando o cliente desconecta
+                chunks.close()
+            
+            tokens_info = self.build_stream_tokens_info(prompt, full_response, model_usado, provider, usage_data=usage_data)
+            tokens_info['cache_hit'] = False
+            tokens_info['routing'] = roteamento
+            if full_response:
+                compartilhar = (full_response, generation_cache.resumo_tokens(tokens_info))
+        finally:
+            # Liberar as requisições idênticas que aguardam (None: geram por conta própria)
+            if geracao:
+                request_coalescer.concluir(geracao, compartilhar)
+        if usar_cache and full_response and model_usado == model:
+            generation_cache.salvar(chave, model, full_response, tokens_info)
+        yield {'type': 'done', 'response': full_response, 'tokens_info': tokens_info}
+    
+    def _stream_do_provedor(self, model: str):
+        """Função de streaming do provedor do modelo (None se o cliente do provedor não está configurado)"""
+        provider = get_provider_for_model(model)
+        if provider == "openai" and self.openai_client:
+            return self._stream_openai
+        if provider == "anthropic" and self.anthropic_client:
+            return self._stream_anthropic
+        if provider == "google" and self.google_genai:
+            return self._stream_google
+        return None
+    
+    def build_stream_tokens_info(self, prompt: str, response: str, model: str, provider: str = None,
+                                 usage_data: Dict = None, error: str = None) -> Dict:
+        """
+        Monta os metadados de tokens e custos de uma geração em streaming
+        
+        Usa os dados de uso informados pela API quando disponíveis; caso contrário
+        (ex.: stream interrompido), estima os tokens do prompt e do texto já recebido
+        """
+        if usage_data and usage_data.get('input_tokens'):
+            cost_info = self.token_usage_manager.calculate_cost_from_api_response(usage_data, model)
+            request_tokens = usage_data['input_tokens']
+            response_tokens = usage_data.get('output_tokens', 0)
+        else:
+            cost_info = self.token_usage_manager.calculate_cost_from_estimation(prompt, response, model)
+            request_tokens = self.count_request_tokens(prompt, model)
+            response_tokens = self.count_response_tokens(response, model)
+        
+        return {
+            'request_tokens': request_tokens,
+            'response_tokens': response_tokens,
+            'total_tokens': request_tokens + response_tokens,
+            'model_used': model,
+            'provider': provider,
+            'success': error is None,
+            'error': error,
+            'usage_data': usage_data,
+            'cost_info': cost_info,
+            'display_info': self.token_usage_manager.format_cost_for_display(cost_info),
+            'streaming': True
+        }
+    
+    def _split_cache_prefix(self, prompt: str, cache_prefix: str) -> Tuple[Optional[str], str]:
+        """Separa o prompt em (prefixo estável, restante); sem prefixo válido retorna (None, prompt)"""
+        if cache_prefix and prompt.startswith(cache_prefix):
+            return cache_prefix, prompt[len(cache_prefix):]
+        return None, prompt
+    
+    def _prompt_cache_key(self, model: str, cache_prefix: str) -> str:
+        """Identificador estável do prefixo (mesmo caso → mesma chave)"""
+        return hashlib.sha256(f"{model}\n{cache_prefix}".encode('utf-8')).hexdigest()[:32]
+    
+    def _openai_messages(self, prompt: str, system_message: str = None) -> List[Dict]:
+        """
+        Monta as mensagens da OpenAI
+        
+        O cache da OpenAI é automático por prefixo: as instruções gerais vêm primeiro e o
+        prompt começa pelo trecho estável (peças processuais), então o início da requisição
+        se repete entre a geração e os ajustes
+        """
         messages = []
         if system_message:
             messages.append({"role": "system", "content": system_message})
         messages.append({"role": "user", "content": prompt})
+        return messages
+    
+    def _openai_usage_data(self, usage) -> Dict:
+        """Converte o uso informado pela OpenAI (prompt_tokens já inclui os tokens em cache)"""
+        details = getattr(usage, 'prompt_tokens_details', None)
+        return {
+            'input_tokens': usage.prompt_tokens,
+            'output_tokens': usage.completion_tokens,
+            'total_tokens': usage.total_tokens,
+            'cache_read_tokens': (getattr(details, 'cached_tokens', 0) or 0) if details else 0
+        }
+    
+    def _anthropic_cached_request(self, prompt: str, system_message: str = None,
+                                  cache_prefix: str = None) -> Tuple[Optional[List[Dict]], List[Dict]]:
+        """
+        Monta system e messages da Anthropic com breakpoints cache_control
+        
+        Um breakpoint nas instruções gerais (iguais para todos os casos) e outro no fim do
+        bloco das peças processuais (igual entre a geração e os ajustes do mesmo caso)
+        """
+        system = None
+        if system_message:
+            system = [{"type": "text", "text": system_message, "cache_control": {"type": "ephemeral"}}]
+        
+        prefix, rest = self._split_cache_prefix(prompt, cache_prefix)
+        content = []
+        if prefix:
+            content.append({"type": "text", "text": prefix, "cache_control": {"type": "ephemeral"}})
+        if rest or not content:
+            content.append({"type": "text", "text": rest})
+        return system, [{"role": "user", "content": content}]
+    
+    def _anthropic_usage_data(self, usage) -> Dict:
+        """
+        Converte o uso informado pela Anthropic
+        
+        Na Anthropic input_tokens não inclui os tokens lidos/gravados no cache; somamos
+        para que input_tokens seja sempre o total de entrada, como nos outros provedores
+        """
+        cache_creation = getattr(usage, 'cache_creation_input_tokens', 0) or 0
+        cache_read = getattr(usage, 'cache_read_input_tokens', 0) or 0
+        input_tokens = (usage.input_tokens or 0) + cache_creation + cache_read
+        output_tokens = getattr(usage, 'output_tokens', 0) or 0
+        return {
+            'input_tokens': input_tokens,
+            'output_tokens': output_tokens,
+            'total_tokens': input_tokens + output_tokens,
+            'cache_creation_tokens': cache_creation,
+            'cache_read_tokens': cache_read
+        }
+    
+    def _get_gemini_cached_content(self, model: str, system_message: str, cache_prefix: str) -> Optional[str]:
+        """
+        Retorna o nome do cached_content do Gemini para o prefixo, criando-o se preciso
+        
+        Só usado para prefixos com pelo menos GEMINI_CACHE_MIN_TOKENS tokens (estimados):
+        o cache explícito tem custo de armazenamento e só compensa em casos grandes
+        """
+        if len(cache_prefix) // 4 < GEMINI_CACHE_MIN_TOKENS:
+            return None
+        
+        key = hashlib.sha256(f"{model}\n{system_message or ''}\n{cache_prefix}".encode('utf-8')).hexdigest()
+        now = time.time()
+        with self._gemini_caches_lock:
+            entry = self._gemini_caches.get(key)
+            # Margem para o cache não expirar no meio da requisição
+            if entry and entry['expires_at'] - 60 > now:
+                return entry['name']
+        
+        try:
+            cache = self._get_google_client().caches.create(
+                model=model,
+                config=types.CreateCachedContentConfig(
+                    contents=cache_prefix,
+                    system_instruction=system_message,
+                    ttl=f"{GEMINI_CACHE_TTL}s",
+                    display_name=f"diria-{key[:16]}"
+                )
+            )
+        except Exception as e:
+            logger.warning(f"[Google Gemini] Não foi possível criar cached_content: {e}")
+            return None
+        
+        logger.info(f"[Google Gemini] cached_content criado: {cache.name}")
+        with self._gemini_caches_lock:
+            # Descartar entradas expiradas
+            self._gemini_caches = {k: v for k, v in self._gemini_caches.items() if v['expires_at'] > now}
+            self._gemini_caches[key] = {'name': cache.name, 'expires_at': now + GEMINI_CACHE_TTL}
+        return cache.name
+    
+    def _google_request(self, model: str, prompt: str, max_tokens: int, temperature: float,
+                        system_message: str = None, cache_prefix: str = None) -> Tuple[types.GenerateContentConfig, str]:
+        """
+        Monta (config, contents) do Gemini
+        
+        Com cached_content, as instruções e o prefixo já estão no cache e só o restante do
+        prompt é enviado; nos demais casos o Gemini 2.5 ainda aproveita o cache implícito
+        do prefixo estável
+        """
+        prefix, rest = self._split_cache_prefix(prompt, cache_prefix)
+        cache_name = self._get_gemini_cached_content(model, system_message, prefix) if prefix and rest.strip() else None
+        if cache_name:
+            config = types.GenerateContentConfig(
+                max_output_tokens=max_tokens,
+                temperature=temperature,
+                cached_content=cache_name
+            )
+            return config, rest
+        
+        config = types.GenerateContentConfig(
+            max_output_tokens=max_tokens,
+            temperature=temperature,
+            system_instruction=system_message
+        )
+        return config, prompt
+    
+    def _stream_openai(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                       cache_prefix: str = None) -> Iterator[Tuple[str, object]]:
+        """Chama API da OpenAI em streaming, gerando ('text', trecho) e ('usage', dados de uso)"""
+        request_params = {
+            "model": model,
+            "messages": self._openai_messages(prompt, system_message),
+            "temperature": 1,  # OpenAI O3/O4 só aceita temperature = 1
+            "stream": True,
+            "stream_options": {"include_usage": True}
+        }
+        # Usar max_completion_tokens para modelos O3/O4, max_tokens para outros
+        if model.startswith('o3-') or model.startswith('o4-'):
+            request_params["max_completion_tokens"] = max_tokens
+        else:
+            request_params["max_tokens"] = max_tokens
+        if cache_prefix:
+            request_params["extra_body"] = {"prompt_cache_key": self._prompt_cache_key(model, cache_prefix)}
+        
+        logger.debug(f"[OpenAI-STREAMING] Iniciando streaming para modelo: {model}")
+        stream = self.openai_client.chat.completions.create(**request_params)
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta and chunk.choices[0].delta.content:
+                    yield 'text', chunk.choices[0].delta.content
+                # O último chunk traz apenas os dados de uso
+                if getattr(chunk, 'usage', None):
+                    yield 'usage', self._openai_usage_data(chunk.usage)
+        finally:
+            stream.close()
+    
+    def _stream_anthropic(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                          cache_prefix: str = None) -> Iterator[Tuple[str, object]]:
+        """Chama API da Anthropic em streaming, gerando ('text', trecho) e ('usage', dados de uso)"""
+        system, messages = self._anthropic_cached_request(prompt, system_message, cache_prefix)
+        request_params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": messages,
+            "temperature": 0.3,
+            "stream": True
+        }
+        if system:
+            request_params["system"] = system
+        
+        logger.debug(f"[ANTHROPIC-STREAMING] Iniciando streaming para modelo: {model}")
+        stream = self.anthropic_client.messages.create(**request_params)
+        usage_data = None
+        try:
+            for event in stream:
+                if event.type == "message_start" and getattr(event.message, 'usage', None):
+                    # Tokens de entrada (e de cache) chegam no início da mensagem
+                    usage_data = self._anthropic_usage_data(event.message.usage)
+                elif event.type == "content_block_delta" and getattr(event.delta, 'text', None):
+                    yield 'text', event.delta.text
+                elif event.type == "message_delta" and usage_data and getattr(event, 'usage', None):
+                    # Tokens de saída acumulados chegam no fim da mensagem
+                    usage_data['output_tokens'] = event.usage.output_tokens or 0
+                    usage_data['total_tokens'] = usage_data['input_tokens'] + usage_data['output_tokens']
+        finally:
+            stream.close()
+        
+        if usage_data:
+            yield 'usage', usage_data
+    
+    def _stream_google(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                       cache_prefix: str = None) -> Iterator[Tuple[str, object]]:
+        """Chama API do Google Gemini em streaming, gerando ('text', trecho) e ('usage', dados de uso)"""
+        client = self._get_google_client()
+        config, contents = self._google_request(model, prompt, max_tokens, 0.3, system_message, cache_prefix)
+        
+        logger.debug(f"[Google Gemini-STREAMING] Iniciando streaming para modelo: {model}")
+        usage_metadata = None
+        for chunk in client.models.generate_content_stream(model=model, config=config, contents=contents):
+            text = getattr(chunk, 'text', None)
+            if text:
+                yield 'text', text
+            # Cada chunk traz o uso acumulado; o último tem os totais
+            if getattr(chunk, 'usage_metadata', None):
+                usage_metadata = chunk.usage_metadata
+        
+        if usage_metadata:
+            cached_tokens = getattr(usage_metadata, 'cached_content_token_count', 0) or 0
+            yield 'usage', {
+                'input_tokens': getattr(usage_metadata, 'prompt_token_count', 0) or 0,
+                'output_tokens': getattr(usage_metadata, 'candidates_token_count', 0) or 0,
+                'total_tokens': getattr(usage_metadata, 'total_token_count', 0) or 0,
+                'cached_content_tokens': cached_tokens,
+                'cache_read_tokens': cached_tokens
+            }
+    
+    def _save_debug_response(self, provider: str, debug_data: Dict):
+        """Salva a resposta completa do provedor para debug"""
+        with open(f"debug_response_{provider}.json", "w", encoding="utf-8") as f:
+            json.dump(debug_data, f, indent=2, ensure_ascii=False, default=str)
+    
+    async def _call_openai(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                           cache_prefix: str = None) -> Tuple[str, Dict]:
+        """Chama API da OpenAI e retorna resposta com informações de tokens"""
+        # Preparar mensagens (system + prompt: prefixo estável para o cache automático)
+        messages = self._openai_messages(prompt, system_message)
         
         # OpenAI O3/O4 só aceita temperature = 1
         temperature = 1
@@ -461,18 +1204,17 @@ class AIManager:
             request_params["max_tokens"] = max_tokens
             logger.debug(f"[OpenAI] Usando max_tokens para modelo {model}")
         
+        if cache_prefix:
+            request_params["extra_body"] = {"prompt_cache_key": self._prompt_cache_key(model, cache_prefix)}
+        
         try:
-            response = self.openai_client.chat.completions.create(**request_params)
+            response = await self.async_openai_client.chat.completions.create(**request_params)
             
             # Extrair texto da resposta
             response_text = response.choices[0].message.content
             
             # Capturar dados de uso da API
-            usage_data = {
-                'input_tokens': response.usage.prompt_tokens,
-                'output_tokens': response.usage.completion_tokens,
-                'total_tokens': response.usage.total_tokens
-            }
+            usage_data = self._openai_usage_data(response.usage)
             
             # Salvar resposta completa para debug
             debug_data = {
@@ -487,8 +1229,7 @@ class AIManager:
                 "usage_data": usage_data,
                 "raw_response": str(response)
             }
-            with open("debug_response_openai.json", "w", encoding="utf-8") as f:
-                json.dump(debug_data, f, indent=2, ensure_ascii=False, default=str)
+            await asyncio.to_thread(self._save_debug_response, "openai", debug_data)
             
             # Calcular custo usando dados da API
             cost_info = self.token_usage_manager.calculate_cost_from_api_response(usage_data, model)
@@ -517,50 +1258,39 @@ class AIManager:
                 'model_used': model,
                 'provider': 'openai',
                 'error': str(e),
+                'error_retryable': erro_repetivel(e),
                 'cost_info': cost_info,
                 'display_info': display_info
             }
     
-    def _call_anthropic(self, prompt: str, model: str, max_tokens: int) -> Tuple[str, Dict]:
+    async def _call_anthropic(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                              cache_prefix: str = None) -> Tuple[str, Dict]:
         """Chama API da Anthropic e retorna resposta com informações de tokens"""
-        import json
-        from datetime import datetime
-        
         # Log detalhado para debug
         logger.debug(f"[ANTHROPIC] Iniciando chamada para modelo: {model}")
-        logger.debug(f"[ANTHROPIC] Cliente configurado: {self.anthropic_client is not None}")
-        
-        system_message = None
-        if hasattr(self, '_current_system_message'):
-            system_message = self._current_system_message
-            delattr(self, '_current_system_message')
+        logger.debug(f"[ANTHROPIC] Cliente configurado: {self.async_anthropic_client is not None}")
         
+        system, messages = self._anthropic_cached_request(prompt, system_message, cache_prefix)
         request_params = {
             "model": model,
             "max_tokens": max_tokens,
-            "messages": [
-                {"role": "user", "content": prompt}
-            ],
+            "messages": messages,
             "temperature": 0.3
         }
-        if system_message:
-            request_params["system"] = system_message
+        if system:
+            request_params["system"] = system
         
         # Log do payload (apenas em debug)
         logger.debug(f"[ANTHROPIC] Payload: {json.dumps(request_params, indent=2, ensure_ascii=False)}")
         
         try:
             logger.debug(f"[ANTHROPIC] Fazendo chamada para API...")
-            response = self.anthropic_client.messages.create(**request_params)
+            response = await self.async_anthropic_client.messages.create(**request_params)
             logger.debug(f"[ANTHROPIC] Resposta recebida com sucesso")
             response_text = response.content[0].text if response.content else ""
             usage_data = None
             if hasattr(response, 'usage') and response.usage:
-                usage_data = {
-                    'input_tokens': response.usage.input_tokens,
-                    'output_tokens': response.usage.output_tokens,
-                    'total_tokens': response.usage.input_tokens + response.usage.output_tokens
-                }
+                usage_data = self._anthropic_usage_data(response.usage)
             
             # Salvar resposta completa para debug
             debug_data = {
@@ -574,8 +1304,7 @@ class AIManager:
                 "usage_data": usage_data,
                 "raw_response": str(response)
             }
-            with open("debug_response_anthropic.json", "w", encoding="utf-8") as f:
-                json.dump(debug_data, f, indent=2, ensure_ascii=False, default=str)
+            await asyncio.to_thread(self._save_debug_response, "anthropic", debug_data)
             
             # Calcular custo usando dados da API se disponíveis
             cost_info = self.token_usage_manager.calculate_cost_from_api_response(usage_data, model) if usage_data else self.token_usage_manager.calculate_cost_from_estimation(prompt, response_text, model)
@@ -614,18 +1343,20 @@ class AIManager:
                 'model_used': model,
                 'provider': 'anthropic',
                 'error': str(e),
+                'error_retryable': erro_repetivel(e),
                 'cost_info': cost_info,
                 'display_info': display_info
             }
     
-    def _call_anthropic_streaming(self, prompt: str, model: str, max_tokens: int, system_message: str = None) -> Tuple[str, Dict]:
+    async def _call_anthropic_streaming(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                                        cache_prefix: str = None) -> Tuple[str, Dict]:
         """Chama API da Anthropic em modo streaming e retorna resposta com informações de tokens"""
         # Anthropic aceita temperature de 0.0 a 1.0 - usar 0.3 para área jurídica
         temperature = 0.3
         
         # Log detalhado para debug
         logger.debug(f"[ANTHROPIC-STREAMING] Iniciando chamada para modelo: {model}")
-        logger.debug(f"[ANTHROPIC-STREAMING] Cliente configurado: {self.anthropic_client is not None}")
+        logger.debug(f"[ANTHROPIC-STREAMING] Cliente configurado: {self.async_anthropic_client is not None}")
         
         # Log do payload para debug
         logger.debug("[ANTHROPIC-STREAMING] Payload enviado:")
@@ -637,46 +1368,46 @@ class AIManager:
             "temperature": temperature
         }))
         
-        # Preparar parâmetros da requisição
+        # Preparar parâmetros da requisição (breakpoints de cache nas instruções e nas peças)
+        system, messages = self._anthropic_cached_request(prompt, system_message, cache_prefix)
         request_params = {
             "model": model,
             "max_tokens": max_tokens,
-            "messages": [{"role": "user", "content": prompt}],
+            "messages": messages,
             "temperature": temperature,
             "stream": True
         }
         
         # Adicionar system message apenas se existir
-        if system_message:
-            request_params["system"] = system_message
+        if system:
+            request_params["system"] = system
         
         try:
             logger.debug(f"[ANTHROPIC-STREAMING] Fazendo chamada para API...")
-            response = self.anthropic_client.messages.create(**request_params)
+            response = await self.async_anthropic_client.messages.create(**request_params)
             logger.debug(f"[ANTHROPIC-STREAMING] Resposta streaming iniciada")
             full_response = ""
             usage_data = None
             
             logger.debug(f"[ANTHROPIC-STREAMING] Processando chunks da resposta...")
             chunk_count = 0
-            for chunk in response:
+            async for chunk in response:
                 chunk_count += 1
                 logger.debug(f"[ANTHROPIC-STREAMING] Chunk {chunk_count}: type={chunk.type}")
                 
-                if chunk.type == "content_block_delta":
+                if chunk.type == "message_start" and getattr(chunk.message, 'usage', None):
+                    # Tokens de entrada (e de cache) chegam no início da mensagem
+                    usage_data = self._anthropic_usage_data(chunk.message.usage)
+                elif chunk.type == "content_block_delta" and getattr(chunk.delta, 'text', None):
                     full_response += chunk.delta.text
                     logger.debug(f"[ANTHROPIC-STREAMING] Adicionado texto: {len(chunk.delta.text)} chars")
+                elif chunk.type == "message_delta" and usage_data and getattr(chunk, 'usage', None):
+                    # Tokens de saída acumulados chegam no fim da mensagem
+                    usage_data['output_tokens'] = chunk.usage.output_tokens or 0
+                    usage_data['total_tokens'] = usage_data['input_tokens'] + usage_data['output_tokens']
+                    logger.debug(f"[ANTHROPIC-STREAMING] Usage data capturado: {usage_data}")
                 elif chunk.type == "message_stop":
                     logger.debug(f"[ANTHROPIC-STREAMING] Mensagem finalizada após {chunk_count} chunks")
-                    # Capturar dados de uso no evento final
-                    if hasattr(chunk, 'usage') and chunk.usage:
-                        usage_data = {
-                            'input_tokens': chunk.usage.input_tokens,
-                            'output_tokens': chunk.usage.output_tokens,
-                            'cache_creation_input_tokens': getattr(chunk.usage, 'cache_creation_input_tokens', 0),
-                            'cache_read_input_tokens': getattr(chunk.usage, 'cache_read_input_tokens', 0)
-                        }
-                        logger.debug(f"[ANTHROPIC-STREAMING] Usage data capturado: {usage_data}")
             
             logger.debug(f"[ANTHROPIC-STREAMING] Resposta completa: {len(full_response)} caracteres")
             
@@ -730,30 +1461,22 @@ class AIManager:
                 'model_used': model,
                 'provider': 'anthropic',
                 'error': str(e),
+                'error_retryable': erro_repetivel(e),
                 'cost_info': cost_info,
                 'display_info': display_info
             }
     
-    def _call_google(self, prompt: str, model: str, max_tokens: int) -> Tuple[str, Dict]:
+    async def _call_google(self, prompt: str, model: str, max_tokens: int, system_message: str = None,
+                           cache_prefix: str = None) -> Tuple[str, Dict]:
         """Chama API do Google Gemini (nova API) e retorna resposta com informações de tokens"""
-        system_message = None
-        if hasattr(self, '_current_system_message'):
-            system_message = self._current_system_message
-            delattr(self, '_current_system_message')
-        
         temperature = 0.3
         
-        # Usar a API key armazenada na configuração
-        api_key = getattr(self, 'google_api_key', None)
-        if not api_key:
-            raise Exception("API key do Google não configurada")
-        
-        client = genai.Client(api_key=api_key)
+        # Cliente compartilhado (pool de conexões já aquecido)
+        client = self._get_google_client()
         
-        config = types.GenerateContentConfig(
-            max_output_tokens=max_tokens,
-            temperature=temperature,
-            system_instruction=system_message
+        # Casos grandes: prefixo em cached_content (criação é uma chamada síncrona, fora do loop)
+        config, contents = await asyncio.to_thread(
+            self._google_request, model, prompt, max_tokens, temperature, system_message, cache_prefix
         )
         
         # Log do payload para debug
@@ -767,10 +1490,10 @@ class AIManager:
         }))
         
         try:
-            response = client.models.generate_content(
+            response = await client.aio.models.generate_content(
                 model=model,
                 config=config,
-                contents=prompt
+                contents=contents
             )
             logger.debug(f"[Google Gemini] Resposta bruta: {response!r}")
             response_text = getattr(response, 'text', None)
@@ -790,6 +1513,7 @@ class AIManager:
                     'total_tokens': safe_int(getattr(usage_metadata, 'total_token_count', 0)),
                     'cached_content_tokens': safe_int(getattr(usage_metadata, 'cached_content_token_count', 0))
                 }
+                usage_data['cache_read_tokens'] = usage_data['cached_content_tokens']
                 logger.debug(f"[Google Gemini] Tokens capturados da API:")
                 logger.debug(f"  Input: {usage_data['input_tokens']}")
                 logger.debug(f"  Output: {usage_data['output_tokens']}")
@@ -815,8 +1539,7 @@ class AIManager:
                 "usage_data": usage_data,
                 "raw_response": str(response)
             }
-            with open("debug_response_google.json", "w", encoding="utf-8") as f:
-                json.dump(debug_data, f, indent=2, ensure_ascii=False, default=str)
+            await asyncio.to_thread(self._save_debug_response, "google", debug_data)
             
             # Se não conseguiu capturar da API, usar estimativa
             if not usage_data:
@@ -860,6 +1583,7 @@ class AIManager:
                 'model_used': model,
                 'provider': 'google',
                 'error': str(e),
+                'error_retryable': erro_repetivel(e),
                 'cost_info': cost_info,
                 'display_info': display_info
             }
@@ -1,4 +1,4 @@
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, session, Response, stream_with_context
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_sqlalchemy import SQLAlchemy
 from werkzeug.security import generate_password_hash, check_password_hash
@@ -11,15 +11,28 @@ import json
 import argparse
 import logging
 from ai_manager import ai_manager
-from models_config import get_all_models, get_model_info
+from models_config import get_all_models, get_model_info, invalidate_model_cache, calculate_cost
 import requests
 from datetime import date, timedelta
 from cryptography.fernet import Fernet
 import base64
+import hashlib
 import urllib3
-import io
-import PyPDF2
-import pdfplumber
+import threading
+import time
+from contextlib import contextmanager
+from functools import cached_property
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+import pdf_extraction
+import context_budget
+import generation_cache
+import provider_routing
+from usage_rollup import atualizar_uso_diario
+import debug_search
+import debug_storage
+from rate_limiter import RATE_LIMIT_MAX_WAIT
+from token_counting import token_counter
 from bs4 import BeautifulSoup
 
 # Carregar variáveis de ambiente
@@ -47,34 +60,56 @@ def from_json_filter(value):
     except (json.JSONDecodeError, TypeError):
         return None
 
-@app.template_filter('extract_numero_processo')
-def extract_numero_processo(request_data_json):
-    """Extrai o número do processo dos dados da requisição JSON"""
-    try:
-        import json
-        data = json.loads(request_data_json)
-        numero_processo = data.get('numero_processo', '')
-        if numero_processo:
-            # Se o número já está formatado, retornar como está
-            if '-' in numero_processo or '.' in numero_processo:
-                return numero_processo
-            # Se é só números, formatar como processo judicial
-            if numero_processo.isdigit() and len(numero_processo) >= 15:
-                # Formato: NNNNNNN-DD.AAAA.J.TT.OOOO
-                return f"{numero_processo[:7]}-{numero_processo[7:9]}.{numero_processo[9:13]}.{numero_processo[13]}.{numero_processo[14:16]}.{numero_processo[16:]}"
-            return numero_processo
-        return '-'
-    except:
+@app.template_filter('formatar_numero_processo')
+def formatar_numero_processo(numero_processo):
+    """Formata o número do processo gravado só com dígitos (DebugRequest.numero_processo)"""
+    if not numero_processo:
         return '-'
+    if len(numero_processo) >= 20:
+        # Formato: NNNNNNN-DD.AAAA.J.TT.OOOO
+        return f"{numero_processo[:7]}-{numero_processo[7:9]}.{numero_processo[9:13]}.{numero_processo[13]}.{numero_processo[14:16]}.{numero_processo[16:]}"
+    return numero_processo
 
 # Desabilitar avisos de SSL para a API do Balcão Jus
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Validade assumida para o token quando o JWT não informa "exp" (segundos)
+BALCAOJUS_TOKEN_TTL = int(os.getenv('BALCAOJUS_TOKEN_TTL', '1800'))
+# Margem para renovar o token antes de expirar (segundos)
+BALCAOJUS_TOKEN_MARGEM = 60
+# Downloads simultâneos por importação em lote e tamanho máximo do lote
+BALCAOJUS_MAX_DOWNLOADS = int(os.getenv('BALCAOJUS_MAX_DOWNLOADS', '4'))
+BALCAOJUS_MAX_PECAS_LOTE = 100
+
+class CredenciaisEprocNaoConfiguradas(Exception):
+    """Levantada quando não há credenciais ativas do eproc para autenticar no Balcão Jus"""
+    pass
+
+def _extrair_expiracao_jwt(token: str) -> float:
+    """Retorna o timestamp de expiração (claim "exp") de um JWT, ou None se não for possível ler"""
+    try:
+        payload = token.split('.')[1]
+        payload += '=' * (-len(payload) % 4)
+        claims = json.loads(base64.urlsafe_b64decode(payload.encode()))
+        exp = claims.get('exp')
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
 class BalcaoJusAPI:
-    def __init__(self):
+    def __init__(self, credentials_provider=None):
         self.base_url = "https://balcaojus.trf2.jus.br/balcaojus/api/v1"
         self.session = requests.Session()
+        # Manter conexões keep-alive abertas para reaproveitar o handshake TLS
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10)
+        self.session.mount('https://', adapter)
         self.token = None
+        self.token_expira_em = 0.0
+        # Função que retorna {'login', 'password'} quando for preciso (re)autenticar
+        self._credentials_provider = credentials_provider
+        self._credenciais = None
+        # A sessão é compartilhada pelas threads de download: só uma renova o token por vez
+        self._auth_lock = threading.Lock()
     
     def autenticar(self, username: str, password: str) -> dict:
         """Autentica no Balcão Jus e obtém token"""
@@ -90,6 +125,8 @@ class BalcaoJusAPI:
         result = response.json()
         if "id_token" in result:
             self.token = result["id_token"]
+            self.token_expira_em = _extrair_expiracao_jwt(self.token) or (time.time() + BALCAOJUS_TOKEN_TTL)
+            self._credenciais = {'login': username, 'password': password}
             self.session.headers.update({
                 "Authorization": f"Bearer {self.token}",
                 "Accept": "application/json, text/plain, */*",
@@ -98,13 +135,59 @@ class BalcaoJusAPI:
         
         return result
     
+    def token_valido(self) -> bool:
+        """Indica se o token atual ainda pode ser usado"""
+        return bool(self.token) and time.time() < self.token_expira_em - BALCAOJUS_TOKEN_MARGEM
+    
+    def garantir_autenticacao(self):
+        """Autentica apenas se não houver token válido"""
+        if self.token_valido():
+            return
+        
+        with self._auth_lock:
+            # Outra thread pode ter renovado o token enquanto esta esperava
+            if self.token_valido():
+                return
+            self._reautenticar()
+    
+    def _reautenticar(self):
+        """Faz o login com as credenciais atuais (chamar com _auth_lock adquirido)"""
+        credenciais = self._credenciais
+        if credenciais is None and self._credentials_provider:
+            credenciais = self._credentials_provider()
+        if not credenciais:
+            raise CredenciaisEprocNaoConfiguradas("Credenciais do eproc não configuradas")
+        
+        self.autenticar(credenciais['login'], credenciais['password'])
+    
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET autenticado, reautenticando uma vez se o token for recusado (401)"""
+        if self._credentials_provider or self._credenciais:
+            self.garantir_autenticacao()
+        
+        token_usado = self.token
+        response = self.session.get(url, **kwargs)
+        if response.status_code == 401 and (self._credentials_provider or self._credenciais):
+            with self._auth_lock:
+                # Só reautentica se nenhuma outra thread já trocou o token recusado
+                if self.token == token_usado or not self.token_valido():
+                    logging.getLogger(__name__).info("[BALCAOJUS] Token recusado (401), reautenticando")
+                    self.token = None
+                    if self._credentials_provider:
+                        # Buscar credenciais novamente (podem ter sido alteradas no painel)
+                        self._credenciais = None
+                    self._reautenticar()
+            response = self.session.get(url, **kwargs)
+        
+        response.raise_for_status()
+        return response
+    
     def buscar_movimentos_processo(self, numero_processo: str, sistema: str) -> dict:
         """Busca movimentos de um processo específico"""
         url = f"{self.base_url}/processo/{numero_processo}/consultar"
         params = {"sistema": sistema}
         
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
+        response = self._get(url, params=params)
         return response.json()
     
     def obter_jwt_peca(self, numero_processo: str, id_peca: str, sistema: str) -> str:
@@ -112,8 +195,7 @@ class BalcaoJusAPI:
         url = f"{self.base_url}/processo/{numero_processo}/peca/{id_peca}/pdf"
         params = {"sistema": sistema}
         
-        response = self.session.get(url, params=params)
-        response.raise_for_status()
+        response = self._get(url, params=params)
         
         result = response.json()
         return result.get("jwt")
@@ -122,9 +204,65 @@ class BalcaoJusAPI:
         """Faz download do conteúdo da peça"""
         url = f"{self.base_url}/download/{jwt}/{numero_processo}-peca-{id_peca}.pdf"
         
-        response = self.session.get(url)
-        response.raise_for_status()
+        response = self._get(url)
         return response.content
+    
+    def fechar(self):
+        """Fecha as conexões da sessão HTTP"""
+        self.session.close()
+
+class BalcaoJusSessionPool:
+    """
+    Pool de sessões autenticadas no Balcão Jus compartilhado por todo o processo.
+    
+    Cada sessão guarda o id_token até expirar e mantém conexões keep-alive, evitando
+    um login, um handshake TLS e uma descriptografia de credenciais por requisição.
+    """
+    
+    def __init__(self, credentials_provider, max_ociosas: int = 4):
+        self._credentials_provider = credentials_provider
+        self._max_ociosas = max_ociosas
+        self._ociosas = []
+        self._geracao = 0
+        self._lock = threading.Lock()
+    
+    def _obter(self):
+        with self._lock:
+            geracao = self._geracao
+            if self._ociosas:
+                return self._ociosas.pop(), geracao
+        return BalcaoJusAPI(credentials_provider=self._credentials_provider), geracao
+    
+    def _devolver(self, api, geracao, saudavel):
+        with self._lock:
+            if saudavel and geracao == self._geracao and len(self._ociosas) < self._max_ociosas:
+                self._ociosas.append(api)
+                return
+        api.fechar()
+    
+    @contextmanager
+    def sessao(self):
+        """Empresta uma sessão autenticada; ela volta ao pool ao sair do bloco"""
+        api, geracao = self._obter()
+        saudavel = False
+        try:
+            api.garantir_autenticacao()
+            yield api
+            saudavel = True
+        except requests.HTTPError:
+            # Erro da API (ex.: peça inexistente) não invalida a sessão
+            saudavel = api.token_valido()
+            raise
+        finally:
+            self._devolver(api, geracao, saudavel)
+    
+    def reset(self):
+        """Descarta todas as sessões (ex.: após alterar as credenciais do eproc)"""
+        with self._lock:
+            self._geracao += 1
+            ociosas, self._ociosas = self._ociosas, []
+        for api in ociosas:
+            api.fechar()
 
 def extrair_texto_conteudo(conteudo_bytes: bytes, formato: str = 'pdf') -> str:
     """
@@ -137,48 +275,27 @@ def extrair_texto_conteudo(conteudo_bytes: bytes, formato: str = 'pdf') -> str:
     Returns:
         Texto extraído ou mensagem de erro
     """
-    try:
-        if formato.lower() == 'pdf':
-            return extrair_texto_pdf(conteudo_bytes)
-        elif formato.lower() == 'html':
-            return extrair_texto_html(conteudo_bytes)
-        else:
-            return f"Formato não suportado: {formato}"
-    except Exception as e:
-        return f"Erro ao extrair texto: {str(e)}"
+    texto, _, _ = extrair_texto_conteudo_com_metodo(conteudo_bytes, formato)
+    return texto
 
-def extrair_texto_pdf(conteudo_bytes: bytes) -> str:
+def extrair_texto_conteudo_com_metodo(conteudo_bytes: bytes, formato: str = 'pdf') -> tuple:
     """
-    Extrai texto de um PDF usando múltiplas bibliotecas para melhor resultado
-    """
-    texto = ""
+    Extrai texto de conteúdo PDF ou HTML informando o método de extração usado
     
-    # Tentar com pdfplumber primeiro (melhor para PDFs complexos)
-    try:
-        with pdfplumber.open(io.BytesIO(conteudo_bytes)) as pdf:
-            for pagina in pdf.pages:
-                texto_pagina = pagina.extract_text()
-                if texto_pagina:
-                    texto += texto_pagina + "\n"
-        
-        if texto.strip():
-            return texto.strip()
-    except Exception as e:
-        print(f"pdfplumber falhou: {e}")
-    
-    # Fallback para PyPDF2
+    Returns:
+        Tuple[str, str, bool]: (texto extraído ou mensagem de erro, método: pypdf2, pdfplumber,
+        misto ou html, se o texto está completo: falso quando o tempo limite interrompeu a extração)
+    """
     try:
-        pdf_file = io.BytesIO(conteudo_bytes)
-        pdf_reader = PyPDF2.PdfReader(pdf_file)
-        
-        for pagina in pdf_reader.pages:
-            texto_pagina = pagina.extract_text()
-            if texto_pagina:
-                texto += texto_pagina + "\n"
-        
-        return texto.strip()
+        if formato.lower() == 'pdf':
+            texto, info = pdf_extraction.extrair_texto_pdf_detalhado(conteudo_bytes)
+            return texto, info.get('metodo'), info.get('completo', False)
+        elif formato.lower() == 'html':
+            return extrair_texto_html(conteudo_bytes), 'html', True
+        else:
+            return f"Formato não suportado: {formato}", None, False
     except Exception as e:
-        return f"Erro ao extrair texto do PDF: {str(e)}"
+        return f"Erro ao extrair texto: {str(e)}", None, False
 
 def extrair_texto_html(conteudo_bytes: bytes) -> str:
     """
@@ -382,6 +499,11 @@ class Prompt(db.Model):
     objetivo = db.Column(db.String(50), default='minuta')  # minuta, resumo, relatorio
     is_default = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    
+    __table_args__ = (
+        # get_prompts_by_objetivo (filtro por objetivo, ordem por nome)
+        db.Index('ix_prompt_objetivo_name', 'objetivo', 'name'),
+    )
 
 class UsageLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -390,12 +512,47 @@ class UsageLog(db.Model):
     tokens_used = db.Column(db.Integer, default=0)
     request_tokens = db.Column(db.Integer, default=0)
     response_tokens = db.Column(db.Integer, default=0)
+    # Parte de request_tokens lida/gravada no cache de prompt do provedor
+    cache_read_tokens = db.Column(db.Integer, default=0)
+    cache_creation_tokens = db.Column(db.Integer, default=0)
+    # Resposta reaproveitada do cache de gerações (sem chamada ao provedor nem custo)
+    cache_hit = db.Column(db.Boolean, default=False)
     model_used = db.Column(db.String(50), nullable=True)
+    # Custo em USD calculado com os preços vigentes na geração (None nos logs anteriores às colunas)
+    input_cost_usd = db.Column(db.Float, nullable=True)
+    output_cost_usd = db.Column(db.Float, nullable=True)
     success = db.Column(db.Boolean, default=True)
     error_message = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    # Função (e não valor): a data de cada log, e não a do carregamento do módulo
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
     user = db.relationship('User', backref=db.backref('logs', lazy=True))
+    
+    __table_args__ = (
+        # admin_logs (período e ordem por data) e consultas por usuário ou modelo
+        db.Index('ix_usage_log_created_at', 'created_at'),
+        db.Index('ix_usage_log_user_created', 'user_id', 'created_at'),
+        db.Index('ix_usage_log_model_created', 'model_used', 'created_at'),
+    )
+
+class UsageDaily(db.Model):
+    """Totais diários de uso por usuário, modelo e ação (ver usage_rollup.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    date = db.Column(db.Date, nullable=False, index=True)  # Dia (UTC) dos logs
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    model_used = db.Column(db.String(50), nullable=False, default='')  # '' para logs sem modelo
+    action = db.Column(db.String(100), nullable=False)
+    requests = db.Column(db.Integer, default=0)
+    requests_with_tokens = db.Column(db.Integer, default=0)
+    successful_requests = db.Column(db.Integer, default=0)
+    tokens_used = db.Column(db.Integer, default=0)
+    request_tokens = db.Column(db.Integer, default=0)
+    response_tokens = db.Column(db.Integer, default=0)
+    cost_usd = db.Column(db.Float, default=0.0)
+    
+    __table_args__ = (
+        db.UniqueConstraint('date', 'user_id', 'model_used', 'action', name='uq_usage_daily'),
+    )
 
 class AppConfig(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -467,20 +624,180 @@ class DebugRequest(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     action = db.Column(db.String(100), nullable=False)  # generate_minuta, adjust_minuta
-    request_data = db.Column(db.Text, nullable=False)  # JSON da requisição
-    response_data = db.Column(db.Text, nullable=False)  # JSON da resposta
-    prompt_used = db.Column(db.Text, nullable=True)  # Prompt final usado
+    numero_processo = db.Column(db.String(30), nullable=True)  # Apenas dígitos (extraído de request_data)
+    # Dados gravados em debug_blob (ver debug_storage.py): SHA-256 do manifesto de cada campo
+    request_blob = db.Column(db.String(64), nullable=True)  # JSON da requisição
+    response_blob = db.Column(db.String(64), nullable=True)  # JSON da resposta
+    prompt_blob = db.Column(db.String(64), nullable=True)  # Prompt final usado
+    tokens_blob = db.Column(db.String(64), nullable=True)  # JSON com info de tokens
+    # Colunas antigas, sem compressão (vazias depois da migração para debug_blob)
+    request_data_legado = db.deferred(db.Column('request_data', db.Text, nullable=False, default=''))
+    response_data_legado = db.deferred(db.Column('response_data', db.Text, nullable=False, default=''))
+    prompt_used_legado = db.deferred(db.Column('prompt_used', db.Text, nullable=True))
+    tokens_info_legado = db.deferred(db.Column('tokens_info', db.Text, nullable=True))
     model_used = db.Column(db.String(100), nullable=True)
-    tokens_info = db.Column(db.Text, nullable=True)  # JSON com info de tokens
     success = db.Column(db.Boolean, default=True)
     error_message = db.Column(db.Text, nullable=True)
-    created_at = db.Column(db.DateTime, default=datetime.now(timezone.utc))
+    # Função (e não valor): a data de cada requisição, e não a do carregamento do módulo
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
     
     user = db.relationship('User', backref=db.backref('debug_requests', lazy=True))
     
+    __table_args__ = (
+        # get_debug_requests e get_user_debug_requests (período, usuário e ordem por data)
+        db.Index('ix_debug_request_created_at', 'created_at'),
+        db.Index('ix_debug_request_user_created', 'user_id', 'created_at'),
+        db.Index('ix_debug_request_processo_created', 'numero_processo', 'created_at'),
+    )
+    
+    # Descomprimidos só quando acessados (página de detalhe), uma vez por objeto
+    @cached_property
+    def request_data(self):
+        return debug_storage.ler_json(self.request_blob) if self.request_blob else self.request_data_legado
+    
+    @cached_property
+    def response_data(self):
+        return debug_storage.ler_json(self.response_blob) if self.response_blob else self.response_data_legado
+    
+    @cached_property
+    def prompt_used(self):
+        return debug_storage.ler(self.prompt_blob) if self.prompt_blob else self.prompt_used_legado
+    
+    @cached_property
+    def tokens_info(self):
+        return debug_storage.ler_json(self.tokens_blob) if self.tokens_blob else self.tokens_info_legado
+    
     def __repr__(self):
         return f'<DebugRequest {self.action} by {self.user_id} at {self.created_at}>'
 
+class DebugBlob(db.Model):
+    """Conteúdo comprimido e deduplicado das requisições de debug (ver debug_storage.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)  # Hash do conteúdo descomprimido
+    compression = db.Column(db.String(10), nullable=False, default='zlib')
+    size = db.Column(db.Integer, default=0)  # Tamanho do conteúdo descomprimido (caracteres)
+    data = db.Column(db.LargeBinary, nullable=False)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    
+    def __repr__(self):
+        return f'<DebugBlob {self.sha256[:12]} ({self.size})>'
+
+class DocumentTextCache(db.Model):
+    """Cache do texto extraído das peças (por processo/peça e por hash do conteúdo)"""
+    id = db.Column(db.Integer, primary_key=True)
+    numero_processo = db.Column(db.String(30), nullable=False)  # Apenas dígitos
+    id_peca = db.Column(db.String(100), nullable=False)
+    sistema = db.Column(db.String(50), nullable=False)
+    content_sha256 = db.Column(db.String(64), nullable=False, index=True)  # Hash dos bytes baixados
+    formato = db.Column(db.String(10), nullable=False)  # pdf, html
+    metodo_extracao = db.Column(db.String(20), nullable=True)  # pypdf2, pdfplumber, misto, html
+    tamanho_bytes = db.Column(db.Integer, default=0)  # Tamanho do arquivo original
+    texto_extraido = db.Column(db.Text, nullable=False)
+    texto_tamanho = db.Column(db.Integer, default=0)  # Tamanho do texto (para limite do cache)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_accessed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('numero_processo', 'id_peca', 'sistema', name='uq_document_text_cache_peca'),
+    )
+    
+    def __repr__(self):
+        return f'<DocumentTextCache {self.numero_processo}/{self.id_peca}>'
+
+class DocumentSummaryCache(db.Model):
+    """Cache dos resumos de peças do modo resumido (por hash do conteúdo, modelo e prompt de resumo)"""
+    id = db.Column(db.Integer, primary_key=True)
+    content_sha256 = db.Column(db.String(64), nullable=False)  # Hash do texto da peça
+    model_used = db.Column(db.String(100), nullable=False)
+    prompt_sha256 = db.Column(db.String(64), nullable=False)  # Hash do prompt de resumo usado
+    resumo = db.Column(db.Text, nullable=False)
+    request_tokens = db.Column(db.Integer, default=0)
+    response_tokens = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    last_accessed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    
+    __table_args__ = (
+        db.UniqueConstraint('content_sha256', 'model_used', 'prompt_sha256', name='uq_document_summary_cache'),
+    )
+    
+    def __repr__(self):
+        return f'<DocumentSummaryCache {self.content_sha256[:12]} ({self.model_used})>'
+
+class GenerationCache(db.Model):
+    """Cache de respostas de geração (ver generation_cache.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    cache_key = db.Column(db.String(64), unique=True, nullable=False)  # Hash do prompt, instruções, modelo e max_tokens
+    model_used = db.Column(db.String(100), nullable=False)
+    response = db.Column(db.Text, nullable=False)
+    tokens_info = db.Column(db.Text, nullable=True)  # JSON com tokens e custo da geração original
+    response_size = db.Column(db.Integer, default=0)  # Tamanho da resposta (para limite do cache)
+    hits = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_accessed_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), index=True)
+    
+    def __repr__(self):
+        return f'<GenerationCache {self.cache_key[:12]} ({self.model_used})>'
+
+class GenerationLock(db.Model):
+    """Geração em andamento compartilhada entre processos (ver request_coalescing.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    lock_key = db.Column(db.String(64), unique=True, nullable=False)  # Mesma chave do cache de gerações
+    owner = db.Column(db.String(100), nullable=False)  # host:pid do processo que está gerando
+    status = db.Column(db.String(20), nullable=False, default='running')  # running, done, failed
+    response = db.Column(db.Text, nullable=True)
+    tokens_info = db.Column(db.Text, nullable=True)  # JSON com tokens e custo da geração
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<GenerationLock {self.lock_key[:12]} ({self.status})>'
+
+class RateLimitBucket(db.Model):
+    """Saldo de um limite de taxa (RPM ou TPM) de um provedor ou modelo (ver rate_limiter.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    bucket_key = db.Column(db.String(150), unique=True, nullable=False)  # "<provedor ou modelo>:rpm|tpm"
+    tokens = db.Column(db.Float, nullable=False)  # Saldo disponível
+    updated_at = db.Column(db.Float, nullable=False)  # Última atualização do saldo (epoch, em segundos)
+    
+    def __repr__(self):
+        return f'<RateLimitBucket {self.bucket_key}: {self.tokens:.0f}>'
+
+class GenerationJob(db.Model):
+    """Geração/ajuste executado em segundo plano pelos workers de job_worker.py"""
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    action = db.Column(db.String(20), nullable=False)  # generate, adjust
+    status = db.Column(db.String(20), nullable=False, default='queued', index=True)  # queued, running, done, error, cancelled
+    request_data = db.Column(db.Text, nullable=False)  # JSON da requisição
+    result_data = db.Column(db.Text, nullable=True)  # JSON da resposta (mesmo formato de /generate_minuta)
+    error_message = db.Column(db.Text, nullable=True)
+    cancel_requested = db.Column(db.Boolean, default=False)
+    progress_chars = db.Column(db.Integer, default=0)  # Caracteres já gerados
+    worker = db.Column(db.String(50), nullable=True)  # host:pid do worker que executa o job
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)  # Atualizado pelo worker durante a execução
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    user = db.relationship('User', backref=db.backref('generation_jobs', lazy=True))
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'action': self.action,
+            'status': self.status,
+            'progress_chars': self.progress_chars or 0,
+            'cancel_requested': bool(self.cancel_requested),
+            'error': self.error_message,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<GenerationJob {self.id} {self.action} {self.status}>'
+
 @login_manager.user_loader
 def load_user(user_id):
     return db.session.get(User, int(user_id))
@@ -534,6 +851,7 @@ def set_api_key(provider, api_key_value):
     existing = APIKey.query.filter_by(provider=provider).first()
     if existing:
         existing.api_key = api_key_value
+        existing.is_active = True
         existing.updated_at = datetime.now(timezone.utc)
     else:
         new_key = APIKey(provider=provider, api_key=api_key_value)
@@ -599,6 +917,16 @@ def set_eproc_credentials(login, password):
     )
     db.session.add(new_credentials)
     db.session.commit()
+    
+    # Sessões existentes usam as credenciais antigas
+    balcaojus_pool.reset()
+
+def _credenciais_eproc_para_pool():
+    """Fornece as credenciais do eproc ao pool do Balcão Jus (pode ser chamado fora de requisição)"""
+    with app.app_context():
+        return get_eproc_credentials()
+
+balcaojus_pool = BalcaoJusSessionPool(_credenciais_eproc_para_pool)
 
 def test_eproc_credentials(login, password):
     """Testa as credenciais do eproc (simulado por enquanto)"""
@@ -668,6 +996,7 @@ def set_model_status(model_id, is_enabled):
             model.is_enabled = is_enabled
             model.updated_at = datetime.now(timezone.utc)
             db.session.commit()
+            invalidate_model_cache()
         else:
             print(f"⚠️  Modelo {model_id} não encontrado no banco")
     except Exception as e:
@@ -856,20 +1185,204 @@ def extrair_pecas_movimentos_balcaojus(json_movimentos):
             })
     return resultado
 
+# Tamanho máximo do cache de textos extraídos (soma dos textos, em MB)
+DOCUMENT_CACHE_MAX_MB = int(os.getenv('DOCUMENT_CACHE_MAX_MB', '500'))
+
+def _resposta_texto_extraido(texto_extraido, formato, tamanho_bytes, metodo_extracao=None, em_cache=False):
+    """Monta a resposta de /api/buscar_conteudo_peca para um texto extraído"""
+    # Verificar se a extração foi bem-sucedida
+    if texto_extraido and not texto_extraido.startswith('Erro ao extrair'):
+        return {
+            'success': True,
+            'conteudo_disponivel': True,
+            'tamanho_bytes': tamanho_bytes,
+            'formato': formato.upper(),
+            'texto_extraido': texto_extraido,
+            'metodo_extracao': metodo_extracao,
+            'em_cache': em_cache,
+            'mensagem': f'Texto extraído com sucesso do {formato.upper()}.'
+        }
+    
+    # Se não conseguiu extrair texto, retornar apenas informações do arquivo
+    return {
+        'success': True,
+        'conteudo_disponivel': True,
+        'tamanho_bytes': tamanho_bytes,
+        'formato': formato.upper(),
+        'texto_extraido': '',
+        'em_cache': em_cache,
+        'mensagem': f'Arquivo {formato.upper()} obtido, mas não foi possível extrair o texto: {texto_extraido}'
+    }
+
+def buscar_texto_cache(numero_processo_limpo=None, id_peca=None, sistema=None, content_sha256=None):
+    """
+    Busca um texto extraído no cache, por processo/peça ou pelo hash do conteúdo
+    
+    Returns:
+        Dict com texto_extraido, formato e tamanho_bytes, ou None se não houver
+    """
+    try:
+        with app.app_context():
+            if content_sha256:
+                entrada = DocumentTextCache.query.filter_by(content_sha256=content_sha256).first()
+            else:
+                entrada = DocumentTextCache.query.filter_by(
+                    numero_processo=numero_processo_limpo, id_peca=str(id_peca), sistema=sistema
+                ).first()
+            
+            if not entrada:
+                return None
+            
+            # Registrar acesso para a política LRU
+            entrada.last_accessed_at = datetime.now(timezone.utc)
+            db.session.commit()
+            
+            return {
+                'texto_extraido': entrada.texto_extraido,
+                'formato': entrada.formato,
+                'metodo_extracao': entrada.metodo_extracao,
+                'tamanho_bytes': entrada.tamanho_bytes
+            }
+    except Exception as e:
+        app.logger.warning(f"Erro ao consultar cache de textos: {str(e)}")
+        return None
+
+def salvar_texto_cache(numero_processo_limpo, id_peca, sistema, content_sha256, formato, tamanho_bytes, texto_extraido, metodo_extracao=None):
+    """Grava um texto extraído no cache e remove as entradas menos usadas se passar do limite"""
+    with app.app_context():
+        try:
+            agora = datetime.now(timezone.utc)
+            entrada = DocumentTextCache.query.filter_by(
+                numero_processo=numero_processo_limpo, id_peca=str(id_peca), sistema=sistema
+            ).first()
+            if not entrada:
+                entrada = DocumentTextCache(
+                    numero_processo=numero_processo_limpo,
+                    id_peca=str(id_peca),
+                    sistema=sistema,
+                    created_at=agora
+                )
+                db.session.add(entrada)
+            
+            entrada.content_sha256 = content_sha256
+            entrada.formato = formato
+            entrada.metodo_extracao = metodo_extracao
+            entrada.tamanho_bytes = tamanho_bytes
+            entrada.texto_extraido = texto_extraido
+            entrada.texto_tamanho = len(texto_extraido.encode('utf-8'))
+            entrada.last_accessed_at = agora
+            db.session.commit()
+            
+            _aplicar_limite_cache_textos()
+        except Exception as e:
+            # Ex.: outra requisição gravou a mesma peça ao mesmo tempo
+            app.logger.warning(f"Erro ao gravar cache de textos: {str(e)}")
+            db.session.rollback()
+
+def _aplicar_limite_cache_textos():
+    """Remove as entradas acessadas há mais tempo até o cache caber em DOCUMENT_CACHE_MAX_MB"""
+    limite = DOCUMENT_CACHE_MAX_MB * 1024 * 1024
+    total = db.session.query(db.func.sum(DocumentTextCache.texto_tamanho)).scalar() or 0
+    if total <= limite:
+        return
+    
+    excedente = total - limite
+    ids_remover = []
+    for entrada_id, tamanho in db.session.query(
+        DocumentTextCache.id, DocumentTextCache.texto_tamanho
+    ).order_by(DocumentTextCache.last_accessed_at).all():
+        if excedente <= 0:
+            break
+        ids_remover.append(entrada_id)
+        excedente -= tamanho or 0
+    
+    DocumentTextCache.query.filter(DocumentTextCache.id.in_(ids_remover)).delete(synchronize_session=False)
+    db.session.commit()
+    app.logger.info(f"Cache de textos: {len(ids_remover)} entrada(s) removida(s) por limite de tamanho")
+
+def baixar_e_extrair_peca(api, numero_processo_limpo, id_peca, sistema):
+    """
+    Baixa uma peça do Balcão Jus e extrai seu texto
+    
+    Args:
+        api: BalcaoJusAPI já autenticada
+        numero_processo_limpo: Número do processo (apenas dígitos)
+        id_peca: ID da peça
+        sistema: Sistema de origem (ex.: br.jus.jfrj.eproc)
+    
+    Returns:
+        Dict no formato de resposta de /api/buscar_conteudo_peca (com 'error' em caso de falha)
+    """
+    # Peça já extraída antes (por qualquer usuário): não baixar nem processar de novo
+    em_cache = buscar_texto_cache(numero_processo_limpo, id_peca, sistema)
+    if em_cache:
+        return _resposta_texto_extraido(
+            em_cache['texto_extraido'], em_cache['formato'], em_cache['tamanho_bytes'],
+            metodo_extracao=em_cache['metodo_extracao'], em_cache=True
+        )
+    
+    # Obter JWT para download da peça com número limpo
+    jwt = api.obter_jwt_peca(numero_processo_limpo, id_peca, sistema)
+    
+    if not jwt:
+        return {'error': 'Não foi possível obter autorização para download da peça'}
+    
+    # Fazer download do conteúdo da peça com número limpo
+    conteudo_peca = api.download_peca(jwt, numero_processo_limpo, id_peca)
+    content_sha256 = hashlib.sha256(conteudo_peca).hexdigest()
+    
+    # Mesmo conteúdo já extraído em outra peça/processo: reaproveitar o texto
+    em_cache = buscar_texto_cache(content_sha256=content_sha256)
+    if em_cache:
+        formato = em_cache['formato']
+        texto_extraido = em_cache['texto_extraido']
+        metodo_extracao = em_cache['metodo_extracao']
+        completo = True
+    else:
+        # Detectar formato do conteúdo
+        formato = detectar_formato_conteudo(conteudo_peca)
+        
+        # Extrair texto do conteúdo
+        texto_extraido, metodo_extracao, completo = extrair_texto_conteudo_com_metodo(conteudo_peca, formato)
+        app.logger.info(f"Peça {id_peca} do processo {numero_processo_limpo}: texto extraído via {metodo_extracao}")
+    
+    resultado = _resposta_texto_extraido(
+        texto_extraido, formato, len(conteudo_peca),
+        metodo_extracao=metodo_extracao, em_cache=bool(em_cache)
+    )
+    
+    # Guardar apenas extrações bem-sucedidas e completas (o texto parcial de uma extração
+    # interrompida pelo tempo limite é usado agora, mas a próxima importação tenta de novo)
+    if not completo:
+        app.logger.warning(f"Peça {id_peca} do processo {numero_processo_limpo}: texto parcial, não guardado no cache")
+    elif resultado['texto_extraido']:
+        salvar_texto_cache(
+            numero_processo_limpo, id_peca, sistema, content_sha256, formato,
+            len(conteudo_peca), texto_extraido, metodo_extracao
+        )
+    
+    return resultado
+
 def save_debug_request(action, request_data, response_data, prompt_used=None, model_used=None, tokens_info=None, success=True, error_message=None):
     """Salva uma requisição de debug no banco de dados"""
     try:
         user_id = current_user.id if current_user.is_authenticated else None
         
+        # Peças e minutas da requisição e da resposta, gravadas uma vez só (também no prompt)
+        corpos = debug_storage.corpos(request_data, response_data)
+        
         # Criar nova requisição de debug (sem limitação)
         debug_request = DebugRequest(
             user_id=user_id,
             action=action,
-            request_data=json.dumps(request_data, ensure_ascii=False, indent=2),
-            response_data=json.dumps(response_data, ensure_ascii=False, indent=2),
-            prompt_used=prompt_used,
+            numero_processo=debug_search.normalizar_numero_processo(
+                request_data.get('numero_processo') if isinstance(request_data, dict) else None
+            ),
+            request_blob=debug_storage.guardar(request_data, corpos),
+            response_blob=debug_storage.guardar(response_data, corpos),
+            prompt_blob=debug_storage.guardar(prompt_used or None, corpos),
             model_used=model_used,
-            tokens_info=json.dumps(tokens_info, ensure_ascii=False, indent=2) if tokens_info else None,
+            tokens_blob=debug_storage.guardar(tokens_info or None),
             success=success,
             error_message=error_message
         )
@@ -877,6 +1390,14 @@ def save_debug_request(action, request_data, response_data, prompt_used=None, mo
         db.session.add(debug_request)
         db.session.commit()
         
+        # Índice de texto completo (falha aqui não perde a requisição já gravada)
+        try:
+            debug_search.indexar(debug_request.id, prompt_used, debug_search.texto_resposta(response_data))
+            db.session.commit()
+        except Exception as e:
+            app.logger.warning(f"Erro ao indexar debug request {debug_request.id}: {str(e)}")
+            db.session.rollback()
+        
         return debug_request.id
         
     except Exception as e:
@@ -884,56 +1405,52 @@ def save_debug_request(action, request_data, response_data, prompt_used=None, mo
         db.session.rollback()
         return None
 
-def get_debug_requests(page=1, per_page=30, start_date=None, end_date=None, user_id=None, numero_processo=None):
+def consultar_debug_requests(start_date=None, end_date=None, user_id=None, numero_processo=None, busca=None):
+    """Consulta das requisições de debug com os filtros, da mais recente para a mais antiga"""
+    query = DebugRequest.query
+    
+    # Aplicar filtros
+    if user_id:
+        query = query.filter_by(user_id=user_id)
+    
+    if start_date:
+        query = query.filter(DebugRequest.created_at >= start_date)
+    
+    if end_date:
+        # Adicionar 23:59:59 ao end_date para incluir o dia todo
+        from datetime import datetime, time
+        if isinstance(end_date, str):
+            end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
+        end_datetime = datetime.combine(end_date, time(23, 59, 59))
+        query = query.filter(DebugRequest.created_at <= end_datetime)
+    
+    # Filtro por número de processo (coluna indexada, só dígitos): completo ou pelo início
+    numero_limpo = debug_search.normalizar_numero_processo(numero_processo)
+    if numero_limpo:
+        if len(numero_limpo) >= 20:
+            query = query.filter(DebugRequest.numero_processo == numero_limpo)
+        else:
+            # ':' vem logo após '9': intervalo de todos os números que começam com os dígitos
+            query = query.filter(
+                DebugRequest.numero_processo >= numero_limpo,
+                DebugRequest.numero_processo < numero_limpo + ':'
+            )
+    
+    # Busca livre no prompt e na resposta (índice FTS5)
+    condicao_busca = debug_search.filtro_busca(busca)
+    if condicao_busca is not None:
+        query = query.filter(condicao_busca)
+    
+    # Ordenar por data decrescente
+    return query.order_by(DebugRequest.created_at.desc())
+
+def get_debug_requests(page=1, per_page=30, start_date=None, end_date=None, user_id=None, numero_processo=None, busca=None):
     """Retorna requisições de debug com paginação e filtros"""
     try:
-        query = DebugRequest.query
-        
-        # Aplicar filtros
-        if user_id:
-            query = query.filter_by(user_id=user_id)
-        
-        if start_date:
-            query = query.filter(DebugRequest.created_at >= start_date)
+        query = consultar_debug_requests(start_date, end_date, user_id, numero_processo, busca)
         
-        if end_date:
-            # Adicionar 23:59:59 ao end_date para incluir o dia todo
-            from datetime import datetime, time
-            if isinstance(end_date, str):
-                end_date = datetime.strptime(end_date, '%Y-%m-%d').date()
-            end_datetime = datetime.combine(end_date, time(23, 59, 59))
-            query = query.filter(DebugRequest.created_at <= end_datetime)
-        
-        # Filtro por número de processo
-        if numero_processo:
-            # Limpar o número (remover pontos, hífens, espaços)
-            numero_limpo = re.sub(r'[^\d]', '', numero_processo)
-            if numero_limpo:
-                # Criar diferentes variações do número para busca mais abrangente
-                condicoes_busca = []
-                
-                # 1. Buscar pelo número original (como digitado)
-                condicoes_busca.append(DebugRequest.request_data.like(f'%{numero_processo}%'))
-                
-                # 2. Buscar pelo número limpo (só números)
-                condicoes_busca.append(DebugRequest.request_data.like(f'%{numero_limpo}%'))
-                
-                # 3. Se for só números e tiver pelo menos 15 dígitos, tentar formato judicial
-                if numero_processo.isdigit() and len(numero_limpo) >= 15:
-                    # Formato: NNNNNNN-DD.AAAA.J.TT.OOOO
-                    if len(numero_limpo) >= 20:
-                        numero_formatado = f"{numero_limpo[:7]}-{numero_limpo[7:9]}.{numero_limpo[9:13]}.{numero_limpo[13]}.{numero_limpo[14:16]}.{numero_limpo[16:]}"
-                        condicoes_busca.append(DebugRequest.request_data.like(f'%{numero_formatado}%'))
-                
-                # 4. Se for formatado, também buscar só pelos números
-                if not numero_processo.isdigit():
-                    condicoes_busca.append(DebugRequest.request_data.like(f'%{numero_limpo}%'))
-                
-                # Aplicar filtro com OR entre todas as condições
-                query = query.filter(db.or_(*condicoes_busca))
-        
-        # Ordenar por data decrescente e paginar
-        paginated = query.order_by(DebugRequest.created_at.desc()).paginate(
+        # Paginar
+        paginated = query.paginate(
             page=page, per_page=per_page, error_out=False
         )
         
@@ -1020,161 +1537,778 @@ def change_password():
     
     return render_template('change_password.html')
 
+def formatar_pecas_processuais(pecas):
+    """Formata as peças processuais para o placeholder {{pecas_processuais}}"""
+    pecas_texto = ""
+    for peca in pecas:
+        nome_peca = peca.get('nome', '').strip()
+        conteudo_peca = peca.get('conteudo', '').strip()
+        
+        if nome_peca and conteudo_peca:
+            # Formatar como grupo estruturado
+            pecas_texto += f"\n{'-' * 50}\n"
+            pecas_texto += f"{nome_peca.upper()}:\n"
+            pecas_texto += f"{'-' * 50}\n"
+            pecas_texto += f"{conteudo_peca}\n"
+            pecas_texto += f"{'-' * 50}\n"
+    
+    # Se não há peças estruturadas, usar formato antigo como fallback
+    if not pecas_texto.strip():
+        for peca in pecas:
+            pecas_texto += f"\n- {peca.get('nome', '')}: {peca.get('conteudo', '')}\n"
+    
+    return pecas_texto
+
+def substituir_placeholders_prompt(prompt, data, objetivo):
+    """
+    Substitui os placeholders do prompt com os dados do formulário
+    
+    Returns:
+        Tuple[str, str]: (prompt final, prefixo do prompt até o fim das peças processuais,
+        usado como prefixo de prompt caching; None se não houver peças no prompt)
+    """
+    # Limpar número do processo (apenas números)
+    numero_processo = data.get('numero_processo', '')
+    if numero_processo:
+        numero_processo = re.sub(r'[^\d]', '', numero_processo)
+    
+    pecas_texto = formatar_pecas_processuais(data.get('pecas_processuais', []))
+    prompt_content = prompt.content
+    prompt_content = prompt_content.replace('{{numero_processo}}', numero_processo if numero_processo else 'Não informado')
+    prompt_content = prompt_content.replace('{{pecas_processuais}}', pecas_texto)
+    
+    # Placeholders específicos para minutas
+    if objetivo == 'minuta':
+        prompt_content = prompt_content.replace('{{como_decidir}}', data.get('como_decidir', ''))
+        prompt_content = prompt_content.replace('{{fundamentos}}', data.get('fundamentos', ''))
+        prompt_content = prompt_content.replace('{{vedacoes}}', data.get('vedacoes', ''))
+    else:
+        # Placeholders para outros objetivos
+        prompt_content = prompt_content.replace('{{instrucoes_adicionais}}', data.get('instrucoes_adicionais', ''))
+    
+    return prompt_content, prefixo_ate_pecas(prompt_content, pecas_texto)
+
+def prefixo_ate_pecas(prompt_content, pecas_texto):
+    """Trecho inicial do prompt que termina no fim das peças processuais (None se não houver peças)"""
+    if not pecas_texto.strip():
+        return None
+    posicao = prompt_content.find(pecas_texto)
+    if posicao < 0:
+        return None
+    return prompt_content[:posicao + len(pecas_texto)]
+
+# Modo resumido: cada peça é resumida em paralelo por um modelo mais barato e só os
+# resumos (mais as peças-chave, na íntegra) vão para o modelo que redige a minuta
+RESUMO_CONCORRENCIA = int(os.getenv('SUMMARY_CONCURRENCY', '8'))
+RESUMO_MAX_TOKENS = int(os.getenv('SUMMARY_MAX_TOKENS', '4000'))
+# Peças menores que isso seguem na íntegra (o resumo não economizaria nada)
+RESUMO_MIN_TOKENS_PECA = int(os.getenv('SUMMARY_MIN_DOCUMENT_TOKENS', '2000'))
+# Peso mínimo (context_budget.PESOS_TIPO_PECA) das peças-chave, que seguem na íntegra
+RESUMO_PESO_PECA_CHAVE = 3
+
+# Usado quando não há prompt cadastrado com objetivo "resumo"
+PROMPT_RESUMO_PADRAO = """Resuma a peça processual abaixo do processo {{numero_processo}}.
+
+{{pecas_processuais}}
+
+{{instrucoes_adicionais}}"""
+
+INSTRUCOES_RESUMO_PECA = (
+    "O resumo será usado no lugar da peça na elaboração de uma minuta. Preserve partes, pedidos, "
+    "fatos relevantes, fundamentos, datas, valores e o dispositivo (se houver). Não invente informações "
+    "e responda apenas com o resumo."
+)
+
+def get_modelo_resumo(ai_model_id):
+    """Obtém o modelo usado para resumir as peças (configurável; padrão: o próprio modelo selecionado)"""
+    modelo = get_app_config('summary_ai_model') or os.getenv('SUMMARY_AI_MODEL')
+    if modelo and get_model_status(modelo):
+        return modelo
+    return ai_model_id
+
+def get_prompt_resumo():
+    """Obtém o prompt de resumo (padrão do objetivo "resumo" ou PROMPT_RESUMO_PADRAO)"""
+    prompt = get_default_prompt_by_objetivo('resumo')
+    if not prompt:
+        prompt = Prompt.query.filter_by(objetivo='resumo').first()
+    return prompt or Prompt(content=PROMPT_RESUMO_PADRAO, objetivo='resumo')
+
+def resumir_pecas(data, ai_model_id):
+    """
+    Substitui as peças processuais grandes por resumos (modo resumido)
+    
+    Peças-chave (sentença, decisão, petição inicial) e peças pequenas seguem na íntegra.
+    As demais são resumidas em paralelo com o modelo de resumo, reaproveitando os resumos
+    já gerados para o mesmo conteúdo (cache por hash), inclusive nas rodadas de ajuste
+    
+    Returns:
+        Tuple[list, Dict]: (peças para o prompt final, informações do resumo)
+    """
+    pecas = data.get('pecas_processuais') or []
+    modelo = get_modelo_resumo(ai_model_id)
+    prompt_resumo = get_prompt_resumo()
+    prompt_sha256 = hashlib.sha256(f"{prompt_resumo.content}\n{INSTRUCOES_RESUMO_PECA}".encode('utf-8')).hexdigest()
+    info = {'modelo': modelo, 'pecas_resumidas': 0, 'resumos_em_cache': 0, 'pecas_integrais': 0, 'falhas': 0}
+    
+    # Peças a resumir: {hash do conteúdo: [índices]} (a mesma peça pode aparecer mais de uma vez)
+    a_resumir = {}
+    for indice, peca in enumerate(pecas):
+        conteudo = peca.get('conteudo', '')
+        peso, _ = context_budget.relevancia_peca(peca, indice)
+        if peso >= RESUMO_PESO_PECA_CHAVE or token_counter.count_tokens(conteudo, modelo) < RESUMO_MIN_TOKENS_PECA:
+            info['pecas_integrais'] += 1
+            continue
+        a_resumir.setdefault(hashlib.sha256(conteudo.encode('utf-8')).hexdigest(), []).append(indice)
+    
+    if not a_resumir:
+        return list(pecas), info
+    
+    resumos = {}
+    agora = datetime.now(timezone.utc)
+    for entrada in DocumentSummaryCache.query.filter(
+        DocumentSummaryCache.content_sha256.in_(list(a_resumir)),
+        DocumentSummaryCache.model_used == modelo,
+        DocumentSummaryCache.prompt_sha256 == prompt_sha256
+    ).all():
+        resumos[entrada.content_sha256] = entrada.resumo
+        entrada.last_accessed_at = agora
+    info['resumos_em_cache'] = len(resumos)
+    
+    pendentes = [content_sha256 for content_sha256 in a_resumir if content_sha256 not in resumos]
+    prompts = []
+    for content_sha256 in pendentes:
+        peca = pecas[a_resumir[content_sha256][0]]
+        prompt_peca, _ = substituir_placeholders_prompt(
+            prompt_resumo,
+            {
+                'numero_processo': data.get('numero_processo', ''),
+                'pecas_processuais': [peca],
+                'instrucoes_adicionais': INSTRUCOES_RESUMO_PECA
+            },
+            'resumo'
+        )
+        prompts.append(prompt_peca)
+    
+    resultados = ai_manager.generate_responses(prompts, modelo, max_tokens=RESUMO_MAX_TOKENS, concurrency=RESUMO_CONCORRENCIA)
+    novos_resumos = []
+    for content_sha256, (resumo, tokens_info) in zip(pendentes, resultados):
+        sucesso = bool(tokens_info.get('success')) and bool((resumo or '').strip())
+        input_cost_usd, output_cost_usd = custos_uso(tokens_info, modelo)
+        db.session.add(UsageLog(
+            user_id=current_user.id,
+            action='resumo_peca',
+            tokens_used=tokens_info.get('total_tokens', 0),
+            request_tokens=tokens_info.get('request_tokens', 0),
+            response_tokens=tokens_info.get('response_tokens', 0),
+            model_used=modelo,
+            input_cost_usd=input_cost_usd,
+            output_cost_usd=output_cost_usd,
+            success=sucesso,
+            error_message=tokens_info.get('error')
+        ))
+        if not sucesso:
+            # A peça segue na íntegra
+            info['falhas'] += 1
+            continue
+        resumos[content_sha256] = resumo.strip()
+        novos_resumos.append({
+            'content_sha256': content_sha256,
+            'model_used': modelo,
+            'prompt_sha256': prompt_sha256,
+            'resumo': resumo.strip(),
+            'request_tokens': tokens_info.get('request_tokens', 0),
+            'response_tokens': tokens_info.get('response_tokens', 0),
+            'created_at': agora,
+            'last_accessed_at': agora
+        })
+    
+    # Logs de uso gravados antes e à parte: as chamadas de resumo já foram pagas, mesmo
+    # que a gravação do cache falhe
+    try:
+        db.session.commit()
+    except Exception as e:
+        app.logger.error(f"Erro ao registrar uso dos resumos: {str(e)}")
+        db.session.rollback()
+    
+    if novos_resumos:
+        try:
+            # OR IGNORE: outra requisição pode ter gravado o mesmo resumo ao mesmo tempo
+            db.session.execute(DocumentSummaryCache.__table__.insert().prefix_with('OR IGNORE'), novos_resumos)
+            db.session.commit()
+        except Exception as e:
+            app.logger.warning(f"Erro ao gravar cache de resumos: {str(e)}")
+            db.session.rollback()
+    
+    pecas_finais = list(pecas)
+    for content_sha256, indices in a_resumir.items():
+        if content_sha256 not in resumos:
+            info['pecas_integrais'] += len(indices)
+            continue
+        for indice in indices:
+            pecas_finais[indice] = dict(pecas[indice], nome=f"{pecas[indice].get('nome', '')} (resumo)", conteudo=resumos[content_sha256])
+            info['pecas_resumidas'] += 1
+    
+    app.logger.info(
+        f"[RESUMO] {info['pecas_resumidas']} peça(s) resumida(s) com {modelo} "
+        f"({info['resumos_em_cache']} resumo(s) em cache, {info['falhas']} falha(s)), "
+        f"{info['pecas_integrais']} na íntegra"
+    )
+    return pecas_finais, info
+
+def preparar_pecas(data, ai_model_id):
+    """
+    Aplica o modo resumido às peças, se solicitado (resumir_pecas na requisição)
+    
+    Returns:
+        Tuple[Dict, Dict]: (dados com as peças do prompt final, informações do resumo ou None)
+    """
+    if not data.get('resumir_pecas'):
+        return data, None
+    pecas, info = resumir_pecas(data, ai_model_id)
+    return dict(data, pecas_processuais=pecas), info
+
+def get_politica_orcamento_contexto():
+    """Obtém a política aplicada quando o processo excede a janela de contexto do modelo"""
+    return get_app_config('context_budget_policy', context_budget.POLITICA_PADRAO)
+
+def aplicar_orcamento_contexto(data, ai_model_id, montar_prompt):
+    """
+    Ajusta as peças processuais à janela de contexto do modelo (antes da chamada ao provedor)
+    
+    Args:
+        data: Dados da requisição (com pecas_processuais)
+        ai_model_id: Modelo selecionado
+        montar_prompt: Função que recebe os dados e devolve o prompt final
+    
+    Returns:
+        Tuple[Dict, Dict, str]: (dados com as peças ajustadas, relatório do orçamento, mensagem de erro)
+    """
+    model_info = get_model_info(ai_model_id)
+    if not model_info or not model_info.get('context_window'):
+        return data, None, None
+    
+    def contar_texto(texto):
+        return token_counter.count_tokens(texto, ai_model_id)
+    
+    tokens_saida = ai_manager.resolve_output_tokens(ai_model_id, 2000)
+    limite = context_budget.limite_entrada(model_info['context_window'], tokens_saida)
+    # Tudo o que é enviado além das peças: instruções gerais (system) e o prompt montado sem peças
+    tokens_fixos = contar_texto(get_general_instructions()) + contar_texto(montar_prompt(dict(data, pecas_processuais=[])))
+    
+    try:
+        pecas, orcamento = context_budget.ajustar_pecas(
+            data.get('pecas_processuais') or [],
+            tokens_fixos,
+            limite,
+            contar_peca=lambda peca: contar_texto(formatar_pecas_processuais([peca])),
+            contar_texto=contar_texto,
+            politica=get_politica_orcamento_contexto()
+        )
+    except context_budget.OrcamentoExcedido as e:
+        app.logger.info(f"[ORÇAMENTO] Requisição rejeitada para {ai_model_id}: {e}")
+        return None, None, str(e)
+    
+    if orcamento['ajustado']:
+        app.logger.info(
+            f"[ORÇAMENTO] {ai_model_id}: {orcamento['tokens_originais']:,} -> {orcamento['tokens_estimados']:,} tokens "
+            f"(limite {limite:,}, política {orcamento['politica']}); "
+            f"{len(orcamento['pecas_omitidas'])} peça(s) omitida(s), {len(orcamento['pecas_resumidas'])} resumida(s)"
+        )
+        data = dict(data, pecas_processuais=pecas)
+    return data, orcamento, None
+
+def preparar_prompt_geracao(data):
+    """
+    Valida a requisição de geração e monta o prompt final
+    
+    Returns:
+        Tuple[Dict, str]: ({'objetivo', 'ai_model_id', 'prompt', 'prefixo_cache', 'orcamento', 'resumo_pecas'}, None)
+        ou (None, mensagem de erro)
+    """
+    # Obter o objetivo selecionado (default: minuta)
+    objetivo = data.get('objetivo', 'minuta')
+    
+    # Validação dos campos obrigatórios
+    if not data.get('pecas_processuais') or len(data['pecas_processuais']) == 0:
+        return None, 'Pelo menos uma peça processual é obrigatória.'
+    
+    # Validação específica para minutas
+    if objetivo == 'minuta' and not data.get('como_decidir'):
+        return None, 'O campo "Como decidir" é obrigatório para minutas.'
+    
+    # Obter o prompt selecionado
+    prompt_id = data.get('prompt_id')
+    if prompt_id:
+        prompt = db.session.get(Prompt, int(prompt_id))
+    else:
+        # Buscar prompt padrão do objetivo específico
+        prompt = get_default_prompt_by_objetivo(objetivo)
+        if not prompt:
+            # Fallback para prompt padrão geral
+            prompt = Prompt.query.filter_by(is_default=True).first()
+    
+    if not prompt:
+        return None, f'Nenhum prompt encontrado para o objetivo "{objetivo}".'
+    
+    # Usar o modelo de IA selecionado pelo usuário
+    ai_model_id = data.get('ai_model_id')
+    if not ai_model_id:
+        return None, 'Modelo de IA não selecionado.'
+    
+    # Verificar se o modelo está habilitado
+    if not get_model_status(ai_model_id):
+        return None, f'Modelo {ai_model_id} não está habilitado no sistema.'
+    
+    # Modo resumido e ajuste das peças à janela de contexto do modelo antes de chamar o provedor
+    dados_prompt, resumo_pecas = preparar_pecas(data, ai_model_id)
+    dados_prompt, orcamento, erro = aplicar_orcamento_contexto(
+        dados_prompt, ai_model_id, lambda dados: substituir_placeholders_prompt(prompt, dados, objetivo)[0]
+    )
+    if erro:
+        return None, erro
+    
+    prompt_content, prefixo_cache = substituir_placeholders_prompt(prompt, dados_prompt, objetivo)
+    return {'objetivo': objetivo, 'ai_model_id': ai_model_id, 'prompt': prompt_content, 'prefixo_cache': prefixo_cache,
+            'orcamento': orcamento, 'resumo_pecas': resumo_pecas}, None
+
+def preparar_prompt_ajuste(data):
+    """
+    Valida a requisição de ajuste e monta o prompt final (prompt original + minuta + pedido)
+    
+    Returns:
+        Tuple[Dict, str]: ({'objetivo', 'ai_model_id', 'prompt', 'prefixo_cache', 'orcamento', 'resumo_pecas'}, None)
+        ou (None, mensagem de erro)
+    """
+    # Obter o objetivo selecionado (default: minuta)
+    objetivo = data.get('objetivo', 'minuta')
+    
+    # Validação dos campos obrigatórios
+    if not data.get('adjustment_prompt'):
+        return None, 'O prompt de ajuste é obrigatório.'
+    
+    if not data.get('current_content'):
+        return None, 'O conteúdo atual é obrigatório.'
+    
+    # Obter o modelo de IA selecionado
+    ai_model_id = data.get('model_id')
+    if not ai_model_id:
+        return None, 'Modelo de IA não selecionado.'
+    
+    # Verificar se o modelo está habilitado
+    if not get_model_status(ai_model_id):
+        return None, f'Modelo {ai_model_id} não está habilitado no sistema.'
+    
+    # Obter o prompt original usado na primeira geração
+    original_prompt_id = data.get('prompt_id')
+    if original_prompt_id:
+        original_prompt = db.session.get(Prompt, int(original_prompt_id))
+    else:
+        # Fallback: usar prompt padrão do objetivo
+        original_prompt = get_default_prompt_by_objetivo(objetivo)
+        if not original_prompt:
+            original_prompt = Prompt.query.filter_by(is_default=True).first()
+        if not original_prompt:
+            original_prompt = Prompt.query.first()
+    
+    if not original_prompt:
+        return None, f'Nenhum prompt original encontrado para o objetivo "{objetivo}".'
+    
+    prompt_ajuste = get_adjustment_prompt()
+    
+    def montar_prompt(dados):
+        # Reconstruir o prompt original com substituição de placeholders
+        prompt_original_content, prefixo_original = substituir_placeholders_prompt(original_prompt, dados, objetivo)
+        
+        # Substituir placeholders no prompt de ajuste da configuração
+        adjustment_prompt = prompt_ajuste.replace('{{PROMPT_ORIGINAL}}', prompt_original_content)
+        adjustment_prompt = adjustment_prompt.replace('{{MINUTA}}', dados.get('current_content', ''))
+        adjustment_prompt = adjustment_prompt.replace('{{PEDIDO_DE_AJUSTE}}', dados.get('adjustment_prompt', ''))
+        
+        # Com o prompt de ajuste padrão ({{PROMPT_ORIGINAL}} primeiro), o prefixo é o mesmo da
+        # geração e de todas as rodadas de ajuste: as peças não são reprocessadas pelo provedor
+        prefixo_cache = None
+        if prefixo_original:
+            prefixo_cache = prefixo_ate_pecas(adjustment_prompt, prefixo_original)
+        return adjustment_prompt, prefixo_cache
+    
+    # Modo resumido (os resumos da geração vêm do cache) e ajuste das peças à janela de
+    # contexto (a minuta atual e o pedido também ocupam espaço)
+    dados_prompt, resumo_pecas = preparar_pecas(data, ai_model_id)
+    dados_prompt, orcamento, erro = aplicar_orcamento_contexto(dados_prompt, ai_model_id, lambda dados: montar_prompt(dados)[0])
+    if erro:
+        return None, erro
+    
+    adjustment_prompt, prefixo_cache = montar_prompt(dados_prompt)
+    return {'objetivo': objetivo, 'ai_model_id': ai_model_id, 'prompt': adjustment_prompt, 'prefixo_cache': prefixo_cache,
+            'orcamento': orcamento, 'resumo_pecas': resumo_pecas}, None
+
+def tokens_cache_prompt(tokens_info):
+    """Retorna (tokens lidos do cache, tokens gravados no cache) informados pelo provedor"""
+    usage_data = (tokens_info or {}).get('usage_data') or {}
+    return usage_data.get('cache_read_tokens', 0) or 0, usage_data.get('cache_creation_tokens', 0) or 0
+
+def ler_periodo_filtros():
+    """
+    Lê o período dos filtros da URL (start_date e end_date no formato AAAA-MM-DD)
+    
+    Returns:
+        Tuple[date, date]: datas inicial e final (None quando ausentes ou inválidas)
+    """
+    datas = {}
+    for campo, rotulo in (('start_date', 'inicial'), ('end_date', 'final')):
+        datas[campo] = None
+        valor = request.args.get(campo)
+        if valor:
+            try:
+                datas[campo] = datetime.strptime(valor, '%Y-%m-%d').date()
+            except ValueError:
+                flash(f'Data {rotulo} inválida. Use o formato AAAA-MM-DD.', 'error')
+    
+    if datas['start_date'] and datas['end_date'] and datas['start_date'] > datas['end_date']:
+        flash('A data inicial não pode ser posterior à data final.', 'error')
+        return None, None
+    return datas['start_date'], datas['end_date']
+
+def custos_uso(tokens_info, model_id):
+    """
+    Retorna o custo em USD (entrada, saída) de uma geração, gravado no UsageLog com os
+    preços vigentes (alterar o preço do modelo depois não muda o histórico)
+    """
+    if not tokens_info:
+        return 0.0, 0.0
+    cost_info = tokens_info.get('cost_info') or {}
+    if 'input_cost' not in cost_info:
+        cost_info = calculate_cost(tokens_info.get('request_tokens', 0) or 0, tokens_info.get('response_tokens', 0) or 0, model_id) if model_id else {}
+    return cost_info.get('input_cost', 0) or 0.0, cost_info.get('output_cost', 0) or 0.0
+
+def montar_resposta_geracao(resultado, tokens_info, ai_model_id, objetivo, orcamento=None):
+    """Monta o JSON de resposta de uma geração/ajuste"""
+    cache_read_tokens, cache_creation_tokens = tokens_cache_prompt(tokens_info)
+    response_data = {
+        'resultado': resultado,  # Nome genérico para compatibilidade
+        'tokens_info': {
+            'request_tokens': tokens_info.get('request_tokens', 0) if tokens_info else 0,
+            'response_tokens': tokens_info.get('response_tokens', 0) if tokens_info else 0,
+            'total_tokens': tokens_info.get('total_tokens', 0) if tokens_info else 0,
+            'model_used': tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id,
+            'success': tokens_info.get('success', False) if tokens_info else False,
+            'cache_read_tokens': cache_read_tokens,
+            'cache_creation_tokens': cache_creation_tokens,
+            'cache_hit': tokens_info.get('cache_hit', False) if tokens_info else False,
+            'coalesced': tokens_info.get('coalesced', False) if tokens_info else False
+        },
+        'cost_info': tokens_info.get('display_info', {}) if tokens_info else {},
+        'user_cost': format_cost_for_user(tokens_info.get('cost_info', {}).get('total_cost', 0) if tokens_info else 0)
+    }
+    
+    # Peças omitidas/resumidas para caber na janela de contexto do modelo
+    if orcamento and orcamento.get('ajustado'):
+        response_data['orcamento_contexto'] = {
+            'politica': orcamento['politica'],
+            'pecas_omitidas': orcamento['pecas_omitidas'],
+            'pecas_resumidas': orcamento['pecas_resumidas']
+        }
+    
+    # Resposta gerada por um modelo da cadeia de fallback (o modelo pedido falhou)
+    roteamento = (tokens_info or {}).get('routing') or {}
+    if roteamento.get('fallback'):
+        response_data['fallback_modelo'] = {
+            'modelo_pedido': roteamento['requested_model'],
+            'modelo_usado': tokens_info.get('model_used')
+        }
+    
+    # Manter compatibilidade com código existente
+    if objetivo == 'minuta':
+        response_data['minuta'] = resultado
+    
+    return response_data
+
+def registrar_geracao(action, data, response_data, prompt_used, ai_model_id, tokens_info):
+    """Salva o debug request e o log de uso de uma geração/ajuste"""
+    save_debug_request(
+        action=action,
+        request_data=data,
+        response_data=response_data,
+        prompt_used=prompt_used,
+        model_used=ai_model_id,
+        tokens_info=tokens_info,
+        success=tokens_info.get('success', False) if tokens_info else False,
+        error_message=tokens_info.get('error') if tokens_info else None
+    )
+    
+    # Log de uso detalhado
+    cache_read_tokens, cache_creation_tokens = tokens_cache_prompt(tokens_info)
+    model_used = tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id
+    input_cost_usd, output_cost_usd = custos_uso(tokens_info, model_used)
+    log = UsageLog(
+        user_id=current_user.id,
+        action=action,
+        tokens_used=tokens_info.get('total_tokens', 0) if tokens_info else 0,
+        request_tokens=tokens_info.get('request_tokens', 0) if tokens_info else 0,
+        response_tokens=tokens_info.get('response_tokens', 0) if tokens_info else 0,
+        cache_read_tokens=cache_read_tokens,
+        cache_creation_tokens=cache_creation_tokens,
+        cache_hit=tokens_info.get('cache_hit', False) if tokens_info else False,
+        model_used=model_used,
+        input_cost_usd=input_cost_usd,
+        output_cost_usd=output_cost_usd,
+        success=tokens_info.get('success', False) if tokens_info else False,
+        error_message=tokens_info.get('error') if tokens_info else None
+    )
+    db.session.add(log)
+    db.session.commit()
+
+def registrar_erro_geracao(action, data, erro):
+    """Salva o debug request e o log de uso de uma geração/ajuste que falhou"""
+    db.session.rollback()
+    error_response = {'error': str(erro)}
+    save_debug_request(
+        action=action,
+        request_data=data or {},
+        response_data=error_response,
+        success=False,
+        error_message=str(erro)
+    )
+    
+    # Log de erro
+    log = UsageLog(
+        user_id=current_user.id,
+        action=action,
+        tokens_used=0,
+        input_cost_usd=0.0,
+        output_cost_usd=0.0,
+        success=False,
+        error_message=str(erro)
+    )
+    db.session.add(log)
+    db.session.commit()
+    return error_response
+
+def evento_sse(evento, dados):
+    """Formata um evento Server-Sent Events"""
+    return f"event: {evento}\ndata: {json.dumps(dados, ensure_ascii=False)}\n\n"
+
+def eventos_geracao(action, data, contexto, motivo_interrupcao='Streaming interrompido pelo cliente'):
+    """
+    Gera a resposta do modelo em streaming e registra o uso
+    
+    Yields:
+        Tuple[str, Dict]: ('delta', {"text": trecho}) a cada trecho recebido do provedor,
+        ('done', mesmo JSON de /generate_minuta e /adjust_minuta) ou ('error', {"error": mensagem})
+    
+    O uso é registrado ao final; se o consumidor fechar o gerador antes (cliente desconectou,
+    job cancelado), registra o uso estimado do que já foi gerado com motivo_interrupcao
+    e fecha a conexão com o provedor
+    """
+    ai_model_id = contexto['ai_model_id']
+    prompt_content = contexto['prompt']
+    
+    eventos = ai_manager.generate_response_stream(
+        prompt=prompt_content,
+        model=ai_model_id,
+        max_tokens=2000,
+        cache_prefix=contexto.get('prefixo_cache'),
+        use_cache=not data.get('ignorar_cache'),
+        objetivo=contexto['objetivo']
+    )
+    texto_parcial = ""
+    finalizado = False
+    try:
+        for evento in eventos:
+            if evento['type'] == 'delta':
+                texto_parcial += evento['text']
+                yield 'delta', {'text': evento['text']}
+            elif evento['type'] == 'done':
+                finalizado = True
+                tokens_info = evento['tokens_info']
+                response_data = montar_resposta_geracao(evento['response'], tokens_info, ai_model_id, contexto['objetivo'], contexto.get('orcamento'))
+                registrar_geracao(action, data, response_data, prompt_content, ai_model_id, tokens_info)
+                yield 'done', response_data
+    except Exception as e:
+        finalizado = True
+        yield 'error', registrar_erro_geracao(action, data, e)
+    finally:
+        if not finalizado:
+            # Consumidor parou no meio da geração
+            eventos.close()
+            tokens_info = ai_manager.build_stream_tokens_info(
+                prompt_content, texto_parcial, ai_model_id,
+                error=motivo_interrupcao
+            )
+            response_data = montar_resposta_geracao(texto_parcial, tokens_info, ai_model_id, contexto['objetivo'], contexto.get('orcamento'))
+            registrar_geracao(action, data, response_data, prompt_content, ai_model_id, tokens_info)
+
+def resposta_sse_geracao(action, data, contexto):
+    """
+    Gera a resposta do modelo em streaming (text/event-stream)
+    
+    Eventos enviados (ver eventos_geracao):
+        delta: {"text": trecho} a cada trecho recebido do provedor
+        done: mesmo JSON de /generate_minuta e /adjust_minuta
+        error: {"error": mensagem}
+    """
+    def gerar():
+        eventos = eventos_geracao(action, data, contexto)
+        try:
+            for evento, dados in eventos:
+                yield evento_sse(evento, dados)
+        finally:
+            # Cliente desconectou: registra o uso parcial e fecha a conexão com o provedor
+            eventos.close()
+    
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 @app.route('/generate_minuta', methods=['POST'])
 @login_required
 def generate_minuta():
     try:
         data = request.get_json()
         
-        # Obter o objetivo selecionado (default: minuta)
-        objetivo = data.get('objetivo', 'minuta')
-        
-        # Validação dos campos obrigatórios
-        if not data.get('pecas_processuais') or len(data['pecas_processuais']) == 0:
-            return jsonify({'error': 'Pelo menos uma peça processual é obrigatória.'}), 400
-        
-        # Validação específica para minutas
-        if objetivo == 'minuta' and not data.get('como_decidir'):
-            return jsonify({'error': 'O campo "Como decidir" é obrigatório para minutas.'}), 400
-        
-        # Limpar número do processo (apenas números)
-        numero_processo = data.get('numero_processo', '')
-        if numero_processo:
-            numero_processo = re.sub(r'[^\d]', '', numero_processo)
-        
-        # Obter o prompt selecionado
-        prompt_id = data.get('prompt_id')
-        if prompt_id:
-            prompt = db.session.get(Prompt, int(prompt_id))
-        else:
-            # Buscar prompt padrão do objetivo específico
-            prompt = get_default_prompt_by_objetivo(objetivo)
-            if not prompt:
-                # Fallback para prompt padrão geral
-                prompt = Prompt.query.filter_by(is_default=True).first()
-        
-        if not prompt:
-            return jsonify({'error': f'Nenhum prompt encontrado para o objetivo "{objetivo}".'}), 400
-        
-        # Usar o modelo de IA selecionado pelo usuário
-        ai_model_id = data.get('ai_model_id')
-        if not ai_model_id:
-            return jsonify({'error': 'Modelo de IA não selecionado.'}), 400
-        
-        # Verificar se o modelo está habilitado
-        if not get_model_status(ai_model_id):
-            return jsonify({'error': f'Modelo {ai_model_id} não está habilitado no sistema.'}), 400
-        
-        # Preparar dados para o prompt
-        pecas_texto = ""
-        for peca in data.get('pecas_processuais', []):
-            nome_peca = peca.get('nome', '').strip()
-            conteudo_peca = peca.get('conteudo', '').strip()
-            
-            if nome_peca and conteudo_peca:
-                # Formatar como grupo estruturado
-                pecas_texto += f"\n{'-' * 50}\n"
-                pecas_texto += f"{nome_peca.upper()}:\n"
-                pecas_texto += f"{'-' * 50}\n"
-                pecas_texto += f"{conteudo_peca}\n"
-                pecas_texto += f"{'-' * 50}\n"
-        
-        # Se não há peças estruturadas, usar formato antigo como fallback
-        if not pecas_texto.strip():
-            for peca in data.get('pecas_processuais', []):
-                pecas_texto += f"\n- {peca.get('nome', '')}: {peca.get('conteudo', '')}\n"
-        
-        # Substituir placeholders no prompt
-        prompt_content = prompt.content
-        prompt_content = prompt_content.replace('{{numero_processo}}', numero_processo if numero_processo else 'Não informado')
-        prompt_content = prompt_content.replace('{{pecas_processuais}}', pecas_texto)
-        
-        # Placeholders específicos para minutas
-        if objetivo == 'minuta':
-            prompt_content = prompt_content.replace('{{como_decidir}}', data.get('como_decidir', ''))
-            prompt_content = prompt_content.replace('{{fundamentos}}', data.get('fundamentos', ''))
-            prompt_content = prompt_content.replace('{{vedacoes}}', data.get('vedacoes', ''))
-        else:
-            # Placeholders para outros objetivos
-            prompt_content = prompt_content.replace('{{instrucoes_adicionais}}', data.get('instrucoes_adicionais', ''))
+        contexto, erro = preparar_prompt_geracao(data)
+        if erro:
+            return jsonify({'error': erro}), 400
         
         # Gerar resposta usando IA com o modelo selecionado
         resultado, tokens_info = ai_manager.generate_response(
-            prompt=prompt_content,
-            model=ai_model_id,
-            max_tokens=2000
+            prompt=contexto['prompt'],
+            model=contexto['ai_model_id'],
+            max_tokens=2000,
+            cache_prefix=contexto['prefixo_cache'],
+            use_cache=not data.get('ignorar_cache'),
+            objetivo=contexto['objetivo']
         )
         
         # Preparar resposta
-        response_data = {
-            'resultado': resultado,  # Nome genérico para compatibilidade
-            'tokens_info': {
-                'request_tokens': tokens_info.get('request_tokens', 0) if tokens_info else 0,
-                'response_tokens': tokens_info.get('response_tokens', 0) if tokens_info else 0,
-                'total_tokens': tokens_info.get('total_tokens', 0) if tokens_info else 0,
-                'model_used': tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id,
-                'success': tokens_info.get('success', False) if tokens_info else False
-            },
-            'cost_info': tokens_info.get('display_info', {}) if tokens_info else {},
-            'user_cost': format_cost_for_user(tokens_info.get('cost_info', {}).get('total_cost', 0) if tokens_info else 0)
-        }
-        
-        # Manter compatibilidade com código existente
-        if objetivo == 'minuta':
-            response_data['minuta'] = resultado
-        
-        # Salvar debug request
-        save_debug_request(
-            action=f'generate_{objetivo}',
-            request_data=data,
-            response_data=response_data,
-            prompt_used=prompt_content,
-            model_used=ai_model_id,
-            tokens_info=tokens_info,
-            success=tokens_info.get('success', False) if tokens_info else False,
-            error_message=tokens_info.get('error') if tokens_info else None
-        )
-        
-        # Log de uso detalhado
-        log = UsageLog(
-            user_id=current_user.id,
-            action=f'generate_{objetivo}',
-            tokens_used=tokens_info.get('total_tokens', 0) if tokens_info else 0,
-            request_tokens=tokens_info.get('request_tokens', 0) if tokens_info else 0,
-            response_tokens=tokens_info.get('response_tokens', 0) if tokens_info else 0,
-            model_used=tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id,
-            success=tokens_info.get('success', False) if tokens_info else False,
-            error_message=tokens_info.get('error') if tokens_info else None
-        )
-        db.session.add(log)
-        db.session.commit()
+        response_data = montar_resposta_geracao(resultado, tokens_info, contexto['ai_model_id'], contexto['objetivo'], contexto.get('orcamento'))
+        registrar_geracao(f"generate_{contexto['objetivo']}", data, response_data, contexto['prompt'], contexto['ai_model_id'], tokens_info)
         
         return jsonify(response_data)
         
     except Exception as e:
-        # Salvar debug request de erro
-        error_response = {'error': str(e)}
-        save_debug_request(
-            action=f'generate_{data.get("objetivo", "minuta")}',
-            request_data=data if 'data' in locals() else {},
-            response_data=error_response,
-            success=False,
-            error_message=str(e)
-        )
-        
-        # Log de erro
-        log = UsageLog(
-            user_id=current_user.id,
-            action=f'generate_{data.get("objetivo", "minuta")}',
-            tokens_used=0,
-            success=False,
-            error_message=str(e)
+        error_response = registrar_erro_geracao(
+            f'generate_{data.get("objetivo", "minuta")}',
+            data if 'data' in locals() else {},
+            e
         )
-        db.session.add(log)
-        db.session.commit()
-        
         return jsonify(error_response), 500
 
+@app.route('/generate_minuta/stream', methods=['POST'])
+@login_required
+def generate_minuta_stream():
+    """Versão em streaming (SSE) de /generate_minuta"""
+    data = request.get_json()
+    
+    contexto, erro = preparar_prompt_geracao(data)
+    if erro:
+        return jsonify({'error': erro}), 400
+    
+    return resposta_sse_geracao(f"generate_{contexto['objetivo']}", data, contexto)
+
+# Comparação entre modelos: máximo de modelos por requisição e prazo para todos terminarem
+FANOUT_MAX_MODELOS = int(os.getenv('FANOUT_MAX_MODELS', '4'))
+FANOUT_PRAZO_SEGUNDOS = int(os.getenv('FANOUT_DEADLINE_SECONDS', '240'))
+# Prazo mínimo aceito do cliente (prazo zero ou negativo cancelaria todas as gerações na hora)
+FANOUT_PRAZO_MINIMO = 1.0
+
+def limite_entrada_modelo(ai_model_id):
+    """Tokens de entrada disponíveis na janela de contexto do modelo (None se desconhecido)"""
+    model_info = get_model_info(ai_model_id)
+    if not model_info or not model_info.get('context_window'):
+        return None
+    return context_budget.limite_entrada(model_info['context_window'], ai_manager.resolve_output_tokens(ai_model_id, 2000))
+
+def preparar_prompt_comparacao(data):
+    """
+    Valida a comparação entre modelos e monta um único prompt para todos
+    
+    O prompt é ajustado à janela de contexto do modelo com menos espaço de entrada,
+    para caber em todos os modelos escolhidos
+    
+    Returns:
+        Tuple[Dict, str]: (contexto de preparar_prompt_geracao com 'ai_model_ids', None)
+        ou (None, mensagem de erro)
+    """
+    ai_model_ids = list(dict.fromkeys(data.get('ai_model_ids') or []))
+    if len(ai_model_ids) < 2:
+        return None, 'Selecione pelo menos dois modelos para comparar.'
+    if len(ai_model_ids) > FANOUT_MAX_MODELOS:
+        return None, f'Selecione no máximo {FANOUT_MAX_MODELOS} modelos para comparar.'
+    
+    for ai_model_id in ai_model_ids:
+        if not get_model_status(ai_model_id):
+            return None, f'Modelo {ai_model_id} não está habilitado no sistema.'
+    
+    limites = {ai_model_id: limite_entrada_modelo(ai_model_id) for ai_model_id in ai_model_ids}
+    conhecidos = [ai_model_id for ai_model_id in ai_model_ids if limites[ai_model_id] is not None]
+    modelo_base = min(conhecidos, key=lambda ai_model_id: limites[ai_model_id]) if conhecidos else ai_model_ids[0]
+    
+    contexto, erro = preparar_prompt_geracao(dict(data, ai_model_id=modelo_base))
+    if erro:
+        return None, erro
+    contexto['ai_model_ids'] = ai_model_ids
+    return contexto, None
+
+@app.route('/generate_minuta/fanout', methods=['POST'])
+@login_required
+def generate_minuta_fanout():
+    """
+    Gera a minuta com vários modelos em paralelo, para comparação (text/event-stream)
+    
+    Eventos enviados:
+        draft: JSON de /generate_minuta com model_id, assim que cada modelo termina
+        timeout: {"model_id", "error"} para cada modelo cancelado pelo prazo
+        done: {"concluidos": [...], "cancelados": [...]}
+        error: {"error": mensagem}
+    """
+    data = request.get_json()
+    
+    contexto, erro = preparar_prompt_comparacao(data)
+    if erro:
+        return jsonify({'error': erro}), 400
+    
+    try:
+        prazo = max(FANOUT_PRAZO_MINIMO, min(float(data.get('prazo_segundos') or FANOUT_PRAZO_SEGUNDOS), FANOUT_PRAZO_SEGUNDOS))
+    except (TypeError, ValueError):
+        prazo = FANOUT_PRAZO_SEGUNDOS
+    action = f"generate_{contexto['objetivo']}"
+    
+    def gerar():
+        resultados = ai_manager.generate_responses_models(
+            contexto['prompt'], contexto['ai_model_ids'], max_tokens=2000,
+            cache_prefix=contexto['prefixo_cache'], deadline=prazo
+        )
+        concluidos, cancelados = [], []
+        try:
+            for ai_model_id, resultado, tokens_info in resultados:
+                response_data = montar_resposta_geracao(resultado, tokens_info, ai_model_id, contexto['objetivo'], contexto.get('orcamento'))
+                response_data['model_id'] = ai_model_id
+                registrar_geracao(action, dict(data, ai_model_id=ai_model_id), response_data, contexto['prompt'], ai_model_id, tokens_info)
+                
+                if tokens_info.get('deadline_exceeded'):
+                    cancelados.append(ai_model_id)
+                    yield evento_sse('timeout', {'model_id': ai_model_id, 'error': tokens_info['error']})
+                else:
+                    concluidos.append(ai_model_id)
+                    yield evento_sse('draft', response_data)
+            
+            app.logger.info(f"[FANOUT] {len(concluidos)} modelo(s) concluído(s), {len(cancelados)} cancelado(s) pelo prazo de {prazo:.0f}s")
+            yield evento_sse('done', {'concluidos': concluidos, 'cancelados': cancelados})
+        except Exception as e:
+            yield evento_sse('error', registrar_erro_geracao(action, data, e))
+        finally:
+            # Cliente desconectou: cancelar as gerações que ainda não terminaram
+            resultados.close()
+    
+    return Response(
+        stream_with_context(gerar()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
 def get_adjustment_prompt():
     """Obtém o prompt de ajuste da configuração"""
     default_prompt = """{{PROMPT_ORIGINAL}}
@@ -1198,163 +2332,138 @@ def adjust_minuta():
     try:
         data = request.get_json()
         
-        # Obter o objetivo selecionado (default: minuta)
-        objetivo = data.get('objetivo', 'minuta')
-        
-        # Validação dos campos obrigatórios
-        if not data.get('adjustment_prompt'):
-            return jsonify({'error': 'O prompt de ajuste é obrigatório.'}), 400
-        
-        if not data.get('current_content'):
-            return jsonify({'error': 'O conteúdo atual é obrigatório.'}), 400
-        
-        # Obter o modelo de IA selecionado
-        ai_model_id = data.get('model_id')
-        if not ai_model_id:
-            return jsonify({'error': 'Modelo de IA não selecionado.'}), 400
-        
-        # Verificar se o modelo está habilitado
-        if not get_model_status(ai_model_id):
-            return jsonify({'error': f'Modelo {ai_model_id} não está habilitado no sistema.'}), 400
-        
-        # Obter o prompt original usado na primeira geração
-        original_prompt_id = data.get('prompt_id')
-        if original_prompt_id:
-            original_prompt = db.session.get(Prompt, int(original_prompt_id))
-        else:
-            # Fallback: usar prompt padrão do objetivo
-            original_prompt = get_default_prompt_by_objetivo(objetivo)
-            if not original_prompt:
-                original_prompt = Prompt.query.filter_by(is_default=True).first()
-            if not original_prompt:
-                original_prompt = Prompt.query.first()
-        
-        if not original_prompt:
-            return jsonify({'error': f'Nenhum prompt original encontrado para o objetivo "{objetivo}".'}), 400
-        
-        # Reconstruir o prompt original com os dados
-        numero_processo = data.get('numero_processo', '')
-        if numero_processo:
-            numero_processo = re.sub(r'[^\d]', '', numero_processo)
-        
-        # Preparar peças processuais para o prompt original
-        pecas_texto_original = ""
-        for peca in data.get('pecas_processuais', []):
-            nome_peca = peca.get('nome', '').strip()
-            conteudo_peca = peca.get('conteudo', '').strip()
-            
-            if nome_peca and conteudo_peca:
-                # Formatar como grupo estruturado
-                pecas_texto_original += f"\n{'-' * 50}\n"
-                pecas_texto_original += f"{nome_peca.upper()}:\n"
-                pecas_texto_original += f"{'-' * 50}\n"
-                pecas_texto_original += f"{conteudo_peca}\n"
-                pecas_texto_original += f"{'-' * 50}\n"
-        
-        # Se não há peças estruturadas, usar formato antigo como fallback
-        if not pecas_texto_original.strip():
-            for peca in data.get('pecas_processuais', []):
-                pecas_texto_original += f"\n- {peca.get('nome', '')}: {peca.get('conteudo', '')}\n"
-        
-        # Reconstruir o prompt original com substituição de placeholders
-        prompt_original_content = original_prompt.content
-        prompt_original_content = prompt_original_content.replace('{{numero_processo}}', numero_processo if numero_processo else 'Não informado')
-        prompt_original_content = prompt_original_content.replace('{{pecas_processuais}}', pecas_texto_original)
-        
-        # Placeholders específicos por objetivo
-        if objetivo == 'minuta':
-            prompt_original_content = prompt_original_content.replace('{{como_decidir}}', data.get('como_decidir', ''))
-            prompt_original_content = prompt_original_content.replace('{{fundamentos}}', data.get('fundamentos', ''))
-            prompt_original_content = prompt_original_content.replace('{{vedacoes}}', data.get('vedacoes', ''))
-        else:
-            prompt_original_content = prompt_original_content.replace('{{instrucoes_adicionais}}', data.get('instrucoes_adicionais', ''))
-        
-        # Obter o prompt de ajuste da configuração
-        adjustment_prompt_template = get_adjustment_prompt()
-        
-        # Substituir placeholders no prompt de ajuste
-        adjustment_prompt = adjustment_prompt_template
-        adjustment_prompt = adjustment_prompt.replace('{{PROMPT_ORIGINAL}}', prompt_original_content)
-        adjustment_prompt = adjustment_prompt.replace('{{MINUTA}}', data.get('current_content', ''))
-        adjustment_prompt = adjustment_prompt.replace('{{PEDIDO_DE_AJUSTE}}', data.get('adjustment_prompt', ''))
+        contexto, erro = preparar_prompt_ajuste(data)
+        if erro:
+            return jsonify({'error': erro}), 400
         
         # Gerar resposta usando IA
         resultado_ajustado, tokens_info = ai_manager.generate_response(
-            prompt=adjustment_prompt,
-            model=ai_model_id,
-            max_tokens=2000
+            prompt=contexto['prompt'],
+            model=contexto['ai_model_id'],
+            max_tokens=2000,
+            cache_prefix=contexto['prefixo_cache'],
+            use_cache=not data.get('ignorar_cache'),
+            objetivo=contexto['objetivo']
         )
         
         # Preparar resposta
-        response_data = {
-            'resultado': resultado_ajustado,  # Nome genérico para compatibilidade
-            'tokens_info': {
-                'request_tokens': tokens_info.get('request_tokens', 0) if tokens_info else 0,
-                'response_tokens': tokens_info.get('response_tokens', 0) if tokens_info else 0,
-                'total_tokens': tokens_info.get('total_tokens', 0) if tokens_info else 0,
-                'model_used': tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id,
-                'success': tokens_info.get('success', False) if tokens_info else False
-            },
-            'cost_info': tokens_info.get('display_info', {}) if tokens_info else {},
-            'user_cost': format_cost_for_user(tokens_info.get('cost_info', {}).get('total_cost', 0) if tokens_info else 0)
-        }
-        
-        # Manter compatibilidade com código existente
-        if objetivo == 'minuta':
-            response_data['minuta'] = resultado_ajustado
-        
-        # Salvar debug request
-        save_debug_request(
-            action=f'adjust_{objetivo}',
-            request_data=data,
-            response_data=response_data,
-            prompt_used=adjustment_prompt,
-            model_used=ai_model_id,
-            tokens_info=tokens_info,
-            success=tokens_info.get('success', False) if tokens_info else False,
-            error_message=tokens_info.get('error') if tokens_info else None
-        )
-        
-        # Log de uso detalhado
-        log = UsageLog(
-            user_id=current_user.id,
-            action=f'adjust_{objetivo}',
-            tokens_used=tokens_info.get('total_tokens', 0) if tokens_info else 0,
-            request_tokens=tokens_info.get('request_tokens', 0) if tokens_info else 0,
-            response_tokens=tokens_info.get('response_tokens', 0) if tokens_info else 0,
-            model_used=tokens_info.get('model_used', ai_model_id) if tokens_info else ai_model_id,
-            success=tokens_info.get('success', False) if tokens_info else False,
-            error_message=tokens_info.get('error') if tokens_info else None
-        )
-        db.session.add(log)
-        db.session.commit()
+        response_data = montar_resposta_geracao(resultado_ajustado, tokens_info, contexto['ai_model_id'], contexto['objetivo'], contexto.get('orcamento'))
+        registrar_geracao(f"adjust_{contexto['objetivo']}", data, response_data, contexto['prompt'], contexto['ai_model_id'], tokens_info)
         
         return jsonify(response_data)
         
     except Exception as e:
-        # Salvar debug request de erro
-        error_response = {'error': str(e)}
-        save_debug_request(
-            action=f'adjust_{data.get("objetivo", "minuta")}',
-            request_data=data if 'data' in locals() else {},
-            response_data=error_response,
-            success=False,
-            error_message=str(e)
-        )
-        
-        # Log de erro
-        log = UsageLog(
-            user_id=current_user.id,
-            action=f'adjust_{data.get("objetivo", "minuta")}',
-            tokens_used=0,
-            success=False,
-            error_message=str(e)
+        error_response = registrar_erro_geracao(
+            f'adjust_{data.get("objetivo", "minuta")}',
+            data if 'data' in locals() else {},
+            e
         )
-        db.session.add(log)
-        db.session.commit()
-        
         return jsonify(error_response), 500
 
+@app.route('/adjust_minuta/stream', methods=['POST'])
+@login_required
+def adjust_minuta_stream():
+    """Versão em streaming (SSE) de /adjust_minuta"""
+    data = request.get_json()
+    
+    contexto, erro = preparar_prompt_ajuste(data)
+    if erro:
+        return jsonify({'error': erro}), 400
+    
+    return resposta_sse_geracao(f"adjust_{contexto['objetivo']}", data, contexto)
+
+# Jobs de geração em segundo plano (executados pelos workers de job_worker.py)
+JOB_ACTIONS = ('generate', 'adjust')
+JOB_STATUS_FINAIS = ('done', 'error', 'cancelled')
+
+def _buscar_job_usuario(job_id):
+    """Retorna o job se pertencer ao usuário atual (ou se ele for admin)"""
+    job = db.session.get(GenerationJob, job_id)
+    if not job or (job.user_id != current_user.id and not current_user.is_admin):
+        return None
+    return job
+
+def enfileirar_job(action, data):
+    """Cria um job de geração na fila e devolve a resposta da API"""
+    if not isinstance(data, dict):
+        return jsonify({'error': 'Requisição inválida.'}), 400
+    job = GenerationJob(
+        user_id=current_user.id,
+        action=action,
+        status='queued',
+        request_data=json.dumps(data, ensure_ascii=False),
+        created_at=datetime.now(timezone.utc)
+    )
+    db.session.add(job)
+    db.session.commit()
+    return jsonify(job.to_dict()), 202
+
+@app.route('/generate_minuta/job', methods=['POST'])
+@login_required
+def generate_minuta_job():
+    """Versão em segundo plano de /generate_minuta: devolve o id do job"""
+    return enfileirar_job('generate', request.get_json())
+
+@app.route('/adjust_minuta/job', methods=['POST'])
+@login_required
+def adjust_minuta_job():
+    """Versão em segundo plano de /adjust_minuta: devolve o id do job"""
+    return enfileirar_job('adjust', request.get_json())
+
+@app.route('/api/jobs/<int:job_id>', methods=['GET'])
+@login_required
+def job_status(job_id):
+    job = _buscar_job_usuario(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado.'}), 404
+    
+    status = job.to_dict()
+    if job.status == 'queued':
+        # Posição na fila (jobs anteriores ainda não iniciados)
+        status['queue_position'] = GenerationJob.query.filter(
+            GenerationJob.status == 'queued', GenerationJob.id < job.id
+        ).count() + 1
+    return jsonify(status)
+
+@app.route('/api/jobs/<int:job_id>/result', methods=['GET'])
+@login_required
+def job_result(job_id):
+    job = _buscar_job_usuario(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado.'}), 404
+    
+    if job.status == 'done':
+        return jsonify(json.loads(job.result_data))
+    if job.status in ('error', 'cancelled'):
+        resposta = json.loads(job.result_data) if job.result_data else {}
+        resposta.update({'error': job.error_message or 'Job cancelado.', 'status': job.status})
+        return jsonify(resposta), 409 if job.status == 'cancelled' else 500
+    # Ainda na fila ou em execução
+    return jsonify(job.to_dict()), 202
+
+@app.route('/api/jobs/<int:job_id>/cancel', methods=['POST'])
+@login_required
+def job_cancel(job_id):
+    job = _buscar_job_usuario(job_id)
+    if not job:
+        return jsonify({'error': 'Job não encontrado.'}), 404
+    
+    if job.status in JOB_STATUS_FINAIS:
+        return jsonify(job.to_dict()), 409
+    
+    # Job na fila é cancelado aqui; em execução, o worker interrompe a geração
+    cancelado = GenerationJob.query.filter_by(id=job.id, status='queued').update({
+        'status': 'cancelled',
+        'cancel_requested': True,
+        'error_message': 'Cancelado pelo usuário',
+        'finished_at': datetime.now(timezone.utc)
+    })
+    if not cancelado:
+        job.cancel_requested = True
+    db.session.commit()
+    db.session.refresh(job)
+    return jsonify(job.to_dict())
+
 # Rotas administrativas
 @app.route('/admin')
 @login_required
@@ -1561,13 +2670,36 @@ def admin_logs():
         flash('Acesso negado.', 'error')
         return redirect(url_for('dashboard'))
     
-    logs = UsageLog.query.order_by(UsageLog.created_at.desc()).limit(100).all()
+    # Agregados diários com os logs gravados desde a última atualização (ver usage_rollup.py)
+    atualizar_uso_diario()
+    start_date, end_date = ler_periodo_filtros()
+    
+    query = UsageLog.query
+    resumo_query = db.session.query(
+        db.func.sum(db.case(
+            (UsageDaily.action.in_(['generate_minuta', 'generate_resumo', 'generate_relatorio']), UsageDaily.requests),
+            else_=0
+        )).label('geracoes'),
+        db.func.sum(UsageDaily.tokens_used).label('tokens'),
+        db.func.sum(UsageDaily.cost_usd).label('cost_usd'),
+        db.func.count(db.distinct(UsageDaily.user_id)).label('usuarios')
+    )
+    if start_date:
+        query = query.filter(UsageLog.created_at >= start_date)
+        resumo_query = resumo_query.filter(UsageDaily.date >= start_date)
+    if end_date:
+        query = query.filter(UsageLog.created_at < end_date + timedelta(days=1))
+        resumo_query = resumo_query.filter(UsageDaily.date <= end_date)
+    
+    logs = query.order_by(UsageLog.created_at.desc()).limit(100).all()
+    resumo = resumo_query.one()
     
-    # Calcular custos estimados para cada log e total
-    total_cost_usd = 0
+    # Calcular custos estimados para cada log
     for log in logs:
-        if log.tokens_used > 0 and log.model_used:
-            from models_config import calculate_cost
+        if log.input_cost_usd is not None:
+            # Custo gravado na geração
+            log.estimated_cost_brl = format_cost_for_user(log.input_cost_usd + (log.output_cost_usd or 0))
+        elif log.tokens_used > 0 and log.model_used:
             # Usar request_tokens e response_tokens se disponíveis, senão estimar
             if log.request_tokens and log.response_tokens:
                 input_tokens = log.request_tokens
@@ -1579,14 +2711,19 @@ def admin_logs():
             
             cost_info = calculate_cost(input_tokens, output_tokens, log.model_used)
             log.estimated_cost_brl = format_cost_for_user(cost_info.get('total_cost', 0))
-            total_cost_usd += cost_info.get('total_cost', 0)
         else:
             log.estimated_cost_brl = "R$ 0,00"
     
-    # Calcular custo total em BRL
-    total_cost_brl = format_cost_for_user(total_cost_usd)
+    # Totais do período (dos agregados diários)
+    stats = {
+        'geracoes': resumo.geracoes or 0,
+        'tokens': resumo.tokens or 0,
+        'total_cost_brl': format_cost_for_user(resumo.cost_usd or 0),
+        'usuarios': resumo.usuarios or 0
+    }
     
-    return render_template('admin_logs.html', logs=logs, total_cost_brl=total_cost_brl)
+    return render_template('admin_logs.html', logs=logs, stats=stats,
+                         current_filters={'start_date': request.args.get('start_date'), 'end_date': request.args.get('end_date')})
 
 @app.route('/admin/stats')
 @login_required
@@ -1595,159 +2732,94 @@ def admin_stats():
         flash('Acesso negado.', 'error')
         return redirect(url_for('dashboard'))
     
+    # Agregados diários com os logs gravados desde a última atualização (ver usage_rollup.py)
+    atualizar_uso_diario()
+    start_date, end_date = ler_periodo_filtros()
+    
+    def no_periodo(query):
+        if start_date:
+            query = query.filter(UsageDaily.date >= start_date)
+        if end_date:
+            query = query.filter(UsageDaily.date <= end_date)
+        return query
+    
     # Estatísticas gerais
-    total_logs = UsageLog.query.count()
-    total_tokens = db.session.query(db.func.sum(UsageLog.tokens_used)).scalar() or 0
+    totais = no_periodo(db.session.query(
+        db.func.sum(UsageDaily.requests).label('logs'),
+        db.func.sum(UsageDaily.tokens_used).label('tokens'),
+        db.func.sum(UsageDaily.cost_usd).label('cost_usd')
+    )).one()
+    total_logs = totais.logs or 0
+    total_tokens = totais.tokens or 0
     
     # Contar todas as ações de geração (múltiplos objetivos)
-    total_requests = UsageLog.query.filter(
-        UsageLog.action.like('generate_%')
-    ).count()
-    successful_requests = UsageLog.query.filter(
-        UsageLog.action.like('generate_%'),
-        UsageLog.success == True
-    ).count()
-    
-    # Calcular custos totais estimados
-    total_cost_usd = 0
-    for log in UsageLog.query.filter(UsageLog.tokens_used > 0).all():
-        if log.model_used:
-            from models_config import calculate_cost
-            cost_info = calculate_cost(log.request_tokens or 0, log.response_tokens or 0, log.model_used)
-            total_cost_usd += cost_info.get('total_cost', 0)
+    geracoes = no_periodo(db.session.query(
+        db.func.sum(UsageDaily.requests).label('requests'),
+        db.func.sum(UsageDaily.successful_requests).label('successful')
+    ).filter(UsageDaily.action.like('generate_%'))).one()
+    total_requests = geracoes.requests or 0
+    successful_requests = geracoes.successful or 0
     
     # Formatar custos para admin
-    admin_cost_info = format_cost_for_admin(total_cost_usd)
-    
-    # Tokens por modelo
-    tokens_by_model = db.session.query(
-        UsageLog.model_used,
-        db.func.sum(UsageLog.tokens_used).label('total_tokens'),
-        db.func.count(UsageLog.id).label('count')
+    admin_cost_info = format_cost_for_admin(totais.cost_usd or 0)
+    
+    # Tokens e custos por modelo
+    tokens_by_model = no_periodo(db.session.query(
+        UsageDaily.model_used,
+        db.func.sum(UsageDaily.tokens_used).label('total_tokens'),
+        db.func.sum(UsageDaily.requests_with_tokens).label('count'),
+        db.func.sum(UsageDaily.cost_usd).label('cost_usd')
     ).filter(
-        UsageLog.model_used.isnot(None),
-        UsageLog.tokens_used > 0
-    ).group_by(UsageLog.model_used).all()
-    
-    # Calcular custos por modelo
-    model_costs = []
-    for model_data in tokens_by_model:
-        model_id = model_data.model_used
-        total_tokens = model_data.total_tokens
-        count = model_data.count
-        
-        # Estimar custo baseado no modelo
-        from models_config import calculate_cost
-        # Assumir 50% input, 50% output para estimativa
-        estimated_input = total_tokens // 2
-        estimated_output = total_tokens - estimated_input
-        cost_info = calculate_cost(estimated_input, estimated_output, model_id)
-        
-        model_costs.append({
-            'model': model_id,
-            'total_tokens': total_tokens,
-            'count': count,
-            'cost_usd': cost_info.get('total_cost', 0),
-            'cost_brl': format_cost_for_user(cost_info.get('total_cost', 0))
-        })
-    
-    # Tokens por usuário - ORDENADO por tokens em ordem decrescente
-    tokens_by_user_raw = db.session.query(
+        UsageDaily.model_used != ''
+    )).group_by(UsageDaily.model_used).having(db.func.sum(UsageDaily.requests_with_tokens) > 0).all()
+    
+    model_costs = [{
+        'model': model_data.model_used,
+        'total_tokens': model_data.total_tokens,
+        'count': model_data.count,
+        'cost_usd': model_data.cost_usd or 0,
+        'cost_brl': format_cost_for_user(model_data.cost_usd or 0)
+    } for model_data in tokens_by_model]
+    
+    # Tokens e custos por usuário (uma única consulta agrupada)
+    usage_by_user = no_periodo(db.session.query(
         User.id,
         User.name,
-        db.func.sum(UsageLog.tokens_used).label('total_tokens'),
-        db.func.count(UsageLog.id).label('count')
-    ).join(UsageLog).filter(
-        UsageLog.tokens_used > 0
-    ).group_by(User.id, User.name).order_by(db.desc(db.func.sum(UsageLog.tokens_used))).all()
-    
-    # Converter para estrutura compatível com o template (mantendo NamedTuple-like)
-    tokens_by_user = []
-    for user_data in tokens_by_user_raw:
-        # Criar objeto com atributos name, total_tokens, count para compatibilidade
-        class UserTokenData:
-            def __init__(self, name, total_tokens, count):
-                self.name = name
-                self.total_tokens = total_tokens
-                self.count = count
-        
-        tokens_by_user.append(UserTokenData(
-            name=user_data.name,
-            total_tokens=user_data.total_tokens,
-            count=user_data.count
-        ))
+        db.func.sum(UsageDaily.tokens_used).label('total_tokens'),
+        db.func.sum(UsageDaily.requests_with_tokens).label('count'),
+        db.func.sum(UsageDaily.cost_usd).label('cost_usd')
+    ).join(UsageDaily, UsageDaily.user_id == User.id)).group_by(
+        User.id, User.name
+    ).having(db.func.sum(UsageDaily.requests_with_tokens) > 0).all()
     
-    # Calcular custos por usuário - ORDENADO por custo em ordem decrescente
-    user_costs = []
+    # Tokens por usuário - ORDENADO por tokens em ordem decrescente (name, total_tokens, count)
+    tokens_by_user = sorted(usage_by_user, key=lambda u: u.total_tokens or 0, reverse=True)
     
-    # Otimização: buscar todos os logs de uma vez e calcular custos
-    all_user_logs = db.session.query(
-        UsageLog.user_id,
-        UsageLog.request_tokens,
-        UsageLog.response_tokens,
-        UsageLog.model_used,
-        User.name
-    ).join(User).filter(
-        UsageLog.tokens_used > 0,
-        UsageLog.model_used.isnot(None)
-    ).all()
-    
-    # Agrupar logs por usuário e calcular custos
-    user_cost_data = {}
-    for log_data in all_user_logs:
-        user_id = log_data.user_id
-        user_name = log_data.name
-        
-        if user_id not in user_cost_data:
-            # Encontrar dados do usuário no tokens_by_user_raw
-            user_token_data = next((u for u in tokens_by_user_raw if u.id == user_id), None)
-            if user_token_data:
-                user_cost_data[user_id] = {
-                    'name': user_name,
-                    'total_tokens': user_token_data.total_tokens,
-                    'count': user_token_data.count,
-                    'cost_usd': 0
-                }
-        
-        # Calcular custo do log
-        if user_id in user_cost_data and log_data.model_used:
-            from models_config import calculate_cost
-            cost_info = calculate_cost(
-                log_data.request_tokens or 0,
-                log_data.response_tokens or 0,
-                log_data.model_used
-            )
-            user_cost_data[user_id]['cost_usd'] += cost_info.get('total_cost', 0)
-    
-    # Converter para lista final com formatação
-    for user_id, user_data in user_cost_data.items():
-        cost_usd = user_data['cost_usd']
+    # Custos por usuário - ORDENADO por custo em ordem decrescente
+    user_costs = []
+    for user_data in usage_by_user:
+        cost_usd = user_data.cost_usd or 0
+        cost_admin = format_cost_for_admin(cost_usd)
         user_costs.append({
-            'id': user_id,
-            'name': user_data['name'],
-            'total_tokens': user_data['total_tokens'],
-            'count': user_data['count'],
+            'id': user_data.id,
+            'name': user_data.name,
+            'total_tokens': user_data.total_tokens,
+            'count': user_data.count,
             'cost_usd': cost_usd,
             'cost_brl': format_cost_for_user(cost_usd),
-            'cost_admin_usd': format_cost_for_admin(cost_usd)['usd'],
-            'cost_admin_brl': format_cost_for_admin(cost_usd)['brl']
+            'cost_admin_usd': cost_admin['usd'],
+            'cost_admin_brl': cost_admin['brl']
         })
-    
-    # Ordenar usuários por custo em ordem decrescente
     user_costs.sort(key=lambda x: x['cost_usd'], reverse=True)
     
-    # Últimos 7 dias
-    seven_days_ago = datetime.now(timezone.utc) - timedelta(days=7)
-    recent_logs = UsageLog.query.filter(
-        UsageLog.created_at >= seven_days_ago
-    ).count()
-    
-    recent_tokens = db.session.query(
-        db.func.sum(UsageLog.tokens_used)
-    ).filter(
-        UsageLog.created_at >= seven_days_ago,
-        UsageLog.tokens_used > 0
-    ).scalar() or 0
+    # Últimos 7 dias (independente do período filtrado)
+    seven_days_ago = (datetime.now(timezone.utc) - timedelta(days=7)).date()
+    recentes = db.session.query(
+        db.func.sum(UsageDaily.requests).label('logs'),
+        db.func.sum(UsageDaily.tokens_used).label('tokens')
+    ).filter(UsageDaily.date >= seven_days_ago).one()
+    recent_logs = recentes.logs or 0
+    recent_tokens = recentes.tokens or 0
     
     # Cotação atual do dólar
     current_rate = get_dollar_rate()
@@ -1771,7 +2843,8 @@ def admin_stats():
         'rate_date': admin_cost_info['rate_date']
     }
     
-    return render_template('admin_stats.html', stats=stats)
+    return render_template('admin_stats.html', stats=stats,
+                         current_filters={'start_date': request.args.get('start_date'), 'end_date': request.args.get('end_date')})
 
 @app.route('/api/default_model')
 def get_default_model():
@@ -1843,6 +2916,7 @@ def admin_config():
                         if model:
                             model.is_enabled = is_enabled
                             db.session.commit()
+                            invalidate_model_cache()
                             status_text = "habilitado" if is_enabled else "desabilitado"
                             flash(f'Modelo {model.display_name} {status_text} com sucesso.', 'success')
                         else:
@@ -1886,6 +2960,7 @@ def admin_config():
                             )
                             db.session.add(new_model)
                             db.session.commit()
+                            invalidate_model_cache()
                             flash(f'Modelo {display_name} adicionado com sucesso!', 'success')
                 except Exception as e:
                     flash(f'Erro ao adicionar modelo: {str(e)}', 'error')
@@ -1931,6 +3006,7 @@ def admin_config():
                             model.updated_at = datetime.now(timezone.utc)
                             
                             db.session.commit()
+                            invalidate_model_cache()
                             flash(f'Modelo {display_name} atualizado com sucesso!', 'success')
                 except Exception as e:
                     flash(f'Erro ao atualizar modelo: {str(e)}', 'error')
@@ -1947,6 +3023,78 @@ def admin_config():
                 except Exception as e:
                     flash(f'Erro ao atualizar prompt de ajuste: {str(e)}', 'error')
     
+        elif action == 'update_summary_model':
+            summary_model = request.form.get('summary_ai_model', '')
+            
+            if summary_model and not get_model_status(summary_model):
+                flash('Modelo de resumo inválido ou desabilitado.', 'error')
+            else:
+                set_app_config('summary_ai_model', summary_model, 'Modelo usado para resumir as peças no modo resumido (vazio: o modelo da geração)')
+                flash('Modelo de resumo atualizado com sucesso!', 'success')
+        
+        elif action == 'update_generation_cache':
+            enabled = request.form.get('generation_cache_enabled') == 'true'
+            try:
+                ttl_hours = int(request.form.get('generation_cache_ttl_hours', generation_cache.GENERATION_CACHE_TTL_HORAS_PADRAO))
+            except ValueError:
+                ttl_hours = 0
+            
+            if ttl_hours < 1:
+                flash('O tempo de vida do cache deve ser de pelo menos 1 hora.', 'error')
+            else:
+                set_app_config('generation_cache_enabled', 'true' if enabled else 'false', 'Reaproveitar respostas de gerações idênticas')
+                set_app_config('generation_cache_ttl_hours', str(ttl_hours), 'Tempo de vida (horas) das respostas no cache de gerações')
+                flash('Cache de gerações atualizado com sucesso!', 'success')
+        
+        elif action == 'update_routing_policy':
+            hedging = request.form.get('routing_hedging_enabled') == 'true'
+            cadeias_texto = (request.form.get('routing_fallback_chains') or '').strip() or '{}'
+            try:
+                cadeias = json.loads(cadeias_texto)
+                if not isinstance(cadeias, dict) or not all(
+                    isinstance(modelos, list) and all(isinstance(m, str) for m in modelos) for modelos in cadeias.values()
+                ):
+                    raise ValueError('use o formato {"objetivo": ["modelo", ...]}')
+                invalidos = sorted({m for modelos in cadeias.values() for m in modelos if not get_model_status(m)})
+                if invalidos:
+                    raise ValueError(f"modelos inválidos ou desabilitados: {', '.join(invalidos)}")
+            except ValueError as e:
+                flash(f'Cadeias de fallback inválidas: {e}', 'error')
+            else:
+                set_app_config('routing_fallback_chains', json.dumps(cadeias, ensure_ascii=False), 'Modelos tentados, em ordem, quando o modelo escolhido falha (por objetivo)')
+                set_app_config('routing_hedging_enabled', 'true' if hedging else 'false', 'Disparar o próximo modelo da cadeia quando o primeiro demora mais que o p95')
+                flash('Roteamento entre provedores atualizado com sucesso!', 'success')
+        
+        elif action == 'update_rate_limits':
+            limites_texto = (request.form.get('rate_limits') or '').strip() or '{}'
+            try:
+                limites = json.loads(limites_texto)
+                if not isinstance(limites, dict) or not all(
+                    isinstance(limite, dict) and set(limite) <= {'rpm', 'tpm'}
+                    and all(isinstance(v, int) and not isinstance(v, bool) and v > 0 for v in limite.values())
+                    for limite in limites.values()
+                ):
+                    raise ValueError('use o formato {"provedor ou modelo": {"rpm": n, "tpm": n}} com inteiros positivos')
+                provedores = {'openai', 'anthropic', 'google'}
+                invalidos = sorted(escopo for escopo in limites if escopo not in provedores and not get_model_status(escopo))
+                if invalidos:
+                    raise ValueError(f"provedores ou modelos inválidos: {', '.join(invalidos)}")
+            except ValueError as e:
+                flash(f'Limites de taxa inválidos: {e}', 'error')
+            else:
+                set_app_config('rate_limits', json.dumps(limites, ensure_ascii=False), 'Limites de requisições (rpm) e tokens (tpm) por minuto de cada provedor ou modelo')
+                ai_manager.rate_limiter.invalidar()
+                flash('Limites de taxa atualizados com sucesso!', 'success')
+        
+        elif action == 'update_context_budget_policy':
+            politica = request.form.get('context_budget_policy')
+            
+            if politica not in context_budget.POLITICAS:
+                flash('Política de janela de contexto inválida.', 'error')
+            else:
+                set_app_config('context_budget_policy', politica, 'Política aplicada quando o processo excede a janela de contexto do modelo')
+                flash('Política de janela de contexto atualizada com sucesso!', 'success')
+    
     # Obter configurações atuais
     current_default_model = get_default_ai_model()
     
@@ -1959,7 +3107,15 @@ def admin_config():
     return render_template('admin_config.html', 
                          current_default_model=current_default_model,
                          available_models=available_models,
-                         adjustment_prompt=adjustment_prompt)
+                         adjustment_prompt=adjustment_prompt,
+                         context_budget_policy=get_politica_orcamento_contexto(),
+                         summary_ai_model=get_app_config('summary_ai_model', ''),
+                         generation_cache_enabled=generation_cache.cache_habilitado(),
+                         generation_cache_ttl_hours=get_app_config('generation_cache_ttl_hours', generation_cache.GENERATION_CACHE_TTL_HORAS_PADRAO),
+                         routing_fallback_chains=json.dumps(provider_routing.cadeias_fallback(), ensure_ascii=False, indent=2),
+                         routing_hedging_enabled=provider_routing.hedging_habilitado(),
+                         rate_limits=json.dumps(ai_manager.rate_limiter.limites(), ensure_ascii=False, indent=2),
+                         rate_limit_max_wait=int(RATE_LIMIT_MAX_WAIT))
 
 @app.route('/admin/instructions', methods=['GET', 'POST'])
 @login_required
@@ -2007,6 +3163,8 @@ def admin_api_keys():
                 flash('Todos os campos são obrigatórios.', 'error')
             else:
                 set_api_key(provider, api_key)
+                # Neste worker a nova chave vale já; nos outros, na próxima verificação
+                ai_manager.refresh_clients(force=True)
                 flash(f'Chave de API para {provider} configurada com sucesso!', 'success')
         
         elif action == 'test_key':
@@ -2044,6 +3202,7 @@ def admin_api_keys():
                 if key:
                     key.is_active = False
                     db.session.commit()
+                    ai_manager.refresh_clients(force=True)
                     flash(f'Chave de API para {provider} desativada.', 'success')
         
         elif action == 'test_eproc':
@@ -2096,6 +3255,7 @@ def admin_debug():
     end_date = request.args.get('end_date')
     user_id = request.args.get('user_id', type=int)
     numero_processo = request.args.get('numero_processo', '').strip()
+    busca = request.args.get('busca', '').strip()
     
     # Converter datas se fornecidas
     start_date_obj = None
@@ -2125,7 +3285,8 @@ def admin_debug():
         start_date=start_date_obj,
         end_date=end_date_obj,
         user_id=user_id,
-        numero_processo=numero_processo
+        numero_processo=numero_processo,
+        busca=busca
     )
     
     # Obter lista de usuários para filtro
@@ -2139,7 +3300,8 @@ def admin_debug():
                              'start_date': start_date,
                              'end_date': end_date,
                              'user_id': user_id,
-                             'numero_processo': numero_processo
+                             'numero_processo': numero_processo,
+                             'busca': busca
                          })
 
 @app.route('/admin/debug/<int:request_id>', methods=['GET'])
@@ -2172,17 +3334,9 @@ def buscar_movimentos():
         if len(numero_processo_limpo) < 7:
             return jsonify({'error': 'Número do processo deve ter pelo menos 7 dígitos'}), 400
         
-        # Obter credenciais do eproc
-        credenciais = get_eproc_credentials()
-        if not credenciais:
-            return jsonify({'error': 'Credenciais do eproc não configuradas'}), 500
-        
-        # Autenticar na API
-        api = BalcaoJusAPI()
-        api.autenticar(credenciais['login'], credenciais['password'])
-        
-        # Buscar movimentos com número limpo
-        resultado = api.buscar_movimentos_processo(numero_processo_limpo, sistema)
+        # Buscar movimentos com número limpo (sessão autenticada do pool)
+        with balcaojus_pool.sessao() as api:
+            resultado = api.buscar_movimentos_processo(numero_processo_limpo, sistema)
         
         # Extrair peças dos movimentos
         movimentos_com_pecas = extrair_pecas_movimentos_balcaojus(resultado)
@@ -2193,6 +3347,8 @@ def buscar_movimentos():
             'total': len(movimentos_com_pecas)
         })
         
+    except CredenciaisEprocNaoConfiguradas:
+        return jsonify({'error': 'Credenciais do eproc não configuradas'}), 500
     except Exception as e:
         app.logger.error(f"Erro ao buscar movimentos: {str(e)}")
         return jsonify({'error': f'Erro ao buscar movimentos: {str(e)}'}), 500
@@ -2215,63 +3371,89 @@ def buscar_conteudo_peca():
         if len(numero_processo_limpo) < 7:
             return jsonify({'error': 'Número do processo deve ter pelo menos 7 dígitos'}), 400
         
-        # Obter credenciais do eproc
-        credenciais = get_eproc_credentials()
-        if not credenciais:
-            return jsonify({'error': 'Credenciais do eproc não configuradas'}), 500
-        
-        # Autenticar na API
-        api = BalcaoJusAPI()
-        api.autenticar(credenciais['login'], credenciais['password'])
-        
-        # Obter JWT para download da peça com número limpo
-        jwt = api.obter_jwt_peca(numero_processo_limpo, id_peca, sistema)
+        with balcaojus_pool.sessao() as api:
+            resultado = baixar_e_extrair_peca(api, numero_processo_limpo, id_peca, sistema)
         
-        if not jwt:
-            return jsonify({'error': 'Não foi possível obter autorização para download da peça'}), 500
+        if 'error' in resultado:
+            return jsonify(resultado), 500
         
-        # Fazer download do conteúdo da peça com número limpo
-        conteudo_peca = api.download_peca(jwt, numero_processo_limpo, id_peca)
-        
-        # Detectar formato do conteúdo
-        formato = detectar_formato_conteudo(conteudo_peca)
-        
-        # Extrair texto do conteúdo
-        texto_extraido = extrair_texto_conteudo(conteudo_peca, formato)
-        
-        # Verificar se a extração foi bem-sucedida
-        if texto_extraido and not texto_extraido.startswith('Erro ao extrair'):
-            response = jsonify({
-                'success': True,
-                'conteudo_disponivel': True,
-                'tamanho_bytes': len(conteudo_peca),
-                'formato': formato.upper(),
-                'texto_extraido': texto_extraido,
-                'mensagem': f'Texto extraído com sucesso do {formato.upper()}.'
-            })
-            response.headers['Content-Type'] = 'application/json; charset=utf-8'
-            return response
-        else:
-            # Se não conseguiu extrair texto, retornar apenas informações do arquivo
-            response = jsonify({
-                'success': True,
-                'conteudo_disponivel': True,
-                'tamanho_bytes': len(conteudo_peca),
-                'formato': formato.upper(),
-                'texto_extraido': '',
-                'mensagem': f'Arquivo {formato.upper()} obtido, mas não foi possível extrair o texto: {texto_extraido}'
-            })
-            response.headers['Content-Type'] = 'application/json; charset=utf-8'
-            return response
+        response = jsonify(resultado)
+        response.headers['Content-Type'] = 'application/json; charset=utf-8'
+        return response
         
+    except CredenciaisEprocNaoConfiguradas:
+        return jsonify({'error': 'Credenciais do eproc não configuradas'}), 500
     except Exception as e:
         app.logger.error(f"Erro ao buscar conteúdo da peça: {str(e)}")
         return jsonify({'error': f'Erro ao buscar conteúdo da peça: {str(e)}'}), 500
 
+@app.route('/api/buscar_conteudo_pecas', methods=['POST'])
+@login_required
+def buscar_conteudo_pecas():
+    """
+    Busca o conteúdo de várias peças de uma vez.
+    
+    Os downloads rodam em paralelo (limitados por BALCAOJUS_MAX_DOWNLOADS) sobre uma única
+    sessão autenticada, e cada peça é enviada ao navegador assim que fica pronta, em
+    NDJSON (uma linha JSON por peça, na ordem de conclusão, seguida de {"done": true}).
+    """
+    data = request.get_json() or {}
+    numero_processo = data.get('numero_processo')
+    ids_pecas = data.get('ids_pecas') or []
+    sistema = data.get('sistema', 'br.jus.jfrj.eproc')
+    
+    if not numero_processo or not ids_pecas or not isinstance(ids_pecas, list):
+        return jsonify({'error': 'Número do processo e lista de IDs das peças são obrigatórios'}), 400
+    
+    if len(ids_pecas) > BALCAOJUS_MAX_PECAS_LOTE:
+        return jsonify({'error': f'Máximo de {BALCAOJUS_MAX_PECAS_LOTE} peças por importação'}), 400
+    
+    # Limpar número do processo (apenas números)
+    numero_processo_limpo = re.sub(r'[^\d]', '', numero_processo)
+    
+    if len(numero_processo_limpo) < 7:
+        return jsonify({'error': 'Número do processo deve ter pelo menos 7 dígitos'}), 400
+    
+    # Remover IDs repetidos mantendo a ordem
+    ids_pecas = list(dict.fromkeys(str(id_peca) for id_peca in ids_pecas))
+    
+    def gerar():
+        try:
+            with balcaojus_pool.sessao() as api:
+                def processar(id_peca):
+                    try:
+                        return baixar_e_extrair_peca(api, numero_processo_limpo, id_peca, sistema)
+                    except Exception as e:
+                        app.logger.error(f"Erro ao buscar conteúdo da peça {id_peca}: {str(e)}")
+                        return {'error': f'Erro ao buscar conteúdo da peça: {str(e)}'}
+                
+                max_workers = min(BALCAOJUS_MAX_DOWNLOADS, len(ids_pecas))
+                with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                    futures = {executor.submit(processar, id_peca): id_peca for id_peca in ids_pecas}
+                    for future in as_completed(futures):
+                        resultado = future.result()
+                        resultado['id_peca'] = futures[future]
+                        yield json.dumps(resultado, ensure_ascii=False) + '\n'
+        except CredenciaisEprocNaoConfiguradas:
+            yield json.dumps({'error': 'Credenciais do eproc não configuradas'}, ensure_ascii=False) + '\n'
+        except Exception as e:
+            app.logger.error(f"Erro ao buscar conteúdo das peças: {str(e)}")
+            yield json.dumps({'error': f'Erro ao buscar conteúdo das peças: {str(e)}'}, ensure_ascii=False) + '\n'
+        
+        yield json.dumps({'done': True, 'total': len(ids_pecas)}) + '\n'
+    
+    response = Response(stream_with_context(gerar()), mimetype='application/x-ndjson')
+    response.headers['Content-Type'] = 'application/x-ndjson; charset=utf-8'
+    # Evitar que proxies (nginx) acumulem a resposta antes de repassar
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
 # Inicialização do banco de dados
 def init_db():
     with app.app_context():
         db.create_all()
+        debug_search.criar_indice()
         
         # Criar usuários padrão se não existirem
         if not User.query.first():
@@ -0,0 +1,176 @@
+"""
+Orçamento da janela de contexto
+Antes da chamada ao provedor, compara o prompt montado (instruções gerais, prompt e
+peças processuais) com a janela de contexto do modelo, reservando os tokens de saída.
+Se o processo não couber, a política configurada decide: rejeitar a requisição,
+omitir as peças menos relevantes ou condensá-las em trechos
+"""
+
+import os
+import re
+import unicodedata
+
+# Políticas para quando o prompt excede a janela de contexto
+POLITICA_REJEITAR = 'rejeitar'  # devolve erro sem chamar o provedor
+POLITICA_CORTAR = 'cortar'  # omite as peças menos relevantes
+POLITICA_RESUMIR = 'resumir'  # condensa as peças menos relevantes (início e fim) antes de omitir
+POLITICAS = (POLITICA_REJEITAR, POLITICA_CORTAR, POLITICA_RESUMIR)
+POLITICA_PADRAO = os.getenv('CONTEXT_BUDGET_POLICY', POLITICA_CORTAR)
+
+# Fração da janela reservada para o erro da estimativa de tokens
+MARGEM_SEGURANCA = float(os.getenv('CONTEXT_BUDGET_MARGIN', '0.05'))
+# Tamanho máximo de uma peça condensada pela política "resumir"
+RESUMO_MAX_TOKENS = int(os.getenv('CONTEXT_BUDGET_SUMMARY_TOKENS', '1500'))
+
+MARCADOR_PECA_OMITIDA = "[Peça omitida: o processo excede a janela de contexto do modelo]"
+MARCADOR_TRECHO_OMITIDO = "\n\n[... trecho omitido para caber na janela de contexto ...]\n\n"
+
+# Peso da peça pelo tipo (nome normalizado, sem acentos); a primeira regra que casar vale
+PESOS_TIPO_PECA = [
+    (('sentenca', 'acordao', 'decisao', 'voto'), 4),
+    (('peticao inicial', 'inicial', 'denuncia', 'queixa'), 3),
+    (('contestacao', 'replica', 'apelacao', 'recurso', 'contrarrazoes', 'embargos',
+      'agravo', 'impugnacao', 'alegacoes', 'memoriais', 'manifestacao'), 2),
+    (('laudo', 'parecer', 'despacho', 'informacoes'), 1),
+    (('procuracao', 'substabelecimento', 'certidao', 'comprovante', 'guia', 'custas',
+      'ato ordinatorio', 'intimacao', 'juntada', 'aviso', 'mandado'), -1),
+]
+
+class OrcamentoExcedido(Exception):
+    """O prompt não cabe na janela de contexto do modelo"""
+    pass
+
+def limite_entrada(context_window: int, tokens_saida: int) -> int:
+    """Tokens disponíveis para a entrada: janela - saída reservada - margem de segurança"""
+    return int(context_window * (1 - MARGEM_SEGURANCA)) - (tokens_saida or 0)
+
+def _normalizar(texto: str) -> str:
+    texto = unicodedata.normalize('NFKD', (texto or '').lower())
+    return ''.join(c for c in texto if not unicodedata.combining(c))
+
+def relevancia_peca(peca: dict, posicao: int) -> tuple:
+    """
+    Chave de ordenação da relevância de uma peça (maior = mais relevante)
+
+    Usa o tipo da peça pelo nome e, em empate, a ordem escolhida pelo usuário
+    (peças anteriores são mais relevantes)
+    """
+    nome = _normalizar(peca.get('nome', ''))
+    peso = 0
+    for termos, peso_tipo in PESOS_TIPO_PECA:
+        if any(re.search(r'\b' + termo + r'\b', nome) for termo in termos):
+            peso = peso_tipo
+            break
+    return (peso, -posicao)
+
+def condensar_texto(texto: str, max_tokens: int, contar) -> str:
+    """
+    Reduz o texto a no máximo max_tokens mantendo o início e o fim (onde costumam
+    estar a qualificação/pedidos e o dispositivo/conclusão)
+    """
+    total = contar(texto)
+    if total <= max_tokens:
+        return texto
+    if max_tokens <= 0:
+        return ""
+
+    caracteres = int(len(texto) * max_tokens / total * 0.95)
+    for _ in range(10):
+        inicio = texto[:caracteres * 2 // 3].rsplit(' ', 1)[0]
+        fim = texto[len(texto) - caracteres // 3:].split(' ', 1)[-1]
+        condensado = inicio + MARCADOR_TRECHO_OMITIDO + fim
+        if contar(condensado) <= max_tokens:
+            return condensado
+        caracteres = int(caracteres * 0.85)
+    return texto[:caracteres]
+
+def ajustar_pecas(pecas: list, tokens_fixos: int, limite: int, contar_peca, contar_texto,
+                  politica: str = POLITICA_PADRAO) -> tuple:
+    """
+    Ajusta as peças processuais ao limite de tokens de entrada
+
+    Args:
+        pecas: Peças processuais ({'nome', 'conteudo'}) na ordem do usuário
+        tokens_fixos: Tokens do prompt sem as peças (instruções, prompt, minuta etc.)
+        limite: Tokens disponíveis para a entrada (ver limite_entrada)
+        contar_peca: Função que conta os tokens de uma peça já formatada no prompt
+        contar_texto: Função que conta os tokens de um texto
+        politica: rejeitar, cortar ou resumir
+
+    Returns:
+        Tuple[list, Dict]: (peças ajustadas na ordem original, relatório do orçamento)
+
+    Raises:
+        OrcamentoExcedido: se a política for rejeitar ou se o prompt não couber nem sem as peças
+    """
+    if politica not in POLITICAS:
+        politica = POLITICA_CORTAR
+
+    tokens = [contar_peca(peca) for peca in pecas]
+    total = tokens_fixos + sum(tokens)
+    relatorio = {
+        'politica': politica,
+        'limite': limite,
+        'tokens_estimados': total,
+        'tokens_originais': total,
+        'ajustado': False,
+        'pecas_omitidas': [],
+        'pecas_resumidas': []
+    }
+    if total <= limite:
+        return list(pecas), relatorio
+
+    if politica == POLITICA_REJEITAR:
+        raise OrcamentoExcedido(
+            f'O processo excede a janela de contexto do modelo: cerca de {total:,} tokens '
+            f'de entrada para um limite de {limite:,}. Remova peças ou escolha um modelo com janela maior.'
+        )
+    if tokens_fixos >= limite:
+        raise OrcamentoExcedido(
+            f'O prompt excede a janela de contexto do modelo mesmo sem as peças processuais '
+            f'(cerca de {tokens_fixos:,} tokens para um limite de {limite:,}).'
+        )
+
+    ajustadas = list(pecas)
+    # Da menos para a mais relevante; a mais relevante nunca é omitida
+    ordem = sorted(range(len(pecas)), key=lambda i: relevancia_peca(pecas[i], i))
+    resumidas = set()
+
+    def substituir(indice, conteudo):
+        nonlocal total
+        ajustadas[indice] = dict(pecas[indice], conteudo=conteudo)
+        novos_tokens = contar_peca(ajustadas[indice])
+        total -= tokens[indice] - novos_tokens
+        tokens[indice] = novos_tokens
+
+    if politica == POLITICA_RESUMIR:
+        for indice in ordem[:-1]:
+            if total <= limite:
+                break
+            if tokens[indice] > RESUMO_MAX_TOKENS:
+                substituir(indice, condensar_texto(pecas[indice].get('conteudo', ''), RESUMO_MAX_TOKENS, contar_texto))
+                resumidas.add(indice)
+
+    omitidas = set()
+    for indice in ordem[:-1]:
+        if total <= limite:
+            break
+        substituir(indice, MARCADOR_PECA_OMITIDA)
+        omitidas.add(indice)
+        resumidas.discard(indice)
+
+    if total > limite:
+        # Só a peça mais relevante restou e ainda não cabe: condensar no espaço que sobra
+        indice = ordem[-1]
+        excesso = total - limite
+        conteudo = ajustadas[indice].get('conteudo', '')
+        substituir(indice, condensar_texto(conteudo, contar_texto(conteudo) - excesso, contar_texto))
+        resumidas.add(indice)
+
+    relatorio.update({
+        'tokens_estimados': total,
+        'ajustado': True,
+        'pecas_omitidas': [pecas[i].get('nome', '') for i in sorted(omitidas)],
+        'pecas_resumidas': [pecas[i].get('nome', '') for i in sorted(resumidas)]
+    })
+    return ajustadas, relatorio
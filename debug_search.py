@@ -0,0 +1,99 @@
+"""
+Busca nas requisições de debug
+O número do processo de cada requisição é gravado normalizado (só dígitos) na coluna
+indexada debug_request.numero_processo, e o prompt e a resposta de cada geração entram no
+índice de texto completo debug_request_fts (SQLite FTS5). A tabela FTS não guarda cópia do
+texto (content=''): só o índice, com o id da requisição como rowid
+"""
+
+import re
+import logging
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+TABELA_FTS = 'debug_request_fts'
+
+SQL_CRIAR_FTS = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {TABELA_FTS} "
+    "USING fts5(prompt, resposta, content='', tokenize='unicode61 remove_diacritics 2')"
+)
+
+_fts_disponivel = None
+
+def normalizar_numero_processo(numero_processo) -> str:
+    """Número do processo só com dígitos (None se não houver)"""
+    numero = re.sub(r'[^\d]', '', str(numero_processo or ''))
+    return numero or None
+
+def texto_resposta(response_data) -> str:
+    """Texto indexado da resposta de uma geração (resultado ou mensagem de erro)"""
+    if not isinstance(response_data, dict):
+        return ''
+    return response_data.get('resultado') or response_data.get('error') or ''
+
+def fts_disponivel() -> bool:
+    """Verifica (uma vez por processo) se a tabela FTS existe no banco"""
+    global _fts_disponivel
+    if _fts_disponivel is None:
+        try:
+            from app import db
+            _fts_disponivel = db.session.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE name = :nome"
+            ), {'nome': TABELA_FTS}).first() is not None
+        except Exception as e:
+            logger.warning(f"Erro ao verificar o índice de busca do debug: {e}")
+            return False
+    return _fts_disponivel
+
+def criar_indice():
+    """Cria a tabela FTS (False se o SQLite não tiver FTS5)"""
+    global _fts_disponivel
+    from app import db
+    try:
+        db.session.execute(text(SQL_CRIAR_FTS))
+        db.session.commit()
+        _fts_disponivel = True
+        return True
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Índice de busca do debug indisponível (FTS5): {e}")
+        return False
+
+def indexar(debug_request_id: int, prompt: str, resposta: str):
+    """Inclui o prompt e a resposta de uma requisição no índice (na transação da sessão atual)"""
+    if not fts_disponivel():
+        return
+    from app import db
+    db.session.execute(text(
+        f"INSERT INTO {TABELA_FTS} (rowid, prompt, resposta) VALUES (:id, :prompt, :resposta)"
+    ), {'id': debug_request_id, 'prompt': prompt or '', 'resposta': resposta or ''})
+
+def consulta_fts(busca: str) -> str:
+    """
+    Converte o texto digitado em uma consulta FTS5: todos os termos, cada um entre aspas
+    (sem operadores nem erros de sintaxe); o último termo também casa como prefixo
+    """
+    termos = re.findall(r'\w+', busca or '')
+    if not termos:
+        return None
+    consulta = [f'"{termo}"' for termo in termos]
+    consulta[-1] += '*'
+    return ' '.join(consulta)
+
+def filtro_busca(busca: str):
+    """Condição SQL das requisições cujo prompt ou resposta contém os termos (None se a busca é vazia)"""
+    consulta = consulta_fts(busca)
+    if not consulta:
+        return None
+    if fts_disponivel():
+        return text(
+            f"debug_request.id IN (SELECT rowid FROM {TABELA_FTS} WHERE {TABELA_FTS} MATCH :busca_fts)"
+        ).bindparams(busca_fts=consulta)
+    # Sem FTS5: busca lenta, só no texto que não fica comprimido em debug_blob (mensagem de
+    # erro e prompt das requisições ainda não migradas)
+    from app import DebugRequest, db
+    return db.and_(*[
+        db.or_(DebugRequest.error_message.like(f'%{termo}%'), DebugRequest.prompt_used_legado.like(f'%{termo}%'))
+        for termo in re.findall(r'\w+', busca)
+    ])
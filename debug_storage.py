@@ -0,0 +1,189 @@
+"""
+Armazenamento comprimido e deduplicado dos dados das requisições de debug
+Cada campo de uma DebugRequest (requisição, resposta, prompt e tokens) é gravado como um
+manifesto JSON na tabela debug_blob. Os textos longos (peças processuais, minutas) saem do
+manifesto e viram blobs próprios, endereçados pelo SHA-256 do conteúdo: a mesma peça na
+requisição, no prompt montado e em cada rodada de ajuste é gravada uma única vez. Manifestos e
+blobs são comprimidos (zlib). A leitura só acontece quando o campo é acessado (página de detalhe)
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import logging
+from sqlalchemy import text, bindparam
+
+logger = logging.getLogger(__name__)
+
+# Textos a partir deste tamanho (caracteres) são gravados como blobs deduplicados
+DEBUG_BLOB_MIN_CHARS = int(os.getenv('DEBUG_BLOB_MIN_CHARS', '1024'))
+
+COMPRESSAO = 'zlib'
+NIVEL_ZLIB = 6
+
+# Referência a um blob e texto montado a partir de trechos e referências, dentro do manifesto
+REF = '$blob'
+PARTES = '$partes'
+
+def sha256_texto(texto: str) -> str:
+    return hashlib.sha256(texto.encode('utf-8')).hexdigest()
+
+def comprimir(texto: str) -> bytes:
+    return zlib.compress(texto.encode('utf-8'), NIVEL_ZLIB)
+
+def descomprimir(dados: bytes, compressao: str) -> str:
+    if compressao != COMPRESSAO:
+        raise ValueError(f"Compressão desconhecida no debug_blob: {compressao}")
+    return zlib.decompress(dados).decode('utf-8')
+
+def corpos(*valores) -> set:
+    """Textos longos (peças, minutas) dos valores JSON, que viram blobs deduplicados"""
+    encontrados = set()
+
+    def percorrer(valor):
+        if isinstance(valor, dict):
+            for item in valor.values():
+                percorrer(item)
+        elif isinstance(valor, list):
+            for item in valor:
+                percorrer(item)
+        elif isinstance(valor, str) and len(valor) >= DEBUG_BLOB_MIN_CHARS:
+            encontrados.add(valor)
+
+    for valor in valores:
+        percorrer(valor)
+    return encontrados
+
+class _Codificador:
+    """Troca os textos longos de um valor por referências, acumulando os blobs a gravar"""
+
+    def __init__(self, corpos_conhecidos):
+        self.corpos = corpos_conhecidos
+        # O prompt usa as peças sem os espaços das pontas (formatar_pecas_processuais)
+        candidatos = set(corpos_conhecidos) | {corpo.strip() for corpo in corpos_conhecidos}
+        self.candidatos = sorted(
+            (corpo for corpo in candidatos if len(corpo) >= DEBUG_BLOB_MIN_CHARS), key=len, reverse=True
+        )
+        self.blobs = {}
+
+    def ref(self, corpo):
+        sha = sha256_texto(corpo)
+        self.blobs[sha] = corpo
+        return {REF: sha}
+
+    def texto(self, valor):
+        if len(valor) < DEBUG_BLOB_MIN_CHARS:
+            return valor
+        if valor in self.corpos:
+            return self.ref(valor)
+        partes = [valor]
+        for corpo in self.candidatos:
+            novas = []
+            for parte in partes:
+                if not isinstance(parte, str) or corpo not in parte:
+                    novas.append(parte)
+                    continue
+                for i, trecho in enumerate(parte.split(corpo)):
+                    if i:
+                        novas.append(self.ref(corpo))
+                    if trecho:
+                        novas.append(trecho)
+            partes = novas
+        if len(partes) == 1:
+            return partes[0]
+        return {PARTES: partes}
+
+    def valor(self, valor):
+        if isinstance(valor, dict):
+            return {chave: self.valor(item) for chave, item in valor.items()}
+        if isinstance(valor, list):
+            return [self.valor(item) for item in valor]
+        if isinstance(valor, str):
+            return self.texto(valor)
+        return valor
+
+def _gravar_blob(sha: str, conteudo: str):
+    """Grava um blob (na transação da sessão atual); conteúdo já gravado não é repetido"""
+    from app import db
+    db.session.execute(text(
+        "INSERT OR IGNORE INTO debug_blob (sha256, compression, size, data, created_at) "
+        "VALUES (:sha, :compressao, :tamanho, :dados, CURRENT_TIMESTAMP)"
+    ), {'sha': sha, 'compressao': COMPRESSAO, 'tamanho': len(conteudo), 'dados': comprimir(conteudo)})
+
+def guardar(valor, corpos_conhecidos=()) -> str:
+    """
+    Grava um valor JSON (na transação da sessão atual)
+
+    Args:
+        valor: dict, lista ou texto a gravar (None não grava nada)
+        corpos_conhecidos: textos longos que viram blobs próprios (ver corpos)
+
+    Returns:
+        str: SHA-256 do manifesto (None se valor é None)
+    """
+    if valor is None:
+        return None
+    codificador = _Codificador(set(corpos_conhecidos) | corpos(valor))
+    manifesto = json.dumps(codificador.valor(valor), ensure_ascii=False, separators=(',', ':'))
+    for sha, corpo in codificador.blobs.items():
+        _gravar_blob(sha, corpo)
+    sha_manifesto = sha256_texto(manifesto)
+    _gravar_blob(sha_manifesto, manifesto)
+    return sha_manifesto
+
+def _ler_blobs(shas) -> dict:
+    from app import db
+    if not shas:
+        return {}
+    linhas = db.session.execute(
+        text("SELECT sha256, compression, data FROM debug_blob WHERE sha256 IN :shas")
+        .bindparams(bindparam('shas', expanding=True)),
+        {'shas': list(shas)}
+    ).all()
+    return {sha: descomprimir(dados, compressao) for sha, compressao, dados in linhas}
+
+def ler(sha: str):
+    """Valor JSON gravado por guardar (None se sha é None)"""
+    if not sha:
+        return None
+    manifesto = _ler_blobs([sha]).get(sha)
+    if manifesto is None:
+        logger.warning(f"Blob de debug não encontrado: {sha}")
+        return None
+    valor = json.loads(manifesto)
+
+    referencias = set()
+
+    def coletar(item):
+        if isinstance(item, dict):
+            if set(item) == {REF}:
+                referencias.add(item[REF])
+            else:
+                for filho in item.values():
+                    coletar(filho)
+        elif isinstance(item, list):
+            for filho in item:
+                coletar(filho)
+
+    coletar(valor)
+    blobs = _ler_blobs(referencias)
+
+    def montar(item):
+        if isinstance(item, dict):
+            if set(item) == {REF}:
+                return blobs.get(item[REF], '')
+            if set(item) == {PARTES}:
+                return ''.join(montar(parte) for parte in item[PARTES])
+            return {chave: montar(filho) for chave, filho in item.items()}
+        if isinstance(item, list):
+            return [montar(filho) for filho in item]
+        return item
+
+    return montar(valor)
+
+def ler_json(sha: str) -> str:
+    """Valor gravado por guardar, no formato de exibição (JSON indentado); None se sha é None"""
+    if not sha:
+        return None
+    return json.dumps(ler(sha), ensure_ascii=False, indent=2)
@@ -63,8 +63,10 @@ cat > gunicorn.conf.py << 'EOF'
 # Gunicorn configuration for DIRIA
 bind = "127.0.0.1:8000"
 workers = 2
-worker_class = "sync"
-worker_connections = 1000
+# gthread: cada requisição ocupa só uma thread; as chamadas às APIs de IA rodam
+# no event loop assíncrono do processo, então uma geração longa não prende o worker
+worker_class = "gthread"
+threads = 32
 timeout = 300
 keepalive = 2
 max_requests = 1000
@@ -357,6 +359,17 @@ if [ "$RESTART_SUCCESS" = false ]; then
     echo "💡 Execute manualmente: sudo supervisorctl restart diria"
 fi
 
+# Reiniciar os workers dos jobs de geração em segundo plano
+echo "🔄 Reiniciando workers de jobs..."
+if supervisorctl restart diria-worker 2>/dev/null || sudo supervisorctl restart diria-worker 2>/dev/null; then
+    echo "✅ Workers reiniciados via supervisorctl"
+else
+    pkill -f "job_worker.py" 2>/dev/null || true
+    sleep 2
+    nohup venv/bin/python job_worker.py > logs/job_worker.log 2>&1 &
+    echo "✅ Workers reiniciados manualmente (configure o programa diria-worker no supervisor)"
+fi
+
 # Verificar status da aplicação
 echo "📊 Verificando status da aplicação..."
 sleep 5
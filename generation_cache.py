@@ -0,0 +1,130 @@
+"""
+Cache de respostas de geração
+Requisições idênticas (mesmo prompt final, instruções, modelo e max_tokens) reaproveitam a
+resposta já gerada em vez de uma nova chamada paga ao provedor. Opcional: habilitado em
+/admin/config (generation_cache_enabled); as entradas expiram após o TTL e as menos
+usadas são removidas quando o cache passa do tamanho máximo
+"""
+
+import os
+import json
+import hashlib
+import logging
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+GENERATION_CACHE_TTL_HORAS_PADRAO = int(os.getenv('GENERATION_CACHE_TTL_HOURS', '24'))
+GENERATION_CACHE_MAX_MB = int(os.getenv('GENERATION_CACHE_MAX_MB', '100'))
+
+def chave_cache(prompt: str, system_message: str, model: str, max_tokens: int) -> str:
+    """Hash que identifica uma geração (prompt final, instruções, modelo e max_tokens)"""
+    conteudo = json.dumps([model, max_tokens, system_message or '', prompt], ensure_ascii=False)
+    return hashlib.sha256(conteudo.encode('utf-8')).hexdigest()
+
+def resumo_tokens(tokens_info: dict) -> dict:
+    """Tokens e custo de uma geração, guardados para quem reaproveitar a resposta"""
+    return {
+        'request_tokens': tokens_info.get('request_tokens', 0),
+        'response_tokens': tokens_info.get('response_tokens', 0),
+        'total_tokens': tokens_info.get('total_tokens', 0),
+        'cost_usd': (tokens_info.get('cost_info') or {}).get('total_cost', 0)
+    }
+
+def cache_habilitado() -> bool:
+    """Verifica se o cache de gerações está habilitado na configuração"""
+    try:
+        from app import get_app_config
+        return get_app_config('generation_cache_enabled', 'false') == 'true'
+    except Exception as e:
+        logger.warning(f"Erro ao ler configuração do cache de gerações: {e}")
+        return False
+
+def ttl_cache() -> timedelta:
+    """Tempo de vida das entradas do cache (configurável em horas)"""
+    try:
+        from app import get_app_config
+        horas = int(get_app_config('generation_cache_ttl_hours', GENERATION_CACHE_TTL_HORAS_PADRAO))
+    except Exception:
+        horas = GENERATION_CACHE_TTL_HORAS_PADRAO
+    return timedelta(hours=max(1, horas))
+
+def buscar(chave: str):
+    """
+    Busca uma resposta válida no cache
+
+    Returns:
+        Tuple[str, Dict]: (resposta, metadados de tokens da geração original) ou None
+    """
+    try:
+        from app import db, GenerationCache
+        agora = datetime.now(timezone.utc)
+        entrada = GenerationCache.query.filter(
+            GenerationCache.cache_key == chave,
+            GenerationCache.expires_at > agora
+        ).first()
+        if not entrada:
+            return None
+
+        # Registrar acesso para a política LRU
+        entrada.hits = (entrada.hits or 0) + 1
+        entrada.last_accessed_at = agora
+        db.session.commit()
+        return entrada.response, json.loads(entrada.tokens_info or '{}')
+    except Exception as e:
+        logger.warning(f"Erro ao consultar cache de gerações: {e}")
+        return None
+
+def salvar(chave: str, model: str, response: str, tokens_info: dict):
+    """Grava uma resposta bem-sucedida no cache e aplica o TTL e o limite de tamanho"""
+    try:
+        from app import db, GenerationCache
+        agora = datetime.now(timezone.utc)
+        expires_at = agora + ttl_cache()
+        entrada = GenerationCache.query.filter_by(cache_key=chave).first()
+        if not entrada:
+            entrada = GenerationCache(cache_key=chave, created_at=agora, hits=0)
+            db.session.add(entrada)
+
+        entrada.model_used = model
+        entrada.response = response
+        entrada.tokens_info = json.dumps(resumo_tokens(tokens_info))
+        entrada.response_size = len(response.encode('utf-8'))
+        entrada.expires_at = expires_at
+        entrada.last_accessed_at = agora
+        db.session.commit()
+
+        _aplicar_limites(agora)
+    except Exception as e:
+        # Ex.: outra requisição gravou a mesma resposta ao mesmo tempo
+        logger.warning(f"Erro ao gravar cache de gerações: {e}")
+        try:
+            from app import db
+            db.session.rollback()
+        except Exception:
+            pass
+
+def _aplicar_limites(agora: datetime):
+    """Remove as entradas expiradas e as acessadas há mais tempo até caber em GENERATION_CACHE_MAX_MB"""
+    from app import db, GenerationCache
+    GenerationCache.query.filter(GenerationCache.expires_at <= agora).delete(synchronize_session=False)
+    db.session.commit()
+
+    limite = GENERATION_CACHE_MAX_MB * 1024 * 1024
+    total = db.session.query(db.func.sum(GenerationCache.response_size)).scalar() or 0
+    if total <= limite:
+        return
+
+    excedente = total - limite
+    ids_remover = []
+    for entrada_id, tamanho in db.session.query(
+        GenerationCache.id, GenerationCache.response_size
+    ).order_by(GenerationCache.last_accessed_at).all():
+        if excedente <= 0:
+            break
+        ids_remover.append(entrada_id)
+        excedente -= tamanho or 0
+
+    GenerationCache.query.filter(GenerationCache.id.in_(ids_remover)).delete(synchronize_session=False)
+    db.session.commit()
+    logger.info(f"Cache de gerações: {len(ids_remover)} entrada(s) removida(s) por limite de tamanho")
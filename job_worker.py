@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Workers dos jobs de geração em segundo plano
+Cada processo busca o próximo job da tabela generation_job (fila no SQLite), executa a
+geração/ajuste com as mesmas funções das rotas web e grava o resultado no job.
+Uso: python job_worker.py [--workers N]
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import socket
+import logging
+import argparse
+import threading
+import multiprocessing
+from datetime import datetime, timezone, timedelta
+
+# Adicionar o diretório atual ao path
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from flask_login import login_user
+from app import (
+    app, db, GenerationJob, User, preparar_prompt_geracao, preparar_prompt_ajuste,
+    eventos_geracao, registrar_erro_geracao
+)
+from usage_rollup import atualizar_uso_diario, USAGE_ROLLUP_INTERVAL
+
+logger = logging.getLogger('job_worker')  # __name__ é __mp_main__ nos processos spawn
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', '2'))
+# Intervalo entre consultas à fila quando não há jobs (segundos)
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', '1'))
+# Intervalo de atualização do progresso e de verificação de cancelamento (segundos)
+JOB_HEARTBEAT_INTERVAL = float(os.getenv('JOB_HEARTBEAT_INTERVAL', '2'))
+# Job em execução sem heartbeat há mais que isso é considerado abandonado (worker morreu)
+JOB_STALE_SECONDS = int(os.getenv('JOB_STALE_SECONDS', '120'))
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+def reservar_proximo_job(nome_worker):
+    """
+    Marca o job mais antigo da fila como em execução por este worker
+
+    A reserva é um UPDATE condicionado a status='queued': se outro worker pegou o
+    mesmo job, nenhuma linha é alterada e o próximo da fila é tentado
+
+    Returns:
+        int: id do job reservado, ou None se a fila estiver vazia
+    """
+    while True:
+        candidato = db.session.query(GenerationJob.id).filter_by(status='queued').order_by(GenerationJob.id).first()
+        if not candidato:
+            db.session.commit()
+            return None
+
+        agora = _agora()
+        reservado = GenerationJob.query.filter_by(id=candidato.id, status='queued').update({
+            'status': 'running',
+            'worker': nome_worker,
+            'started_at': agora,
+            'heartbeat_at': agora
+        }, synchronize_session=False)
+        db.session.commit()
+        if reservado:
+            return candidato.id
+
+def finalizar_job(job_id, status, result_data=None, error_message=None, progress_chars=None):
+    """Grava o estado final do job"""
+    valores = {
+        'status': status,
+        'error_message': error_message,
+        'finished_at': _agora()
+    }
+    if result_data is not None:
+        valores['result_data'] = json.dumps(result_data, ensure_ascii=False)
+    if progress_chars is not None:
+        valores['progress_chars'] = progress_chars
+    GenerationJob.query.filter_by(id=job_id).update(valores, synchronize_session=False)
+    db.session.commit()
+
+def recuperar_jobs_abandonados():
+    """Marca como erro os jobs em execução cujo worker parou de enviar heartbeat"""
+    limite = _agora() - timedelta(seconds=JOB_STALE_SECONDS)
+    abandonados = GenerationJob.query.filter(
+        GenerationJob.status == 'running',
+        GenerationJob.heartbeat_at < limite
+    ).update({
+        'status': 'error',
+        'error_message': 'Worker interrompido durante a execução do job',
+        'finished_at': _agora()
+    }, synchronize_session=False)
+    db.session.commit()
+    if abandonados:
+        logger.warning(f"[JOBS] {abandonados} job(s) abandonado(s) marcado(s) como erro")
+
+def _heartbeat(job_id, progresso, cancelado, parar):
+    """Atualiza progresso/heartbeat do job e verifica pedidos de cancelamento (thread própria)"""
+    with app.app_context():
+        while not parar.wait(JOB_HEARTBEAT_INTERVAL):
+            try:
+                GenerationJob.query.filter_by(id=job_id).update({
+                    'heartbeat_at': _agora(),
+                    'progress_chars': progresso['chars']
+                }, synchronize_session=False)
+                db.session.commit()
+                if db.session.query(GenerationJob.cancel_requested).filter_by(id=job_id).scalar():
+                    cancelado.set()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"[JOBS] Erro ao atualizar heartbeat do job {job_id}: {e}")
+        db.session.remove()
+
+def executar_job(job_id):
+    """Executa a geração/ajuste de um job reservado e grava o resultado"""
+    job = db.session.get(GenerationJob, job_id)
+    data = json.loads(job.request_data)
+    usuario = db.session.get(User, job.user_id)
+    preparar = preparar_prompt_geracao if job.action == 'generate' else preparar_prompt_ajuste
+
+    progresso = {'chars': 0}
+    cancelado = threading.Event()
+    parar = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job_id, progresso, cancelado, parar), daemon=True)
+    heartbeat.start()
+
+    # As funções das rotas usam current_user (logs de uso por usuário)
+    with app.test_request_context():
+        login_user(usuario)
+        finalizado = False
+        try:
+            try:
+                contexto, erro = preparar(data)
+            except Exception as e:
+                registrar_erro_geracao(f"{job.action}_{data.get('objetivo', 'minuta')}", data, e)
+                contexto, erro = None, str(e)
+            if erro:
+                finalizar_job(job_id, 'error', error_message=erro)
+                return
+
+            # Cancelado durante a preparação (resumo das peças): não chega a chamar o modelo
+            if cancelado.is_set():
+                finalizar_job(job_id, 'cancelled', error_message='Cancelado pelo usuário')
+                logger.info(f"[JOBS] Job {job_id} cancelado antes da geração")
+                return
+
+            eventos = eventos_geracao(
+                f"{job.action}_{contexto['objetivo']}", data, contexto,
+                motivo_interrupcao='Job cancelado pelo usuário'
+            )
+            try:
+                for evento, dados in eventos:
+                    if cancelado.is_set():
+                        break
+                    if evento == 'delta':
+                        progresso['chars'] += len(dados['text'])
+                    elif evento == 'done':
+                        finalizar_job(job_id, 'done', result_data=dados, progress_chars=progresso['chars'])
+                        finalizado = True
+                    elif evento == 'error':
+                        finalizar_job(job_id, 'error', result_data=dados, error_message=dados.get('error'))
+                        finalizado = True
+            finally:
+                # Cancelado: registra o uso parcial e fecha a conexão com o provedor
+                eventos.close()
+
+            if not finalizado:
+                finalizar_job(job_id, 'cancelled', error_message='Cancelado pelo usuário', progress_chars=progresso['chars'])
+                logger.info(f"[JOBS] Job {job_id} cancelado após {progresso['chars']} caracteres")
+        finally:
+            parar.set()
+            heartbeat.join()
+
+def loop_worker(indice):
+    """Loop de um processo worker: reserva e executa jobs até ser encerrado"""
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+    nome_worker = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"[JOBS] Worker {indice} iniciado ({nome_worker})")
+
+    ultima_recuperacao = 0.0
+    ultima_agregacao = 0.0
+    with app.app_context():
+        while True:
+            try:
+                if time.monotonic() - ultima_recuperacao > JOB_STALE_SECONDS / 2:
+                    recuperar_jobs_abandonados()
+                    ultima_recuperacao = time.monotonic()
+
+                # Agregados diários de uso em dia mesmo sem acessos às páginas de estatísticas
+                if time.monotonic() - ultima_agregacao > USAGE_ROLLUP_INTERVAL:
+                    atualizar_uso_diario()
+                    ultima_agregacao = time.monotonic()
+
+                job_id = reservar_proximo_job(nome_worker)
+                if job_id is None:
+                    time.sleep(JOB_POLL_INTERVAL)
+                    continue
+
+                logger.info(f"[JOBS] Job {job_id} iniciado")
+                inicio = time.monotonic()
+                try:
+                    executar_job(job_id)
+                except Exception as e:
+                    db.session.rollback()
+                    logger.error(f"[JOBS] Erro ao executar job {job_id}: {e}")
+                    finalizar_job(job_id, 'error', error_message=str(e))
+                logger.info(f"[JOBS] Job {job_id} finalizado em {time.monotonic() - inicio:.1f}s")
+            except Exception as e:
+                # Ex.: banco bloqueado por outra escrita; tentar de novo no próximo ciclo
+                db.session.rollback()
+                logger.error(f"[JOBS] Erro no loop do worker: {e}")
+                time.sleep(JOB_POLL_INTERVAL)
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Workers dos jobs de geração do DIRIA')
+    parser.add_argument('--workers', type=int, default=JOB_WORKERS, help='Número de processos worker')
+    args = parser.parse_args()
+
+    print(f"🚀 Iniciando {args.workers} worker(s) de jobs de geração...")
+    # spawn: cada worker importa a aplicação do zero (sem conexões/threads herdadas)
+    contexto = multiprocessing.get_context('spawn')
+    processos = [contexto.Process(target=loop_worker, args=(indice,), daemon=True) for indice in range(args.workers)]
+    for processo in processos:
+        processo.start()
+
+    def encerrar(signum, frame):
+        print("🛑 Encerrando workers...")
+        for processo in processos:
+            processo.terminate()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, encerrar)
+    signal.signal(signal.SIGINT, encerrar)
+
+    # Reiniciar workers que morrerem
+    while True:
+        time.sleep(5)
+        for indice, processo in enumerate(processos):
+            if not processo.is_alive():
+                print(f"⚠️  Worker {indice} encerrado (código {processo.exitcode}), reiniciando...")
+                processos[indice] = contexto.Process(target=loop_worker, args=(indice,), daemon=True)
+                processos[indice].start()
+
+if __name__ == '__main__':
+    main()
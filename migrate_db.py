@@ -5,8 +5,10 @@ Atualiza a estrutura do banco conforme necessário
 """
 
 import os
+import re
 import sys
-from datetime import datetime
+import sqlite3
+from datetime import datetime, date, timedelta
 from sqlalchemy import text, inspect
 
 # Adicionar o diretório atual ao path
@@ -67,6 +69,102 @@ def create_ai_model_table():
         print("✅ Tabela ai_model já existe")
         return False
 
+def create_document_text_cache_table():
+    """Cria a tabela DocumentTextCache se não existir"""
+    if not check_table_exists('document_text_cache'):
+        print("🔄 Criando tabela document_text_cache...")
+        
+        # Importar o modelo
+        from app import DocumentTextCache
+        
+        # Criar a tabela
+        DocumentTextCache.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela document_text_cache criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela document_text_cache já existe")
+        return False
+
+def create_document_summary_cache_table():
+    """Cria a tabela DocumentSummaryCache se não existir"""
+    if not check_table_exists('document_summary_cache'):
+        print("🔄 Criando tabela document_summary_cache...")
+        
+        # Importar o modelo
+        from app import DocumentSummaryCache
+        
+        # Criar a tabela
+        DocumentSummaryCache.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela document_summary_cache criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela document_summary_cache já existe")
+        return False
+
+def create_generation_cache_table():
+    """Cria a tabela GenerationCache se não existir"""
+    if not check_table_exists('generation_cache'):
+        print("🔄 Criando tabela generation_cache...")
+        
+        # Importar o modelo
+        from app import GenerationCache
+        
+        # Criar a tabela
+        GenerationCache.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela generation_cache criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela generation_cache já existe")
+        return False
+
+def create_generation_job_table():
+    """Cria a tabela GenerationJob (fila dos jobs de geração) se não existir"""
+    if not check_table_exists('generation_job'):
+        print("🔄 Criando tabela generation_job...")
+        
+        # Importar o modelo
+        from app import GenerationJob
+        
+        # Criar a tabela
+        GenerationJob.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela generation_job criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela generation_job já existe")
+        return False
+
+def create_generation_lock_table():
+    """Cria a tabela GenerationLock (gerações em andamento entre processos) se não existir"""
+    if not check_table_exists('generation_lock'):
+        print("🔄 Criando tabela generation_lock...")
+        
+        # Importar o modelo
+        from app import GenerationLock
+        
+        # Criar a tabela
+        GenerationLock.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela generation_lock criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela generation_lock já existe")
+        return False
+
+def create_rate_limit_bucket_table():
+    """Cria a tabela RateLimitBucket (saldo dos limites de taxa dos provedores) se não existir"""
+    if not check_table_exists('rate_limit_bucket'):
+        print("🔄 Criando tabela rate_limit_bucket...")
+        
+        # Importar o modelo
+        from app import RateLimitBucket
+        
+        # Criar a tabela
+        RateLimitBucket.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela rate_limit_bucket criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela rate_limit_bucket já existe")
+        return False
+
 def create_adjustment_prompt_config():
     """Cria a configuração padrão do prompt de ajuste se não existir"""
     try:
@@ -141,6 +239,356 @@ def add_objetivo_column_to_prompt():
         print(f"❌ Erro ao adicionar coluna 'objetivo': {e}")
         return False
 
+def add_metodo_extracao_column_to_document_text_cache():
+    """Adiciona a coluna 'metodo_extracao' na tabela DocumentTextCache se não existir"""
+    try:
+        # Verificar se a coluna já existe
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('document_text_cache')]
+        
+        if 'metodo_extracao' not in columns:
+            print("🔄 Adicionando coluna 'metodo_extracao' na tabela document_text_cache...")
+            
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE document_text_cache ADD COLUMN metodo_extracao VARCHAR(20)"))
+                conn.commit()
+            
+            print("✅ Coluna 'metodo_extracao' adicionada com sucesso!")
+            return True
+        else:
+            print("✅ Coluna 'metodo_extracao' já existe na tabela document_text_cache")
+            return False
+    except Exception as e:
+        print(f"❌ Erro ao adicionar coluna 'metodo_extracao': {e}")
+        return False
+
+def add_cache_columns_to_usage_log():
+    """Adiciona as colunas de tokens do cache de prompt na tabela UsageLog se não existirem"""
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('usage_log')]
+        
+        added = False
+        for column in ('cache_read_tokens', 'cache_creation_tokens'):
+            if column not in columns:
+                print(f"🔄 Adicionando coluna '{column}' na tabela usage_log...")
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE usage_log ADD COLUMN {column} INTEGER DEFAULT 0"))
+                    conn.commit()
+                print(f"✅ Coluna '{column}' adicionada com sucesso!")
+                added = True
+        
+        if not added:
+            print("✅ Colunas de cache de prompt já existem na tabela usage_log")
+        return added
+    except Exception as e:
+        print(f"❌ Erro ao adicionar colunas de cache na tabela usage_log: {e}")
+        return False
+
+def add_cache_hit_column_to_usage_log():
+    """Adiciona a coluna 'cache_hit' na tabela UsageLog se não existir"""
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('usage_log')]
+        
+        if 'cache_hit' not in columns:
+            print("🔄 Adicionando coluna 'cache_hit' na tabela usage_log...")
+            with db.engine.connect() as conn:
+                conn.execute(text("ALTER TABLE usage_log ADD COLUMN cache_hit BOOLEAN DEFAULT 0"))
+                conn.commit()
+            print("✅ Coluna 'cache_hit' adicionada com sucesso!")
+            return True
+        else:
+            print("✅ Coluna 'cache_hit' já existe na tabela usage_log")
+            return False
+    except Exception as e:
+        print(f"❌ Erro ao adicionar coluna cache_hit: {e}")
+        return False
+
+def create_usage_daily_table():
+    """Cria a tabela UsageDaily (agregados diários de uso) e agrega os logs existentes"""
+    if not check_table_exists('usage_daily'):
+        print("🔄 Criando tabela usage_daily...")
+        
+        # Importar o modelo
+        from app import UsageDaily
+        from usage_rollup import atualizar_uso_diario
+        
+        # Criar a tabela
+        UsageDaily.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela usage_daily criada com sucesso!")
+        
+        print("🔄 Agregando os logs de uso existentes...")
+        print(f"✅ {atualizar_uso_diario()} log(s) agregado(s)")
+        return True
+    else:
+        print("✅ Tabela usage_daily já existe")
+        return False
+
+def add_cost_columns_to_usage_log():
+    """Adiciona as colunas de custo na tabela UsageLog e preenche os logs existentes com o preço atual dos modelos"""
+    try:
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('usage_log')]
+        
+        added = False
+        for column in ('input_cost_usd', 'output_cost_usd'):
+            if column not in columns:
+                print(f"🔄 Adicionando coluna '{column}' na tabela usage_log...")
+                with db.engine.connect() as conn:
+                    conn.execute(text(f"ALTER TABLE usage_log ADD COLUMN {column} FLOAT"))
+                    conn.commit()
+                print(f"✅ Coluna '{column}' adicionada com sucesso!")
+                added = True
+        
+        if not added:
+            print("✅ Colunas de custo já existem na tabela usage_log")
+            return False
+        
+        # Mesma estimativa de admin_logs: sem a divisão entrada/saída, 50% de cada. Logs de
+        # modelos sem preço cadastrado ficam sem custo gravado (NULL, e não 0)
+        print("🔄 Calculando o custo dos logs existentes...")
+        with db.engine.connect() as conn:
+            result = conn.execute(text("""
+                UPDATE usage_log SET
+                    input_cost_usd = (
+                        CASE WHEN request_tokens AND response_tokens THEN request_tokens
+                             ELSE COALESCE(tokens_used, 0) / 2 END
+                    ) * (SELECT price_input FROM ai_model WHERE ai_model.model_id = usage_log.model_used) / 1000000.0,
+                    output_cost_usd = (
+                        CASE WHEN request_tokens AND response_tokens THEN response_tokens
+                             ELSE COALESCE(tokens_used, 0) - COALESCE(tokens_used, 0) / 2 END
+                    ) * (SELECT price_output FROM ai_model WHERE ai_model.model_id = usage_log.model_used) / 1000000.0
+                WHERE input_cost_usd IS NULL
+                  AND model_used IN (SELECT model_id FROM ai_model)
+            """))
+            conn.commit()
+        print(f"✅ Custo calculado para {result.rowcount} log(s)")
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao adicionar colunas de custo na tabela usage_log: {e}")
+        return False
+
+def add_numero_processo_column_to_debug_request():
+    """Adiciona a coluna 'numero_processo' na tabela DebugRequest e a preenche a partir de request_data"""
+    try:
+        import json
+        from debug_search import normalizar_numero_processo
+        
+        inspector = inspect(db.engine)
+        columns = [col['name'] for col in inspector.get_columns('debug_request')]
+        
+        if 'numero_processo' in columns:
+            print("✅ Coluna 'numero_processo' já existe na tabela debug_request")
+            return False
+        
+        print("🔄 Adicionando coluna 'numero_processo' na tabela debug_request...")
+        with db.engine.connect() as conn:
+            conn.execute(text("ALTER TABLE debug_request ADD COLUMN numero_processo VARCHAR(30)"))
+            conn.commit()
+            print("✅ Coluna 'numero_processo' adicionada com sucesso!")
+            
+            print("🔄 Extraindo o número do processo das requisições existentes...")
+            last_id, filled = 0, 0
+            while True:
+                rows = conn.execute(text(
+                    "SELECT id, request_data FROM debug_request WHERE id > :last_id ORDER BY id LIMIT 500"
+                ), {'last_id': last_id}).all()
+                if not rows:
+                    break
+                for row_id, request_data in rows:
+                    try:
+                        data = json.loads(request_data or '{}')
+                    except json.JSONDecodeError:
+                        continue
+                    numero = normalizar_numero_processo(data.get('numero_processo')) if isinstance(data, dict) else None
+                    if numero:
+                        conn.execute(text("UPDATE debug_request SET numero_processo = :numero WHERE id = :id"),
+                                     {'numero': numero, 'id': row_id})
+                        filled += 1
+                conn.commit()
+                last_id = rows[-1][0]
+        print(f"✅ Número do processo preenchido em {filled} requisição(ões)")
+        return True
+    except Exception as e:
+        print(f"❌ Erro ao adicionar coluna numero_processo: {e}")
+        return False
+
+def create_debug_request_fts_table():
+    """
+    Cria o índice de texto completo (FTS5) das requisições de debug e indexa as existentes
+    Retoma a indexação se a tabela existe mas a indexação anterior não terminou
+    """
+    import json
+    import debug_search
+    import debug_storage
+    
+    if check_table_exists(debug_search.TABELA_FTS):
+        print(f"✅ Tabela {debug_search.TABELA_FTS} já existe")
+    else:
+        print(f"🔄 Criando tabela {debug_search.TABELA_FTS}...")
+        if not debug_search.criar_indice():
+            print("❌ SQLite sem suporte a FTS5: busca livre no debug indisponível")
+            return False
+        print(f"✅ Tabela {debug_search.TABELA_FTS} criada com sucesso!")
+    
+    # Só as requisições ainda fora do índice (retoma uma indexação interrompida)
+    not_indexed = f"id NOT IN (SELECT rowid FROM {debug_search.TABELA_FTS})"
+    pending = db.session.execute(text(f"SELECT COUNT(*) FROM debug_request WHERE {not_indexed}")).scalar()
+    if not pending:
+        print("✅ Nenhuma requisição de debug a indexar")
+        return False
+    
+    # SQL direto (e não o modelo): as colunas de debug_blob podem ainda não existir
+    columns = [col['name'] for col in inspect(db.engine).get_columns('debug_request')]
+    blob_columns = "prompt_blob, response_blob" if 'prompt_blob' in columns else "NULL, NULL"
+    
+    print(f"🔄 Indexando {pending} requisição(ões) existente(s)...")
+    last_id, indexed = 0, 0
+    while True:
+        rows = db.session.execute(text(
+            f"SELECT id, prompt_used, response_data, {blob_columns} FROM debug_request "
+            f"WHERE id > :last_id AND {not_indexed} ORDER BY id LIMIT 200"
+        ), {'last_id': last_id}).all()
+        if not rows:
+            break
+        for row_id, prompt_used, response_data, prompt_blob, response_blob in rows:
+            if prompt_blob:
+                prompt_used = debug_storage.ler(prompt_blob)
+            try:
+                resposta = debug_search.texto_resposta(
+                    debug_storage.ler(response_blob) if response_blob else json.loads(response_data or '{}')
+                )
+            except json.JSONDecodeError:
+                resposta = ''
+            debug_search.indexar(row_id, prompt_used, resposta)
+            indexed += 1
+        db.session.commit()
+        last_id = rows[-1][0]
+    print(f"✅ {indexed} requisição(ões) indexada(s)")
+    return True
+
+def create_debug_blob_table():
+    """Cria a tabela DebugBlob (dados comprimidos das requisições de debug) se não existir"""
+    if not check_table_exists('debug_blob'):
+        print("🔄 Criando tabela debug_blob...")
+        
+        # Importar o modelo
+        from app import DebugBlob
+        
+        # Criar a tabela
+        DebugBlob.__table__.create(db.engine, checkfirst=True)
+        print("✅ Tabela debug_blob criada com sucesso!")
+        return True
+    else:
+        print("✅ Tabela debug_blob já existe")
+        return False
+
+def compress_debug_request_payloads():
+    """
+    Move os dados das requisições de debug (requisição, resposta, prompt e tokens) para
+    debug_blob, comprimidos e deduplicados, e compacta o banco (VACUUM)
+    """
+    import json
+    import debug_storage
+    
+    changes = False
+    inspector = inspect(db.engine)
+    columns = [col['name'] for col in inspector.get_columns('debug_request')]
+    new_columns = ['request_blob', 'response_blob', 'prompt_blob', 'tokens_blob']
+    
+    missing = [column for column in new_columns if column not in columns]
+    if missing:
+        print(f"🔄 Adicionando colunas {', '.join(missing)} na tabela debug_request...")
+        with db.engine.connect() as conn:
+            for column in missing:
+                conn.execute(text(f"ALTER TABLE debug_request ADD COLUMN {column} VARCHAR(64)"))
+            conn.commit()
+        print("✅ Colunas adicionadas com sucesso!")
+        changes = True
+    else:
+        print("✅ Colunas de debug_blob já existem na tabela debug_request")
+    
+    print("🔄 Comprimindo os dados das requisições de debug...")
+    last_id, converted, kept = 0, 0, 0
+    while True:
+        rows = db.session.execute(text(
+            "SELECT id, request_data, response_data, prompt_used, tokens_info FROM debug_request "
+            "WHERE id > :last_id AND request_blob IS NULL ORDER BY id LIMIT 100"
+        ), {'last_id': last_id}).all()
+        if not rows:
+            break
+        for row_id, request_data, response_data, prompt_used, tokens_info in rows:
+            try:
+                request_value = json.loads(request_data or 'null')
+                response_value = json.loads(response_data or 'null')
+                tokens_value = json.loads(tokens_info) if tokens_info else None
+            except json.JSONDecodeError:
+                # Mantida como está (exibida pelas colunas antigas)
+                kept += 1
+                continue
+            corpos = debug_storage.corpos(request_value, response_value)
+            db.session.execute(text(
+                "UPDATE debug_request SET request_blob = :request_blob, response_blob = :response_blob, "
+                "prompt_blob = :prompt_blob, tokens_blob = :tokens_blob, "
+                "request_data = '', response_data = '', prompt_used = NULL, tokens_info = NULL WHERE id = :id"
+            ), {
+                'id': row_id,
+                'request_blob': debug_storage.guardar(request_value, corpos),
+                'response_blob': debug_storage.guardar(response_value, corpos),
+                'prompt_blob': debug_storage.guardar(prompt_used or None, corpos),
+                'tokens_blob': debug_storage.guardar(tokens_value),
+            })
+            converted += 1
+        db.session.commit()
+        last_id = rows[-1][0]
+    
+    if kept:
+        print(f"⚠️ {kept} requisição(ões) com JSON inválido mantida(s) sem compressão")
+    if not converted:
+        print("✅ Nenhuma requisição de debug a comprimir")
+        return changes
+    print(f"✅ {converted} requisição(ões) comprimida(s)")
+    
+    # O espaço liberado só volta ao sistema de arquivos depois do VACUUM
+    database = db.engine.url.database
+    size_before = os.path.getsize(database) if database and os.path.exists(database) else None
+    print("🔄 Compactando o banco (VACUUM)...")
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        conn.execute(text("VACUUM"))
+    if size_before:
+        size_after = os.path.getsize(database)
+        print(f"✅ Banco compactado: {size_before / 1048576:.1f} MB → {size_after / 1048576:.1f} MB")
+    else:
+        print("✅ Banco compactado")
+    return True
+
+def create_query_indexes():
+    """Cria os índices das consultas mais frequentes (declarados nos modelos) que ainda não existem"""
+    from app import UsageLog, DebugRequest, Prompt
+    
+    inspector = inspect(db.engine)
+    created = False
+    for model in (UsageLog, DebugRequest, Prompt):
+        table = model.__table__
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in sorted(table.indexes, key=lambda index: index.name):
+            if index.name in existing:
+                continue
+            print(f"🔄 Criando índice {index.name}...")
+            index.create(db.engine, checkfirst=True)
+            print(f"✅ Índice {index.name} criado com sucesso!")
+            created = True
+    
+    if created:
+        # Atualizar as estatísticas usadas pelo planejador de consultas
+        with db.engine.connect() as conn:
+            conn.execute(text("ANALYZE"))
+            conn.commit()
+    else:
+        print("✅ Índices das consultas já existem")
+    return created
+
 def migrate_database():
     """Executa todas as migrações necessárias"""
     print("🚀 Iniciando migração do banco de dados...")
@@ -164,6 +612,22 @@ def migrate_database():
             ("Tabela AIModel", create_ai_model_table),
             ("Configuração do Prompt de Ajuste", create_adjustment_prompt_config),
             ("Coluna objetivo na tabela Prompt", add_objetivo_column_to_prompt),
+            ("Tabela DocumentTextCache", create_document_text_cache_table),
+            ("Coluna metodo_extracao na tabela DocumentTextCache", add_metodo_extracao_column_to_document_text_cache),
+            ("Colunas de cache de prompt na tabela UsageLog", add_cache_columns_to_usage_log),
+            ("Tabela DocumentSummaryCache", create_document_summary_cache_table),
+            ("Tabela GenerationJob", create_generation_job_table),
+            ("Tabela GenerationCache", create_generation_cache_table),
+            ("Coluna cache_hit na tabela UsageLog", add_cache_hit_column_to_usage_log),
+            ("Tabela GenerationLock", create_generation_lock_table),
+            ("Tabela RateLimitBucket", create_rate_limit_bucket_table),
+            ("Colunas de custo na tabela UsageLog", add_cost_columns_to_usage_log),
+            ("Tabela UsageDaily", create_usage_daily_table),
+            ("Coluna numero_processo na tabela DebugRequest", add_numero_processo_column_to_debug_request),
+            ("Índices das consultas frequentes", create_query_indexes),
+            ("Índice de texto completo do debug", create_debug_request_fts_table),
+            ("Tabela DebugBlob", create_debug_blob_table),
+            ("Compressão dos dados do debug", compress_debug_request_payloads),
         ]
         
         # Executar migrações
@@ -202,7 +666,10 @@ def show_status():
             'user', 'prompt', 'usage_log', 'app_config', 
             'general_instructions', 
             'api_key', 'eproc_credentials', 'dollar_rate', 
-            'ai_model', 'debug_request'
+            'ai_model', 'debug_request', 'document_text_cache',
+            'document_summary_cache', 'generation_job', 'generation_cache',
+            'generation_lock', 'rate_limit_bucket', 'usage_daily',
+            'debug_request_fts', 'debug_blob'
         ]
         
         # Verificar configurações obrigatórias
@@ -225,6 +692,102 @@ def show_status():
             else:
                 print(f"  ❌ {table} (faltando)")
 
+def consultas_auditadas():
+    """Consultas frequentes verificadas pelo comando audit: [(descrição, consulta)]"""
+    from app import UsageLog, UsageDaily, DebugRequest, Prompt, AIModel, GenerationCache, consultar_debug_requests
+    from usage_rollup import SQL_AGREGAR
+    
+    fim = date.today()
+    inicio = fim - timedelta(days=30)
+    return [
+        ("admin_logs: últimos logs", UsageLog.query.order_by(UsageLog.created_at.desc()).limit(100)),
+        ("admin_logs: logs do período", UsageLog.query.filter(
+            UsageLog.created_at >= inicio, UsageLog.created_at < fim
+        ).order_by(UsageLog.created_at.desc()).limit(100)),
+        ("admin_stats: custos por modelo no período", db.session.query(
+            UsageDaily.model_used, db.func.sum(UsageDaily.cost_usd)
+        ).filter(UsageDaily.date >= inicio, UsageDaily.date <= fim).group_by(UsageDaily.model_used)),
+        ("usage_rollup: agregação dos logs novos", (SQL_AGREGAR, {'marca': 0, 'ate': 1000})),
+        ("get_debug_requests: período", consultar_debug_requests(start_date=inicio, end_date=fim).limit(30)),
+        ("get_debug_requests: usuário", consultar_debug_requests(user_id=1).limit(30)),
+        ("get_debug_requests: número do processo", consultar_debug_requests(numero_processo='5001234-56.2024.4.02.5101').limit(30)),
+        ("get_debug_requests: início do número do processo", consultar_debug_requests(numero_processo='5001234').limit(30)),
+        ("get_debug_requests: busca livre", consultar_debug_requests(busca='aposentadoria especial').limit(30)),
+        ("debug_storage: leitura dos blobs", (
+            "SELECT sha256, compression, data FROM debug_blob WHERE sha256 IN (:sha1, :sha2)", {'sha1': '0', 'sha2': '1'}
+        )),
+        ("get_user_debug_requests", DebugRequest.query.filter_by(user_id=1).order_by(DebugRequest.created_at.desc()).limit(20)),
+        ("get_prompts_by_objetivo", Prompt.query.filter_by(objetivo='minuta').order_by(Prompt.name)),
+        ("get_default_prompt_by_objetivo", Prompt.query.filter_by(objetivo='minuta', is_default=True).limit(1)),
+        ("get_model_info", AIModel.query.filter_by(model_id='modelo').limit(1)),
+        ("generation_cache.buscar", GenerationCache.query.filter(GenerationCache.cache_key == 'chave').limit(1)),
+    ]
+
+def empty_schema_copy():
+    """
+    Banco em memória com o esquema atual (tabelas e índices), sem dados nem estatísticas do
+    ANALYZE: o planejador assume tabelas grandes, como em produção, em vez de preferir
+    varreduras porque as tabelas locais são pequenas
+    """
+    copy = sqlite3.connect(':memory:')
+    with db.engine.connect() as conn:
+        rows = conn.execute(text(
+            "SELECT name, sql FROM sqlite_master WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%' "
+            "ORDER BY type = 'index'"
+        )).all()
+    # Tabelas internas das tabelas virtuais (FTS5) são criadas junto com elas
+    virtual = [name for name, sql in rows if sql.upper().startswith('CREATE VIRTUAL TABLE')]
+    for name, sql in rows:
+        if not any(name.startswith(f"{table}_") for table in virtual):
+            copy.execute(sql)
+    return copy
+
+def query_plan(conn, consulta):
+    """Linhas de EXPLAIN QUERY PLAN de uma consulta SQLAlchemy ou de um par (SQL, parâmetros)"""
+    if isinstance(consulta, tuple):
+        sql, params = consulta
+    else:
+        compiled = consulta.statement.compile(db.engine)
+        sql = str(compiled)
+        params = tuple(
+            str(value) if isinstance(value, date) else value
+            for value in (compiled.params[name] for name in compiled.positiontup)
+        )
+    return [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params)]
+
+def audit_query_plans():
+    """Verifica com EXPLAIN QUERY PLAN se as consultas frequentes usam índices (sem varreduras completas)"""
+    print("🔍 Auditoria dos planos de consulta")
+    print("-" * 50)
+    
+    problems = 0
+    with app.app_context():
+        schema = empty_schema_copy()
+        for description, consulta in consultas_auditadas():
+            try:
+                plan = query_plan(schema, consulta)
+            except Exception as e:
+                print(f"❌ {description}: erro ao obter o plano ({e})")
+                problems += 1
+                continue
+            
+            # "SCAN tabela" sem "USING ... INDEX" lê a tabela inteira
+            scans = [detail for detail in plan if re.match(r'SCAN \w+$', detail)]
+            if scans:
+                problems += 1
+                print(f"❌ {description}: varredura completa")
+            else:
+                print(f"✅ {description}")
+            for detail in plan:
+                print(f"     {detail}")
+    
+    print("-" * 50)
+    if problems:
+        print(f"⚠️  {problems} consulta(s) sem índice adequado (execute 'python migrate_db.py migrate')")
+    else:
+        print("🎉 Todas as consultas auditadas usam índices!")
+    return problems == 0
+
 def main():
     """Função principal"""
     if len(sys.argv) > 1:
@@ -237,12 +800,16 @@ def main():
         elif command == 'init':
             print("🚀 Inicializando banco de dados...")
             init_db()
+        elif command == 'audit':
+            if not audit_query_plans():
+                sys.exit(1)
         else:
             print("❌ Comando inválido!")
             print("Comandos disponíveis:")
             print("  python migrate_db.py status   - Mostra status do banco")
             print("  python migrate_db.py migrate  - Executa migrações")
             print("  python migrate_db.py init     - Inicializa banco (cria usuários padrão)")
+            print("  python migrate_db.py audit    - Verifica se as consultas frequentes usam índices")
     else:
         # Comportamento padrão: executar migração
         migrate_database() 
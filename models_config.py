@@ -3,18 +3,71 @@ Configuração dos modelos de IA por fabricante
 Facilita a adição de novos modelos conforme são lançados
 """
 
+import threading
+import time
+
 # Configuração dos modelos de IA por fabricante
 # NOTA: Esta configuração foi migrada para o banco de dados
 # Os modelos agora são gerenciados dinamicamente através da tabela AIModel
 
+# Cache em memória da tabela ai_model (evita uma consulta ao banco por lookup)
+# O cache é recarregado quando expira ou quando a tabela é alterada por este processo
+MODEL_CACHE_TTL = 60  # segundos (outros workers do gunicorn enxergam mudanças após esse prazo)
+
+_model_cache = None
+_model_cache_loaded_at = 0.0
+_model_cache_lock = threading.Lock()
+
+def _model_to_info(model) -> dict:
+    """Converte um registro AIModel no dicionário de informações usado pela aplicação"""
+    return {
+        "provider": model.provider,
+        "provider_name": model.provider.title(),
+        "model_id": model.model_id,
+        "display_name": model.display_name,
+        "description": model.description,
+        "max_tokens": model.max_tokens,
+        "context_window": model.context_window,
+        "price_input": model.price_input,
+        "price_output": model.price_output,
+        "available": model.is_enabled
+    }
+
+def _load_model_cache() -> dict:
+    """Carrega todos os modelos do banco para o cache (sem filtrar por is_enabled)"""
+    from app import app, AIModel
+    with app.app_context():
+        models = AIModel.query.order_by(AIModel.id).all()
+        return {model.model_id: _model_to_info(model) for model in models}
+
+def _get_model_cache() -> dict:
+    """Retorna o cache de modelos, recarregando do banco se necessário"""
+    global _model_cache, _model_cache_loaded_at
+    
+    cache = _model_cache
+    if cache is not None and time.monotonic() - _model_cache_loaded_at < MODEL_CACHE_TTL:
+        return cache
+    
+    with _model_cache_lock:
+        # Outra thread pode ter recarregado enquanto esperávamos o lock
+        if _model_cache is not None and time.monotonic() - _model_cache_loaded_at < MODEL_CACHE_TTL:
+            return _model_cache
+        
+        _model_cache = _load_model_cache()
+        _model_cache_loaded_at = time.monotonic()
+        return _model_cache
+
+def invalidate_model_cache():
+    """Descarta o cache de modelos (chamar após alterar a tabela ai_model)"""
+    global _model_cache, _model_cache_loaded_at
+    with _model_cache_lock:
+        _model_cache = None
+        _model_cache_loaded_at = 0.0
+
 def get_all_models() -> list:
     """Retorna lista de todos os modelos disponíveis (apenas do banco)"""
     try:
-        from app import app, AIModel
-        with app.app_context():
-            # Carregar do banco
-            db_models = AIModel.query.filter_by(is_enabled=True).all()
-            return [model.model_id for model in db_models]
+        return [model_id for model_id, info in _get_model_cache().items() if info["available"]]
     except Exception as e:
         print(f"⚠️  Erro ao carregar modelos do banco: {e}")
         return []  # Retornar lista vazia se não conseguir acessar banco
@@ -22,10 +75,10 @@ def get_all_models() -> list:
 def get_models_by_provider(provider: str) -> list:
     """Retorna lista de modelos de um fabricante específico (apenas do banco)"""
     try:
-        from app import app, AIModel
-        with app.app_context():
-            models = AIModel.query.filter_by(provider=provider, is_enabled=True).all()
-            return [model.model_id for model in models]
+        return [
+            model_id for model_id, info in _get_model_cache().items()
+            if info["provider"] == provider and info["available"]
+        ]
     except Exception as e:
         print(f"⚠️  Erro ao carregar modelos do provedor {provider}: {e}")
         return []
@@ -33,23 +86,10 @@ def get_models_by_provider(provider: str) -> list:
 def get_model_info(model_id: str) -> dict:
     """Retorna informações de um modelo específico (apenas do banco)"""
     try:
-        from app import app, AIModel
-        with app.app_context():
-            # Buscar no banco (sem filtrar por is_enabled)
-            model = AIModel.query.filter_by(model_id=model_id).first()
-            if model:
-                return {
-                    "provider": model.provider,
-                    "provider_name": model.provider.title(),
-                    "model_id": model.model_id,
-                    "display_name": model.display_name,
-                    "description": model.description,
-                    "max_tokens": model.max_tokens,
-                    "context_window": model.context_window,
-                    "price_input": model.price_input,
-                    "price_output": model.price_output,
-                    "available": model.is_enabled
-                }
+        # Buscar no cache (sem filtrar por is_enabled)
+        info = _get_model_cache().get(model_id)
+        if info:
+            return dict(info)  # Cópia para que o chamador não altere o cache
     except Exception as e:
         print(f"⚠️  Erro ao buscar modelo no banco: {e}")
     
@@ -58,10 +98,8 @@ def get_model_info(model_id: str) -> dict:
 def get_provider_for_model(model_id: str) -> str:
     """Retorna o fabricante de um modelo (apenas do banco)"""
     try:
-        from app import app, AIModel
-        with app.app_context():
-            model = AIModel.query.filter_by(model_id=model_id).first()
-            return model.provider if model else None
+        info = _get_model_cache().get(model_id)
+        return info["provider"] if info else None
     except Exception as e:
         print(f"⚠️  Erro ao buscar provedor do modelo: {e}")
         return None
@@ -139,6 +177,7 @@ def add_new_model(provider: str, model_id: str, display_name: str, description:
             )
             db.session.add(model)
             db.session.commit()
+            invalidate_model_cache()
             print(f"✅ Modelo '{model_id}' adicionado ao banco")
     except Exception as e:
         print(f"❌ Erro ao adicionar modelo: {e}")
@@ -152,6 +191,7 @@ def disable_model(model_id: str):
             if model:
                 model.is_enabled = False
                 db.session.commit()
+                invalidate_model_cache()
                 print(f"✅ Modelo '{model_id}' desabilitado")
             else:
                 print(f"❌ Modelo '{model_id}' não encontrado")
@@ -167,6 +207,7 @@ def enable_model(model_id: str):
             if model:
                 model.is_enabled = True
                 db.session.commit()
+                invalidate_model_cache()
                 print(f"✅ Modelo '{model_id}' habilitado")
             else:
                 print(f"❌ Modelo '{model_id}' não encontrado")
@@ -0,0 +1,283 @@
+"""
+Extração de texto de PDFs em processos separados
+Divide o PDF em intervalos de páginas, extrai em paralelo e remonta o texto na ordem,
+respeitando um tempo máximo por documento para não prender o worker web.
+Cada página passa primeiro pelo PyPDF2 e só vai para o pdfplumber (análise de layout,
+bem mais lenta) se o texto obtido não passar nos critérios de qualidade
+"""
+
+import io
+import os
+import re
+import time
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+import PyPDF2
+import pdfplumber
+
+logger = logging.getLogger(__name__)
+
+# Processos dedicados à extração (compartilhados por todas as requisições do worker)
+PDF_WORKERS = int(os.getenv('PDF_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+# Páginas por tarefa enviada ao pool
+PDF_PAGINAS_POR_LOTE = int(os.getenv('PDF_PAGINAS_POR_LOTE', '10'))
+# Tempo máximo de extração por documento (segundos)
+PDF_TEMPO_MAXIMO = float(os.getenv('PDF_TEMPO_MAXIMO', '60'))
+
+# Critérios para aceitar o texto do caminho rápido (PyPDF2) sem passar pelo pdfplumber
+PDF_MIN_CARACTERES_PAGINA = 20
+PDF_MAX_PROPORCAO_MOJIBAKE = 0.02
+_MOJIBAKE_RE = re.compile('[ÃÂ][\x80-\xbf¡-¿]')
+
+# Métodos de extração registrados por documento
+METODO_RAPIDO = 'pypdf2'
+METODO_LAYOUT = 'pdfplumber'
+METODO_MISTO = 'misto'
+
+_executor = None
+_executor_pid = None
+_executor_lock = threading.Lock()
+
+def _get_executor() -> ProcessPoolExecutor:
+    """Retorna o pool de extração, criando-o no primeiro uso (e após um fork do gunicorn)"""
+    global _executor, _executor_pid
+    with _executor_lock:
+        if _executor is None or _executor_pid != os.getpid():
+            # spawn: os processos filhos não herdam threads/conexões do worker web
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _executor_pid = os.getpid()
+            logger.info(f"[PDF] Pool de extração iniciado com {PDF_WORKERS} processo(s)")
+        return _executor
+
+def _descartar_executor():
+    """Descarta o pool (ex.: um processo filho morreu); o próximo uso cria outro"""
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+def _pagina_aceitavel(texto: str) -> bool:
+    """
+    Avalia se o texto de uma página extraído pelo caminho rápido é bom o suficiente
+
+    Reprova páginas vazias ou quase vazias, com caracteres corrompidos (mojibake,
+    caractere de substituição, controle) ou com palavras coladas (sem espaços)
+    """
+    texto = (texto or "").strip()
+    if len(texto) < PDF_MIN_CARACTERES_PAGINA:
+        return False
+
+    suspeitos = sum(
+        1 for c in texto
+        if c == '\ufffd' or (ord(c) < 32 and c not in '\n\r\t') or '\ue000' <= c <= '\uf8ff'
+    )
+    # Sequências típicas de UTF-8 lido como Latin-1 (ex.: "Ã©", "Ã§")
+    suspeitos += len(_MOJIBAKE_RE.findall(texto))
+    if suspeitos / len(texto) > PDF_MAX_PROPORCAO_MOJIBAKE:
+        return False
+
+    if len(texto) > 200 and texto.count(' ') / len(texto) < 0.05:
+        return False
+
+    return True
+
+def _extrair_intervalo(conteudo_bytes: bytes, inicio: int, fim: int, prazo: float) -> tuple:
+    """
+    Extrai as páginas [inicio, fim) (executado no processo filho)
+
+    Usa primeiro o PyPDF2 (sem análise de layout) e só passa pelo pdfplumber as
+    páginas cujo texto não foi aprovado em _pagina_aceitavel
+
+    Returns:
+        Tuple[list, list, bool]: (texto de cada página, método usado em cada página,
+        se todas as páginas foram processadas)
+    """
+    textos = []
+    metodos = []
+    pendentes = []
+    completo = True
+
+    pdf_reader = PyPDF2.PdfReader(io.BytesIO(conteudo_bytes))
+    for indice in range(inicio, min(fim, len(pdf_reader.pages))):
+        if time.time() > prazo:
+            completo = False
+            break
+        try:
+            texto_pagina = pdf_reader.pages[indice].extract_text() or ""
+        except Exception:
+            texto_pagina = ""
+        textos.append(texto_pagina)
+        metodos.append(METODO_RAPIDO)
+        if not _pagina_aceitavel(texto_pagina):
+            pendentes.append(indice)
+
+    if pendentes and time.time() <= prazo:
+        with pdfplumber.open(io.BytesIO(conteudo_bytes)) as pdf:
+            for indice in pendentes:
+                if time.time() > prazo:
+                    completo = False
+                    break
+                pagina = pdf.pages[indice]
+                texto_pagina = pagina.extract_text() or ""
+                # Liberar o cache de layout da página (PDFs grandes)
+                pagina.flush_cache()
+
+                posicao = indice - inicio
+                if _pagina_aceitavel(texto_pagina) or len(texto_pagina.strip()) > len(textos[posicao].strip()):
+                    textos[posicao] = texto_pagina
+                    metodos[posicao] = METODO_LAYOUT
+    elif pendentes:
+        completo = False
+
+    return textos, metodos, completo
+
+def _extrair_texto_pdfplumber(conteudo_bytes: bytes, prazo: float) -> tuple:
+    """
+    Extrai o texto do documento inteiro com pdfplumber (executado no processo filho)
+
+    Returns:
+        Tuple[str, bool]: (texto extraído, se todas as páginas foram processadas antes do prazo)
+    """
+    texto = ""
+    completo = True
+    with pdfplumber.open(io.BytesIO(conteudo_bytes)) as pdf:
+        for pagina in pdf.pages:
+            if time.time() > prazo:
+                completo = False
+                break
+            texto_pagina = pagina.extract_text()
+            if texto_pagina:
+                texto += texto_pagina + "\n"
+    return texto.strip(), completo
+
+def contar_paginas(conteudo_bytes: bytes) -> int:
+    """Conta as páginas do PDF sem fazer análise de layout"""
+    return len(PyPDF2.PdfReader(io.BytesIO(conteudo_bytes)).pages)
+
+def _extrair_paralelo(conteudo_bytes: bytes, total_paginas: int, prazo: float) -> tuple:
+    """
+    Distribui os intervalos de páginas pelo pool e remonta o texto na ordem original
+
+    Returns:
+        Tuple[str, list, bool]: (texto extraído, método usado em cada página processada, se a
+        extração terminou antes do prazo: falso também quando só a passagem pelo pdfplumber
+        das páginas reprovadas foi interrompida)
+    """
+    executor = _get_executor()
+    futures = [
+        executor.submit(_extrair_intervalo, conteudo_bytes, inicio, inicio + PDF_PAGINAS_POR_LOTE, prazo)
+        for inicio in range(0, total_paginas, PDF_PAGINAS_POR_LOTE)
+    ]
+
+    textos = []
+    metodos = []
+    interrompido = False
+    for future in futures:
+        if interrompido:
+            future.cancel()
+            continue
+        try:
+            # Margem para a tarefa devolver as páginas extraídas até o prazo
+            textos_lote, metodos_lote, completo = future.result(timeout=max(0.0, prazo - time.time()) + 5)
+        except FuturesTimeoutError:
+            future.cancel()
+            interrompido = True
+            continue
+        textos.extend(textos_lote)
+        metodos.extend(metodos_lote)
+        if not completo:
+            interrompido = True
+
+    texto = "".join(texto_pagina + "\n" for texto_pagina in textos if texto_pagina)
+    return texto.strip(), metodos, not interrompido
+
+def _metodo_documento(metodos: list) -> str:
+    """Resume os métodos por página em um método para o documento"""
+    usados = set(metodos)
+    if not usados:
+        return None
+    if usados == {METODO_RAPIDO}:
+        return METODO_RAPIDO
+    if usados == {METODO_LAYOUT}:
+        return METODO_LAYOUT
+    return METODO_MISTO
+
+def extrair_texto_pdf_detalhado(conteudo_bytes: bytes, tempo_maximo: float = None) -> tuple:
+    """
+    Extrai texto de um PDF usando o pool de processos
+
+    Args:
+        conteudo_bytes: Conteúdo do PDF
+        tempo_maximo: Tempo máximo em segundos (padrão: PDF_TEMPO_MAXIMO)
+
+    Returns:
+        Tuple[str, Dict]: (texto extraído ou mensagem de erro, informações da extração:
+        metodo, paginas, paginas_processadas, paginas_layout e completo, falso quando o tempo
+        limite interrompeu a extração e o texto é parcial)
+    """
+    prazo = time.time() + (tempo_maximo or PDF_TEMPO_MAXIMO)
+    info = {'metodo': None, 'paginas': 0, 'paginas_processadas': 0, 'paginas_layout': 0, 'completo': False}
+
+    try:
+        total_paginas = contar_paginas(conteudo_bytes)
+    except Exception as e:
+        logger.warning(f"[PDF] Não foi possível contar as páginas: {e}")
+        total_paginas = None
+
+    if total_paginas:
+        try:
+            texto, metodos, completo = _extrair_paralelo(conteudo_bytes, total_paginas, prazo)
+            info.update({
+                'metodo': _metodo_documento(metodos),
+                'paginas': total_paginas,
+                'paginas_processadas': len(metodos),
+                'paginas_layout': metodos.count(METODO_LAYOUT),
+                'completo': completo
+            })
+            logger.info(
+                f"[PDF] {len(metodos)}/{total_paginas} página(s) extraída(s), método {info['metodo']} "
+                f"({info['paginas_layout']} página(s) com pdfplumber)"
+            )
+            if not completo:
+                logger.warning(f"[PDF] Tempo limite atingido: {len(metodos)} de {total_paginas} página(s) extraída(s)")
+                if texto and len(metodos) < total_paginas:
+                    texto += f"\n\n[Extração interrompida por tempo limite: {len(metodos)} de {total_paginas} página(s) processada(s)]"
+                elif texto:
+                    texto += "\n\n[Extração interrompida por tempo limite: página(s) com texto de baixa qualidade não reprocessada(s)]"
+            return texto, info
+        except BrokenProcessPool as e:
+            logger.error(f"[PDF] Pool de extração interrompido: {e}")
+            _descartar_executor()
+            return f"Erro ao extrair texto do PDF: {str(e)}", info
+        except Exception as e:
+            print(f"Extração por páginas falhou: {e}")
+
+    # Fallback: PDF que o PyPDF2 não conseguiu abrir, tentar pdfplumber no documento inteiro
+    try:
+        if time.time() > prazo:
+            return "Erro ao extrair texto do PDF: tempo limite de extração atingido", info
+        future = _get_executor().submit(_extrair_texto_pdfplumber, conteudo_bytes, prazo)
+        texto, info['completo'] = future.result(timeout=max(0.0, prazo - time.time()) + 5)
+        info['metodo'] = METODO_LAYOUT
+        if not info['completo']:
+            logger.warning("[PDF] Tempo limite atingido na extração com pdfplumber: texto parcial")
+        return texto, info
+    except FuturesTimeoutError:
+        return "Erro ao extrair texto do PDF: tempo limite de extração atingido", info
+    except BrokenProcessPool as e:
+        _descartar_executor()
+        return f"Erro ao extrair texto do PDF: {str(e)}", info
+    except Exception as e:
+        return f"Erro ao extrair texto do PDF: {str(e)}", info
+
+def extrair_texto_pdf(conteudo_bytes: bytes, tempo_maximo: float = None) -> str:
+    """Extrai texto de um PDF usando o pool de processos (apenas o texto)"""
+    texto, _ = extrair_texto_pdf_detalhado(conteudo_bytes, tempo_maximo)
+    return texto
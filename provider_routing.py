@@ -0,0 +1,314 @@
+"""
+Roteamento das gerações entre provedores
+Camada sobre o AIManager para limitar a latência de cauda quando um provedor está
+sobrecarregado ou fora do ar:
+- erros transitórios (429, 5xx, timeout, conexão) são repetidos com backoff exponencial e jitter
+- cadeia de fallback por objetivo: quando o modelo falha, o próximo da cadeia é chamado
+- hedging opcional: se o modelo não responder (em streaming, não enviar o primeiro trecho)
+  dentro do p95 das suas latências recentes, o próximo da cadeia começa em paralelo e vale
+  o que responder primeiro
+Configuração em /admin/config (routing_fallback_chains, routing_hedging_enabled)
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+import concurrent.futures
+from collections import defaultdict, deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+import httpx
+import openai
+import anthropic
+from models_config import get_model_info
+
+logger = logging.getLogger(__name__)
+
+# Repetições do mesmo modelo em erros transitórios (além da primeira chamada)
+ROUTING_MAX_RETRIES = int(os.getenv('ROUTING_MAX_RETRIES', '2'))
+# Backoff exponencial (segundos): espera sorteada entre 0 e min(MAX, BASE * 2^tentativa)
+ROUTING_BACKOFF_BASE = float(os.getenv('ROUTING_BACKOFF_BASE', '1'))
+ROUTING_BACKOFF_MAX = float(os.getenv('ROUTING_BACKOFF_MAX', '20'))
+# Status HTTP de sobrecarga/indisponibilidade (529: Anthropic sobrecarregada)
+STATUS_REPETIVEIS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+# Hedging: prazo = p95 das latências recentes do modelo no processo
+HEDGE_PERCENTIL = 0.95
+HEDGE_MIN_AMOSTRAS = 20  # abaixo disso usa HEDGE_PRAZO_PADRAO
+HEDGE_PRAZO_PADRAO = float(os.getenv('HEDGE_DEFAULT_SECONDS', '60'))
+HEDGE_PRAZO_MINIMO = float(os.getenv('HEDGE_MIN_SECONDS', '3'))
+LATENCIA_AMOSTRAS = 200  # amostras guardadas por modelo
+
+# Tipos de latência: resposta completa (generate_response) e primeiro trecho (streaming)
+LATENCIA_TOTAL = 'total'
+LATENCIA_PRIMEIRO_TRECHO = 'primeiro_trecho'
+
+def status_erro(erro: Exception) -> Optional[int]:
+    """Status HTTP de um erro dos SDKs dos provedores (None se não houver)"""
+    status = getattr(erro, 'status_code', None)
+    if status is None:
+        status = getattr(erro, 'code', None)  # google.genai.errors.APIError
+    return status if isinstance(status, int) else None
+
+def erro_repetivel(erro: Exception) -> bool:
+    """Erro transitório, que vale repetir: sobrecarga, erro do servidor, timeout ou falha de conexão"""
+    if isinstance(erro, (openai.APIConnectionError, anthropic.APIConnectionError, httpx.TransportError,
+                         asyncio.TimeoutError, TimeoutError, ConnectionError)):
+        return True
+    return status_erro(erro) in STATUS_REPETIVEIS
+
+def espera_backoff(tentativa: int) -> float:
+    """Espera antes da próxima tentativa (tentativa 0, 1, 2...): exponencial com jitter completo"""
+    return random.uniform(0, min(ROUTING_BACKOFF_MAX, ROUTING_BACKOFF_BASE * 2 ** tentativa))
+
+def cadeias_fallback() -> Dict[str, List[str]]:
+    """Cadeias de fallback configuradas: {objetivo: [modelos]}; '*' vale para os demais objetivos"""
+    try:
+        from app import get_app_config
+        cadeias = json.loads(get_app_config('routing_fallback_chains', '{}') or '{}')
+        return cadeias if isinstance(cadeias, dict) else {}
+    except Exception as e:
+        logger.warning(f"Erro ao ler cadeias de fallback: {e}")
+        return {}
+
+def hedging_habilitado() -> bool:
+    """Verifica se o hedging está habilitado na configuração"""
+    try:
+        from app import get_app_config
+        return get_app_config('routing_hedging_enabled', 'false') == 'true'
+    except Exception as e:
+        logger.warning(f"Erro ao ler configuração de hedging: {e}")
+        return False
+
+def cadeia_modelos(model: str, objetivo: str = None, cabe: Callable[[str], bool] = None) -> List[str]:
+    """
+    Modelo pedido seguido da cadeia de fallback do objetivo (só modelos habilitados, sem repetição)
+
+    Args:
+        cabe: cabe(modelo) diz se o prompt cabe na janela de contexto do modelo; os modelos de
+            fallback em que não cabe ficam fora da cadeia (o prompt é ajustado só ao modelo pedido)
+    """
+    cadeias = cadeias_fallback()
+    cadeia = [model]
+    for candidato in cadeias.get(objetivo or '', cadeias.get('*', [])):
+        info = get_model_info(candidato)
+        if candidato in cadeia or not info or not info.get('available'):
+            continue
+        if cabe and not cabe(candidato):
+            logger.info(f"[ROTEAMENTO] {candidato} fora da cadeia de {model}: o prompt não cabe na janela de contexto")
+            continue
+        cadeia.append(candidato)
+    return cadeia
+
+def _em_thread(funcao, *args) -> concurrent.futures.Future:
+    """Executa funcao(*args) em uma thread própria, devolvendo um Future com o resultado"""
+    futuro = concurrent.futures.Future()
+
+    def executar():
+        try:
+            futuro.set_result(funcao(*args))
+        except BaseException as e:
+            futuro.set_exception(e)
+
+    threading.Thread(target=executar, name='roteamento-stream', daemon=True).start()
+    return futuro
+
+def _continuar_stream(primeiro, chunks) -> Iterator[Tuple[str, object]]:
+    """Stream a partir do primeiro trecho já recebido; fechar este gerador fecha o original"""
+    try:
+        if primeiro is not None:
+            yield primeiro
+        yield from chunks
+    finally:
+        chunks.close()
+
+class LatencyTracker:
+    """Latências recentes por modelo (no processo), usadas no prazo do hedging"""
+
+    def __init__(self):
+        self._amostras = defaultdict(lambda: deque(maxlen=LATENCIA_AMOSTRAS))
+        self._lock = threading.Lock()
+
+    def registrar(self, tipo: str, model: str, segundos: float):
+        with self._lock:
+            self._amostras[(tipo, model)].append(segundos)
+
+    def percentil(self, tipo: str, model: str, percentil: float = HEDGE_PERCENTIL) -> Optional[float]:
+        """Percentil das latências do modelo (None se ainda há poucas amostras)"""
+        with self._lock:
+            amostras = sorted(self._amostras.get((tipo, model), ()))
+        if len(amostras) < HEDGE_MIN_AMOSTRAS:
+            return None
+        return amostras[min(len(amostras) - 1, int(len(amostras) * percentil))]
+
+    def prazo_hedge(self, tipo: str, model: str) -> float:
+        """Tempo de espera pelo modelo antes de disparar o próximo da cadeia"""
+        p95 = self.percentil(tipo, model)
+        return max(HEDGE_PRAZO_MINIMO, p95 if p95 is not None else HEDGE_PRAZO_PADRAO)
+
+class ProviderRouter:
+    """Política de roteamento (repetição, fallback e hedging) sobre as chamadas do AIManager"""
+
+    def __init__(self, ai_manager):
+        self.ai_manager = ai_manager
+        self.latencias = LatencyTracker()
+
+    async def agenerate(self, prompt: str, cadeia: List[str], max_tokens: int = 2000, system_message: str = None,
+                        cache_prefix: str = None, hedge: bool = False) -> Tuple[str, Dict]:
+        """
+        Gera a resposta pelo primeiro modelo da cadeia que responder com sucesso
+
+        Returns:
+            Tuple[str, Dict]: (resposta, metadados no formato de generate_response, com 'routing':
+            modelo pedido, modelo usado, fallback/hedge e as tentativas feitas). Se todos os
+            modelos falharem, devolve o resultado da última falha
+        """
+        tentativas = []
+        relatorio = {'requested_model': cadeia[0], 'fallback': False, 'hedged': False, 'attempts': tentativas}
+
+        async def gerar_modelo(model):
+            for tentativa in range(ROUTING_MAX_RETRIES + 1):
+                inicio = time.monotonic()
+                response, tokens_info = await self.ai_manager.agenerate_response(
+                    prompt, model, max_tokens, system_message=system_message, cache_prefix=cache_prefix
+                )
+                duracao = time.monotonic() - inicio
+                sucesso = bool(tokens_info.get('success')) and not tokens_info.get('error')
+                tentativas.append({'model': model, 'success': sucesso, 'error': tokens_info.get('error'),
+                                   'seconds': round(duracao, 2)})
+                if sucesso:
+                    self.latencias.registrar(LATENCIA_TOTAL, model, duracao)
+                    return response, tokens_info
+                if not tokens_info.get('error_retryable') or tentativa == ROUTING_MAX_RETRIES:
+                    return response, tokens_info
+                espera = espera_backoff(tentativa)
+                logger.warning(f"[ROTEAMENTO] {model}: erro transitório ({tokens_info.get('error')}); "
+                               f"nova tentativa em {espera:.1f}s")
+                await asyncio.sleep(espera)
+
+        fila = list(cadeia)
+        pendentes = {}  # tarefa -> (modelo, início)
+        ultimo = None
+
+        def iniciar_proximo():
+            model = fila.pop(0)
+            pendentes[asyncio.ensure_future(gerar_modelo(model))] = (model, time.monotonic())
+
+        iniciar_proximo()
+        try:
+            while pendentes:
+                prazo = None
+                if hedge and fila and len(pendentes) == 1:
+                    model, inicio = next(iter(pendentes.values()))
+                    prazo = max(0, self.latencias.prazo_hedge(LATENCIA_TOTAL, model) - (time.monotonic() - inicio))
+
+                prontas, _ = await asyncio.wait(pendentes, timeout=prazo, return_when=asyncio.FIRST_COMPLETED)
+                if not prontas:
+                    model, _ = next(iter(pendentes.values()))
+                    logger.info(f"[ROTEAMENTO] {model} sem resposta no prazo do hedge; iniciando {fila[0]} em paralelo")
+                    relatorio['hedged'] = True
+                    iniciar_proximo()
+                    continue
+
+                for tarefa in prontas:
+                    model, _ = pendentes.pop(tarefa)
+                    response, tokens_info = tarefa.result()
+                    if tokens_info.get('success') and not tokens_info.get('error'):
+                        relatorio['fallback'] = model != cadeia[0]
+                        if relatorio['fallback']:
+                            logger.warning(f"[ROTEAMENTO] Resposta de {model} no lugar de {cadeia[0]}")
+                        tokens_info['routing'] = relatorio
+                        return response, tokens_info
+                    ultimo = (response, tokens_info)
+
+                if not pendentes and fila:
+                    logger.warning(f"[ROTEAMENTO] {model} falhou; passando para {fila[0]}")
+                    iniciar_proximo()
+        finally:
+            # Hedge perdedor (ou cancelamento da chamada): cancelar o que ainda está em andamento
+            for tarefa in pendentes:
+                tarefa.cancel()
+
+        response, tokens_info = ultimo
+        tokens_info['routing'] = relatorio
+        return response, tokens_info
+
+    def abrir_stream(self, iniciar, cadeia: List[str], hedge: bool = False):
+        """
+        Abre o streaming pelo primeiro modelo da cadeia que enviar um trecho
+
+        Só troca de modelo antes do primeiro trecho: depois que o texto começa a chegar ao
+        usuário, uma falha encerra a geração como antes
+
+        Args:
+            iniciar: Função que recebe o modelo e devolve o gerador de ('text'|'usage', valor)
+
+        Returns:
+            Tuple[str, Iterator, Dict]: (modelo usado, gerador a partir do primeiro trecho,
+            relatório do roteamento)
+
+        Raises:
+            Exception: o último erro, se nenhum modelo da cadeia responder
+        """
+        tentativas = []
+        relatorio = {'requested_model': cadeia[0], 'fallback': False, 'hedged': False, 'attempts': tentativas}
+        fila = list(cadeia)
+        pendentes = {}  # futuro do primeiro trecho -> (modelo, gerador, início, tentativa)
+        ultimo_erro = None
+
+        def iniciar_modelo(model, tentativa=0):
+            chunks = iniciar(model)
+            pendentes[_em_thread(next, chunks, None)] = (model, chunks, time.monotonic(), tentativa)
+
+        iniciar_modelo(fila.pop(0))
+        try:
+            while pendentes:
+                prazo = None
+                if hedge and fila and len(pendentes) == 1:
+                    model, _, inicio, _ = next(iter(pendentes.values()))
+                    prazo = max(0, self.latencias.prazo_hedge(LATENCIA_PRIMEIRO_TRECHO, model) - (time.monotonic() - inicio))
+
+                prontos, _ = concurrent.futures.wait(pendentes, timeout=prazo, return_when=concurrent.futures.FIRST_COMPLETED)
+                if not prontos:
+                    model, _, _, _ = next(iter(pendentes.values()))
+                    logger.info(f"[ROTEAMENTO] {model} sem o primeiro trecho no prazo do hedge; iniciando {fila[0]} em paralelo")
+                    relatorio['hedged'] = True
+                    iniciar_modelo(fila.pop(0))
+                    continue
+
+                for futuro in prontos:
+                    model, chunks, inicio, tentativa = pendentes.pop(futuro)
+                    duracao = time.monotonic() - inicio
+                    try:
+                        primeiro = futuro.result()
+                    except Exception as e:
+                        chunks.close()
+                        ultimo_erro = e
+                        tentativas.append({'model': model, 'success': False, 'error': str(e), 'seconds': round(duracao, 2)})
+                        # Com outro modelo em andamento (hedge), não repetir: aguardar o outro
+                        if erro_repetivel(e) and tentativa < ROUTING_MAX_RETRIES and not pendentes:
+                            espera = espera_backoff(tentativa)
+                            logger.warning(f"[ROTEAMENTO] {model}: erro transitório ({e}); nova tentativa em {espera:.1f}s")
+                            time.sleep(espera)
+                            iniciar_modelo(model, tentativa + 1)
+                        continue
+
+                    tentativas.append({'model': model, 'success': True, 'error': None, 'seconds': round(duracao, 2)})
+                    self.latencias.registrar(LATENCIA_PRIMEIRO_TRECHO, model, duracao)
+                    relatorio['fallback'] = model != cadeia[0]
+                    if relatorio['fallback']:
+                        logger.warning(f"[ROTEAMENTO] Streaming de {model} no lugar de {cadeia[0]}")
+                    return model, _continuar_stream(primeiro, chunks), relatorio
+
+                if not pendentes and fila:
+                    logger.warning(f"[ROTEAMENTO] {model} falhou; passando para {fila[0]}")
+                    iniciar_modelo(fila.pop(0))
+        finally:
+            # Perdedores do hedge: fechar a conexão assim que o primeiro trecho chegar
+            for futuro, (_, chunks, _, _) in pendentes.items():
+                futuro.add_done_callback(lambda _futuro, chunks=chunks: chunks.close())
+
+        raise ultimo_erro
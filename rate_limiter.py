@@ -0,0 +1,175 @@
+"""
+Limite de taxa por provedor e por modelo (RPM e TPM), compartilhado entre os processos
+Cada limite é um token bucket na tabela rate_limit_bucket: a capacidade é o limite por
+minuto e o saldo se recarrega continuamente. Antes de chamar o provedor, a requisição
+reserva 1 requisição e os tokens estimados (entrada contada pelo TokenCounter + limite de
+saída) em todos os buckets que se aplicam, numa única transação; sem saldo, aguarda na
+fila local em vez de receber um 429 do provedor. Os tokens de saída não usados são
+devolvidos ao fim da chamada. Limites configurados em /admin/config (rate_limits)
+"""
+
+import os
+import json
+import time
+import random
+import asyncio
+import logging
+import threading
+from sqlalchemy import text
+from models_config import get_provider_for_model
+
+logger = logging.getLogger(__name__)
+
+# Espera máxima na fila local; depois disso a requisição falha (e o roteamento tenta o próximo modelo)
+RATE_LIMIT_MAX_WAIT = float(os.getenv('RATE_LIMIT_MAX_WAIT', '60'))
+# Intervalo máximo entre novas tentativas de reserva enquanto aguarda
+RATE_LIMIT_POLL_MAX = 2.0
+# Tempo em que a configuração dos limites fica em memória (outros workers enxergam mudanças após esse prazo)
+RATE_LIMIT_CONFIG_TTL = 30
+
+class LimiteTaxaExcedido(Exception):
+    """A requisição esperou RATE_LIMIT_MAX_WAIT na fila sem saldo no limite de taxa"""
+    pass
+
+class RateLimiter:
+    """Token buckets de RPM/TPM por provedor e por modelo, guardados no banco"""
+
+    def __init__(self):
+        self._limites = None
+        self._limites_carregados_em = 0.0
+        self._lock = threading.Lock()
+
+    def limites(self) -> dict:
+        """Limites configurados: {provedor ou modelo: {'rpm': n, 'tpm': n}}"""
+        with self._lock:
+            if self._limites is not None and time.monotonic() - self._limites_carregados_em < RATE_LIMIT_CONFIG_TTL:
+                return self._limites
+            try:
+                from app import app, get_app_config
+                with app.app_context():
+                    limites = json.loads(get_app_config('rate_limits', '{}') or '{}')
+                self._limites = limites if isinstance(limites, dict) else {}
+            except Exception as e:
+                logger.warning(f"Erro ao ler limites de taxa: {e}")
+                self._limites = self._limites or {}
+            self._limites_carregados_em = time.monotonic()
+            return self._limites
+
+    def invalidar(self):
+        """Descarta os limites em memória (chamar após alterar a configuração)"""
+        with self._lock:
+            self._limites = None
+
+    def _buckets(self, model: str, tokens: int) -> list:
+        """(chave, capacidade, recarga por segundo, quantidade a reservar) de cada limite aplicável"""
+        limites = self.limites()
+        buckets = []
+        for escopo in (get_provider_for_model(model), model):
+            limite = limites.get(escopo) or {}
+            if limite.get('rpm'):
+                buckets.append((f"{escopo}:rpm", limite['rpm'], limite['rpm'] / 60, 1))
+            if limite.get('tpm') and tokens:
+                # Uma requisição maior que o limite inteiro esperaria para sempre
+                buckets.append((f"{escopo}:tpm", limite['tpm'], limite['tpm'] / 60, min(tokens, limite['tpm'])))
+        return buckets
+
+    def tentar_reservar(self, model: str, tokens: int) -> float:
+        """
+        Tenta reservar a requisição e os tokens em todos os buckets do modelo
+
+        Returns:
+            float: 0 se reservou (ou se não há limites); senão, segundos até haver saldo
+        """
+        buckets = self._buckets(model, tokens)
+        if not buckets:
+            return 0.0
+
+        from app import app, db
+        with app.app_context():
+            try:
+                agora = time.time()
+                for chave, capacidade, _, _ in buckets:
+                    db.session.execute(text(
+                        "INSERT OR IGNORE INTO rate_limit_bucket (bucket_key, tokens, updated_at) VALUES (:chave, :capacidade, :agora)"
+                    ), {'chave': chave, 'capacidade': capacidade, 'agora': agora})
+
+                # UPDATE condicionado ao saldo: atômico entre os processos; sem saldo em algum
+                # bucket, o rollback desfaz as reservas já feitas nos outros
+                saldo_sql = "min(:capacidade, tokens + max(0, :agora - updated_at) * :taxa)"
+                for chave, capacidade, taxa, quantidade in buckets:
+                    parametros = {'chave': chave, 'capacidade': capacidade, 'taxa': taxa, 'quantidade': quantidade, 'agora': agora}
+                    reservado = db.session.execute(text(
+                        f"UPDATE rate_limit_bucket SET tokens = {saldo_sql} - :quantidade, updated_at = :agora "
+                        f"WHERE bucket_key = :chave AND {saldo_sql} >= :quantidade"
+                    ), parametros).rowcount
+                    if not reservado:
+                        saldo = db.session.execute(text(
+                            f"SELECT {saldo_sql} FROM rate_limit_bucket WHERE bucket_key = :chave"
+                        ), parametros).scalar() or 0
+                        db.session.rollback()
+                        return max(0.05, (quantidade - saldo) / taxa)
+                db.session.commit()
+                return 0.0
+            except Exception as e:
+                # Sem o banco, não bloquear a geração
+                db.session.rollback()
+                logger.warning(f"Erro ao reservar limite de taxa: {e}")
+                return 0.0
+
+    def _proxima_espera(self, espera: float, limite: float) -> float:
+        if time.monotonic() + espera > limite:
+            raise LimiteTaxaExcedido(
+                f"Limite de requisições/tokens por minuto atingido para o provedor do modelo; "
+                f"fila de espera maior que {RATE_LIMIT_MAX_WAIT:.0f}s"
+            )
+        # Jitter para os processos na fila não tentarem todos ao mesmo tempo
+        return min(espera, RATE_LIMIT_POLL_MAX) + random.uniform(0, 0.1)
+
+    def reservar(self, model: str, tokens: int):
+        """Reserva a taxa para a chamada, aguardando na fila local (bloqueia a thread)"""
+        limite = time.monotonic() + RATE_LIMIT_MAX_WAIT
+        inicio = time.monotonic()
+        while True:
+            espera = self.tentar_reservar(model, tokens)
+            if not espera:
+                break
+            time.sleep(self._proxima_espera(espera, limite))
+        self._registrar_espera(model, time.monotonic() - inicio)
+
+    async def areservar(self, model: str, tokens: int):
+        """Versão assíncrona de reservar (aguarda sem ocupar o event loop)"""
+        limite = time.monotonic() + RATE_LIMIT_MAX_WAIT
+        inicio = time.monotonic()
+        while True:
+            espera = await asyncio.to_thread(self.tentar_reservar, model, tokens)
+            if not espera:
+                break
+            await asyncio.sleep(self._proxima_espera(espera, limite))
+        self._registrar_espera(model, time.monotonic() - inicio)
+
+    def _registrar_espera(self, model: str, segundos: float):
+        if segundos >= 1:
+            logger.info(f"[LIMITE-TAXA] {model}: {segundos:.1f}s na fila local")
+
+    def devolver(self, model: str, tokens: int):
+        """Devolve aos buckets de TPM os tokens reservados e não usados (saída menor que o limite)"""
+        if tokens <= 0:
+            return
+        buckets = [bucket for bucket in self._buckets(model, tokens) if bucket[0].endswith(':tpm')]
+        if not buckets:
+            return
+
+        from app import app, db
+        with app.app_context():
+            try:
+                for chave, capacidade, _, quantidade in buckets:
+                    db.session.execute(text(
+                        "UPDATE rate_limit_bucket SET tokens = min(:capacidade, tokens + :quantidade) WHERE bucket_key = :chave"
+                    ), {'chave': chave, 'capacidade': capacidade, 'quantidade': quantidade})
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Erro ao devolver limite de taxa: {e}")
+
+# Instância compartilhada pelo processo
+rate_limiter = RateLimiter()
@@ -0,0 +1,201 @@
+"""
+Coalescência de gerações idênticas simultâneas (single-flight)
+Quando várias requisições pedem a mesma geração (mesma chave do cache de gerações) ao
+mesmo tempo, só a primeira chama o provedor; as demais aguardam e recebem a mesma
+resposta, sem tokens cobrados novamente. Dentro do processo a espera é por um Event;
+entre os workers do gunicorn (e os workers de jobs), pela tabela generation_lock
+"""
+
+import os
+import json
+import time
+import socket
+import logging
+import threading
+from datetime import datetime, timezone, timedelta
+
+logger = logging.getLogger(__name__)
+
+# Tempo máximo de espera por uma geração líder (depois disso a reserva expira)
+SINGLE_FLIGHT_TIMEOUT = int(os.getenv('SINGLE_FLIGHT_TIMEOUT', '300'))
+# Intervalo entre consultas à tabela generation_lock enquanto outro processo gera
+SINGLE_FLIGHT_POLL_INTERVAL = float(os.getenv('SINGLE_FLIGHT_POLL_INTERVAL', '0.5'))
+# Tempo em que o resultado fica na tabela para os processos que ainda estão consultando
+SINGLE_FLIGHT_RETENCAO = int(os.getenv('SINGLE_FLIGHT_RETENTION', '5'))
+# Tentativas de reserva quando a geração de outro processo falha
+SINGLE_FLIGHT_TENTATIVAS = 3
+
+PAPEL_LIDER = 'lider'  # deve gerar e chamar concluir()
+PAPEL_SEGUIDOR = 'seguidor'  # deve chamar aguardar()
+
+def _agora():
+    return datetime.now(timezone.utc)
+
+class GeracaoEmAndamento:
+    """Geração em andamento no processo, aguardada pelas requisições idênticas"""
+
+    def __init__(self, chave: str):
+        self.chave = chave
+        self.evento = threading.Event()
+        self.resultado = None
+        self.seguidores = 0
+        # Este processo registrou a geração em generation_lock (e deve publicar o resultado lá)
+        self.reservada_no_banco = False
+
+class RequestCoalescer:
+    """Deduplicação das gerações idênticas em andamento (no processo e entre processos)"""
+
+    def __init__(self):
+        self._geracoes = {}
+        self._lock = threading.Lock()
+
+    def entrar(self, chave: str):
+        """
+        Registra a intenção de gerar a resposta identificada pela chave
+
+        Returns:
+            Tuple[str, GeracaoEmAndamento]: (PAPEL_LIDER ou PAPEL_SEGUIDOR, geração em andamento)
+        """
+        with self._lock:
+            geracao = self._geracoes.get(chave)
+            if geracao is not None:
+                geracao.seguidores += 1
+                return PAPEL_SEGUIDOR, geracao
+            geracao = GeracaoEmAndamento(chave)
+            self._geracoes[chave] = geracao
+
+        # Primeira do processo: verificar se outro processo já está gerando
+        for _ in range(SINGLE_FLIGHT_TENTATIVAS):
+            if self._reservar_no_banco(chave):
+                geracao.reservada_no_banco = True
+                return PAPEL_LIDER, geracao
+            resultado = self._aguardar_banco(chave)
+            if resultado is not None:
+                # Repassar às requisições deste processo que aguardam a mesma geração
+                logger.info(f"[SINGLE-FLIGHT] Resposta {chave[:12]} recebida de outro processo")
+                self._encerrar(geracao, resultado)
+                return PAPEL_SEGUIDOR, geracao
+        # Gerações de outros processos falhando: gerar sem reserva no banco
+        return PAPEL_LIDER, geracao
+
+    def aguardar(self, geracao: GeracaoEmAndamento, timeout: float = SINGLE_FLIGHT_TIMEOUT):
+        """
+        Aguarda o resultado da geração líder
+
+        Returns:
+            Tuple[str, Dict]: (resposta, tokens e custo da geração líder) ou None se a
+            geração líder falhou ou demorou demais (o chamador deve gerar por conta própria)
+        """
+        if not geracao.evento.wait(timeout):
+            return None
+        return geracao.resultado
+
+    def concluir(self, geracao: GeracaoEmAndamento, resultado):
+        """
+        Publica o resultado da geração líder e libera as requisições que aguardam
+
+        Args:
+            resultado: (resposta, tokens e custo) ou None se a geração falhou
+        """
+        if geracao.reservada_no_banco:
+            self._publicar_no_banco(geracao.chave, resultado)
+        if geracao.seguidores and resultado is not None:
+            logger.info(f"[SINGLE-FLIGHT] Resposta {geracao.chave[:12]} compartilhada com {geracao.seguidores} requisição(ões)")
+        self._encerrar(geracao, resultado)
+
+    def _encerrar(self, geracao: GeracaoEmAndamento, resultado):
+        geracao.resultado = resultado
+        with self._lock:
+            if self._geracoes.get(geracao.chave) is geracao:
+                del self._geracoes[geracao.chave]
+        geracao.evento.set()
+
+    def _dono(self) -> str:
+        # pid lido a cada vez: com preload_app o objeto é criado antes do fork dos workers
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _reservar_no_banco(self, chave: str) -> bool:
+        """
+        Registra a geração em generation_lock
+
+        Returns:
+            bool: False se outro processo já está gerando a mesma resposta; True se a
+            reserva foi feita (ou se o banco não pôde ser consultado)
+        """
+        from sqlalchemy.exc import IntegrityError
+        from app import db, GenerationLock
+        for _ in range(2):
+            try:
+                agora = _agora()
+                GenerationLock.query.filter(GenerationLock.expires_at <= agora).delete(synchronize_session=False)
+                db.session.add(GenerationLock(
+                    lock_key=chave,
+                    owner=self._dono(),
+                    status='running',
+                    created_at=agora,
+                    expires_at=agora + timedelta(seconds=SINGLE_FLIGHT_TIMEOUT)
+                ))
+                db.session.commit()
+                return True
+            except IntegrityError:
+                db.session.rollback()
+                # Reserva de uma geração já terminada (mantida só para quem ainda consultava):
+                # não serve de cache para requisições novas
+                finalizadas = GenerationLock.query.filter(
+                    GenerationLock.lock_key == chave,
+                    GenerationLock.status != 'running'
+                ).delete(synchronize_session=False)
+                db.session.commit()
+                if not finalizadas:
+                    return False
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Erro ao reservar geração em generation_lock: {e}")
+                return True
+        return False
+
+    def _aguardar_banco(self, chave: str):
+        """Consulta generation_lock até a geração do outro processo terminar (None se falhar ou expirar)"""
+        from app import db, GenerationLock
+        limite = time.monotonic() + SINGLE_FLIGHT_TIMEOUT
+        while time.monotonic() < limite:
+            try:
+                linha = db.session.query(
+                    GenerationLock.status, GenerationLock.response, GenerationLock.tokens_info
+                ).filter(
+                    GenerationLock.lock_key == chave,
+                    GenerationLock.expires_at > _agora()
+                ).first()
+                # Encerrar a transação de leitura para enxergar a próxima gravação do outro processo
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.warning(f"Erro ao consultar generation_lock: {e}")
+                return None
+
+            if linha is None or linha.status == 'failed':
+                return None
+            if linha.status == 'done':
+                return linha.response, json.loads(linha.tokens_info or '{}')
+            time.sleep(SINGLE_FLIGHT_POLL_INTERVAL)
+        return None
+
+    def _publicar_no_banco(self, chave: str, resultado):
+        """Grava o resultado na reserva para os processos que aguardam e agenda sua remoção"""
+        from app import db, GenerationLock
+        valores = {
+            'status': 'done' if resultado is not None else 'failed',
+            'expires_at': _agora() + timedelta(seconds=SINGLE_FLIGHT_RETENCAO)
+        }
+        if resultado is not None:
+            valores['response'] = resultado[0]
+            valores['tokens_info'] = json.dumps(resultado[1])
+        try:
+            GenerationLock.query.filter_by(lock_key=chave, owner=self._dono()).update(valores, synchronize_session=False)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.warning(f"Erro ao publicar geração em generation_lock: {e}")
+
+# Instância compartilhada pelo processo
+request_coalescer = RequestCoalescer()
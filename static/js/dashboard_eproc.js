@@ -12,6 +12,7 @@ let movimentosCache = {};
 let pecasImportadas = [];
 let pecasManuais = [];
 let editor = null;
+let editorInicializacao = null; // Promise da criação do CKEditor em andamento
 let dragSource = null;
 let dragTarget = null;
 let currentFormData = null; // Dados do formulário original
@@ -640,60 +641,100 @@ async function importarPecas() {
     modalBody.appendChild(loadingImportacao);
 
     try {
-        // Importar peças usando o novo sistema
-        for (let i = 0; i < pecasParaImportar.length; i++) {
-            const peca = pecasParaImportar[i];
+        // Buscar todas as peças de uma vez: o servidor baixa em paralelo e
+        // devolve cada peça (NDJSON) assim que o texto é extraído
+        const resultadosPorId = {};
+        let concluidas = 0;
 
-            // Atualizar progresso
+        const atualizarProgresso = (descricao) => {
             const progressoDiv = document.getElementById('progressoImportacao');
             if (progressoDiv) {
                 progressoDiv.innerHTML = `
                     <div class="text-sm text-blue-600">
                         <i class="fas fa-spinner fa-spin"></i> 
-                        Extraindo texto da peça ${i + 1} de ${pecasParaImportar.length}: ${peca.descricao}
+                        Texto extraído de ${concluidas} de ${pecasParaImportar.length} peça(s)${descricao ? `: ${descricao}` : ''}
                     </div>
                 `;
             }
+        };
+        atualizarProgresso('');
 
-            // Buscar conteúdo real da peça via API
-            let conteudoPeca = '';
-            try {
-                const response = await fetch('/api/buscar_conteudo_peca', {
-                    method: 'POST',
-                    headers: {
-                        'Content-Type': 'application/json',
-                        'Accept': 'application/json',
-                        'Accept-Charset': 'utf-8'
-                    },
-                    body: JSON.stringify({
-                        numero_processo: numeroProcesso,
-                        id_peca: peca.id,
-                        sistema: 'br.jus.jfrj.eproc'
-                    })
-                });
+        try {
+            const response = await fetch('/api/buscar_conteudo_pecas', {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                    'Accept': 'application/x-ndjson',
+                    'Accept-Charset': 'utf-8'
+                },
+                body: JSON.stringify({
+                    numero_processo: numeroProcesso,
+                    ids_pecas: pecasParaImportar.map(peca => peca.id),
+                    sistema: 'br.jus.jfrj.eproc'
+                })
+            });
 
-                const resultado = await response.json();
+            if (!response.ok) {
+                const erro = await response.json().catch(() => ({}));
+                throw new Error(erro.error || `HTTP ${response.status}`);
+            }
 
-                if (resultado.success) {
-                    // Criar conteúdo da peça com informações essenciais
-                    conteudoPeca = `Evento: ${peca.evento} (${formatarData(peca.data)})\n\n`;
+            const reader = response.body.getReader();
+            const decoder = new TextDecoder('utf-8');
+            let buffer = '';
+            let erroGeral = null;
+
+            const processarLinha = (linha) => {
+                if (!linha.trim()) return;
+                const resultado = JSON.parse(linha);
+                if (resultado.done) return;
+                if (resultado.id_peca === undefined) {
+                    erroGeral = resultado.error;
+                    return;
+                }
+                resultadosPorId[resultado.id_peca] = resultado;
+                concluidas++;
+                const peca = pecasParaImportar.find(p => String(p.id) === String(resultado.id_peca));
+                atualizarProgresso(peca ? peca.descricao : '');
+            };
 
-                    // Adicionar texto extraído se disponível
-                    if (resultado.texto_extraido && resultado.texto_extraido.trim()) {
-                        conteudoPeca += resultado.texto_extraido;
-                    } else {
-                        conteudoPeca += `${resultado.mensagem}`;
-                    }
-                } else {
-                    // Fallback se não conseguir buscar o conteúdo
-                    conteudoPeca = `Evento: ${peca.evento} (${formatarData(peca.data)})\n\n`;
-                    conteudoPeca += `[Erro ao buscar conteúdo da peça: ${resultado.error}]`;
+            while (true) {
+                const { done, value } = await reader.read();
+                if (done) break;
+                buffer += decoder.decode(value, { stream: true });
+                const linhas = buffer.split('\n');
+                buffer = linhas.pop();
+                linhas.forEach(processarLinha);
+            }
+            processarLinha(buffer + decoder.decode());
+
+            if (erroGeral && concluidas === 0) {
+                throw new Error(erroGeral);
+            }
+        } catch (error) {
+            // Fallback em caso de erro na API: peças sem resultado recebem a mensagem de erro
+            pecasParaImportar.forEach(peca => {
+                if (!resultadosPorId[peca.id]) {
+                    resultadosPorId[peca.id] = { error: error.message };
                 }
+            });
+        }
 
-            } catch (error) {
-                // Fallback em caso de erro na API
-                conteudoPeca = `Evento: ${peca.evento} (${formatarData(peca.data)})\n\n`;
-                conteudoPeca += `[Erro ao buscar conteúdo da peça: ${error.message}]`;
+        // Inserir as peças na ordem em que foram selecionadas
+        pecasParaImportar.forEach(peca => {
+            const resultado = resultadosPorId[peca.id] || { error: 'Peça não retornada pelo servidor' };
+            let conteudoPeca = `Evento: ${peca.evento} (${formatarData(peca.data)})\n\n`;
+
+            if (resultado.success) {
+                // Adicionar texto extraído se disponível
+                if (resultado.texto_extraido && resultado.texto_extraido.trim()) {
+                    conteudoPeca += resultado.texto_extraido;
+                } else {
+                    conteudoPeca += `${resultado.mensagem}`;
+                }
+            } else {
+                // Fallback se não conseguir buscar o conteúdo
+                conteudoPeca += `[Erro ao buscar conteúdo da peça: ${resultado.error}]`;
             }
 
             // Criar nova peça usando o novo sistema
@@ -707,7 +748,7 @@ async function importarPecas() {
             pecasImportadas.push(novaPeca);
             const elemento = criarElementoPeca(novaPeca, 'importada', pecasImportadas.length);
             document.getElementById('pecas-container').appendChild(elemento);
-        }
+        });
 
         // Atualizar ordens e contador
         atualizarOrdens();
@@ -1524,6 +1565,152 @@ function mostrarPreviewOrdem() {
     alert(preview);
 }
 
+// Avisar quando a resposta foi reaproveitada (cache de gerações ou geração idêntica simultânea, sem custo)
+function avisarRespostaEmCache(tokensInfo) {
+    if (tokensInfo && tokensInfo.coalesced) {
+        showNotification('Resposta compartilhada com uma geração idêntica em andamento, sem custo.', 'info');
+    } else if (tokensInfo && tokensInfo.cache_hit) {
+        showNotification('Resposta idêntica reaproveitada do cache, sem custo.', 'info');
+    }
+}
+
+// Avisar quando o modelo escolhido falhou e a resposta veio de outro modelo da cadeia de fallback
+function avisarFallbackModelo(fallback) {
+    if (fallback) {
+        showNotification(`O modelo ${fallback.modelo_pedido} não respondeu; a resposta foi gerada por ${fallback.modelo_usado}.`, 'warning');
+    }
+}
+
+// Avisar quando peças foram omitidas/resumidas para caber na janela de contexto do modelo
+function avisarOrcamentoContexto(orcamento) {
+    if (!orcamento) {
+        return;
+    }
+    const partes = [];
+    if (orcamento.pecas_omitidas && orcamento.pecas_omitidas.length) {
+        partes.push(`omitidas: ${orcamento.pecas_omitidas.join(', ')}`);
+    }
+    if (orcamento.pecas_resumidas && orcamento.pecas_resumidas.length) {
+        partes.push(`resumidas: ${orcamento.pecas_resumidas.join(', ')}`);
+    }
+    if (partes.length) {
+        showNotification(`O processo excede a janela de contexto do modelo. Peças ${partes.join('; ')}.`, 'warning');
+    }
+}
+
+// Ler os eventos SSE de uma resposta; para quando aoReceberEvento devolver um valor (que é retornado)
+async function lerEventosSSE(response, aoReceberEvento) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) {
+            return null;
+        }
+        buffer += decoder.decode(value, { stream: true });
+
+        // Eventos SSE são separados por uma linha em branco
+        let separador;
+        while ((separador = buffer.indexOf('\n\n')) >= 0) {
+            const bloco = buffer.slice(0, separador);
+            buffer = buffer.slice(separador + 2);
+
+            let evento = 'message';
+            let dados = '';
+            bloco.split('\n').forEach(linha => {
+                if (linha.startsWith('event:')) {
+                    evento = linha.slice(6).trim();
+                } else if (linha.startsWith('data:')) {
+                    dados += linha.slice(5).trim();
+                }
+            });
+            if (!dados) {
+                continue;
+            }
+
+            const resultado = aoReceberEvento(evento, JSON.parse(dados));
+            if (resultado !== undefined) {
+                reader.cancel();
+                return resultado;
+            }
+        }
+    }
+}
+
+// Consome uma rota de geração em streaming (Server-Sent Events)
+// Chama onTexto com o texto acumulado a cada trecho e retorna { ok, result },
+// onde result tem o mesmo formato da resposta JSON das rotas sem streaming
+async function consumirStreamGeracao(url, payload, signal, onTexto) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(payload),
+        signal: signal
+    });
+
+    // Erros de validação chegam como JSON comum
+    if (!response.ok) {
+        return { ok: false, result: await response.json() };
+    }
+
+    let texto = '';
+    const fim = await lerEventosSSE(response, (evento, conteudo) => {
+        if (evento === 'delta') {
+            texto += conteudo.text;
+            if (onTexto) {
+                onTexto(texto);
+            }
+        } else if (evento === 'done') {
+            return { ok: true, result: conteudo };
+        } else if (evento === 'error') {
+            return { ok: false, result: conteudo };
+        }
+    });
+    return fim || { ok: false, result: { error: 'Conexão encerrada antes do fim da geração' } };
+}
+
+// Coletar os dados do formulário de geração (null se não houver peças)
+function coletarDadosFormulario() {
+    const formData = {
+        numero_processo: document.getElementById('numero_processo').value,
+        objetivo: objetivoAtual,
+        pecas_processuais: [],
+        prompt_id: document.getElementById('prompt_select').value,
+        ai_model_id: document.getElementById('ai_model_select').value,
+        resumir_pecas: document.getElementById('resumir_pecas').checked
+    };
+
+    // Adicionar campos específicos baseados no objetivo
+    if (objetivoAtual === 'minuta') {
+        formData.como_decidir = document.getElementById('como_decidir').value;
+        formData.fundamentos = document.getElementById('fundamentos').value;
+        formData.vedacoes = document.getElementById('vedacoes').value;
+    } else {
+        formData.instrucoes_adicionais = document.getElementById('instrucoes_adicionais').value;
+    }
+
+    // Obter peças ordenadas
+    const pecasOrdenadas = obterPecasOrdenadas();
+
+    // Validar se há peças
+    if (pecasOrdenadas.length === 0) {
+        showNotification('Por favor, adicione pelo menos uma peça processual.', 'error');
+        return null;
+    }
+
+    // Adicionar peças ao formData
+    formData.pecas_processuais = pecasOrdenadas.map(peca => ({
+        nome: peca.nome,
+        conteudo: peca.conteudo
+    }));
+
+    return formData;
+}
+
 // Função para enviar formulário
 async function enviarFormulario() {
     const submitBtn = document.querySelector('button[onclick="enviarFormulario()"]');
@@ -1540,57 +1727,37 @@ async function enviarFormulario() {
     submitBtn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Gerando...';
 
     try {
-        // Coletar dados do formulário
-        const formData = {
-            numero_processo: document.getElementById('numero_processo').value,
-            objetivo: objetivoAtual,
-            pecas_processuais: [],
-            prompt_id: document.getElementById('prompt_select').value,
-            ai_model_id: document.getElementById('ai_model_select').value
-        };
-
-        // Adicionar campos específicos baseados no objetivo
-        if (objetivoAtual === 'minuta') {
-            formData.como_decidir = document.getElementById('como_decidir').value;
-            formData.fundamentos = document.getElementById('fundamentos').value;
-            formData.vedacoes = document.getElementById('vedacoes').value;
-        } else {
-            formData.instrucoes_adicionais = document.getElementById('instrucoes_adicionais').value;
-        }
-
-        // Obter peças ordenadas
-        const pecasOrdenadas = obterPecasOrdenadas();
-
-        // Validar se há peças
-        if (pecasOrdenadas.length === 0) {
-            showNotification('Por favor, adicione pelo menos uma peça processual.', 'error');
+        const formData = coletarDadosFormulario();
+        if (!formData) {
             return;
         }
 
-        // Adicionar peças ao formData
-        formData.pecas_processuais = pecasOrdenadas.map(peca => ({
-            nome: peca.nome,
-            conteudo: peca.conteudo
-        }));
-
         // Enviar para o servidor com timeout de 5 minutos
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 5 * 60 * 1000); // 5 minutos
 
-        const response = await fetch('/generate_minuta', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(formData),
-            signal: controller.signal
+        // Mostrar o texto no editor à medida que é gerado (no máximo a cada 500ms)
+        let ultimaPrevia = 0;
+        const { ok, result } = await consumirStreamGeracao('/generate_minuta/stream', formData, controller.signal, textoParcial => {
+            submitBtn.innerHTML = `<i class="fas fa-spinner fa-spin mr-2"></i>Gerando... (${textoParcial.length} caracteres)`;
+
+            const agora = Date.now();
+            if (agora - ultimaPrevia < 500) {
+                return;
+            }
+            ultimaPrevia = agora;
+
+            document.getElementById('resultado').classList.remove('hidden');
+            if (editor) {
+                editor.setData(formatMinutaToHtml(textoParcial));
+            } else {
+                initializeCKEditor();
+            }
         });
 
         clearTimeout(timeoutId);
 
-        const result = await response.json();
-
-        if (response.ok) {
+        if (ok) {
             // Salvar dados do formulário para uso em ajustes
             currentFormData = formData;
 
@@ -1619,15 +1786,16 @@ async function enviarFormulario() {
 
             // Inicializar CKEditor se ainda não foi inicializado
             if (!editor) {
-                initializeCKEditor();
-                // Aguardar um pouco para o CKEditor ser inicializado
-                await new Promise(resolve => setTimeout(resolve, 500));
+                await initializeCKEditor();
             }
 
             // Definir o conteúdo no editor
             if (editor) {
                 editor.setData(formattedResult);
             }
+            avisarOrcamentoContexto(result.orcamento_contexto);
+            avisarRespostaEmCache(result.tokens_info);
+            avisarFallbackModelo(result.fallback_modelo);
 
 
             // Mostrar informações de tokens e custos se disponíveis
@@ -1647,7 +1815,7 @@ async function enviarFormulario() {
                             </div>
                             <div class="text-center">
                                 <div class="font-medium text-blue-600">${tokensInfo.request_tokens || 0}</div>
-                                <div class="text-gray-500">Envio</div>
+                                <div class="text-gray-500">Envio${tokensInfo.cache_read_tokens ? ` (${tokensInfo.cache_read_tokens} em cache)` : ''}</div>
                             </div>
                             <div class="text-center">
                                 <div class="font-medium text-green-600">${tokensInfo.response_tokens || 0}</div>
@@ -1710,6 +1878,143 @@ async function enviarFormulario() {
     }
 }
 
+// Comparar modelos: o mesmo prompt é gerado em paralelo pelos modelos escolhidos
+async function compararModelos() {
+    const compararBtn = document.querySelector('button[onclick="compararModelos()"]');
+    const formData = coletarDadosFormulario();
+    if (!formData) {
+        return;
+    }
+
+    const modelos = [formData.ai_model_id];
+    document.querySelectorAll('#comparar_modelos input:checked').forEach(input => {
+        if (!modelos.includes(input.value)) {
+            modelos.push(input.value);
+        }
+    });
+    if (modelos.length < 2) {
+        showNotification('Marque pelo menos um modelo em "Comparar com outros modelos".', 'error');
+        return;
+    }
+    formData.ai_model_ids = modelos;
+
+    const originalText = compararBtn.innerHTML;
+    compararBtn.disabled = true;
+    compararBtn.innerHTML = '<i class="fas fa-spinner fa-spin mr-2"></i>Comparando...';
+
+    const secao = document.getElementById('comparacao-section');
+    const container = document.getElementById('comparacao-container');
+    const status = document.getElementById('comparacao-status');
+    container.innerHTML = '';
+    status.textContent = `Gerando com ${modelos.length} modelos...`;
+    secao.classList.remove('hidden');
+    secao.scrollIntoView({ behavior: 'smooth' });
+
+    try {
+        const response = await fetch('/generate_minuta/fanout', {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify(formData)
+        });
+
+        // Erros de validação chegam como JSON comum
+        if (!response.ok) {
+            const erro = await response.json();
+            status.textContent = '';
+            secao.classList.add('hidden');
+            showNotification('Erro ao comparar modelos: ' + erro.error, 'error');
+            return;
+        }
+
+        let recebidos = 0;
+        const fim = await lerEventosSSE(response, (evento, conteudo) => {
+            if (evento === 'draft' || evento === 'timeout') {
+                recebidos++;
+                status.textContent = `${recebidos} de ${modelos.length} modelos concluídos...`;
+                container.appendChild(criarCartaoComparacao(evento, conteudo, formData));
+            } else if (evento === 'done' || evento === 'error') {
+                return { evento, conteudo };
+            }
+        });
+
+        if (!fim || fim.evento === 'error') {
+            status.textContent = '';
+            showNotification('Erro ao comparar modelos: ' + (fim ? fim.conteudo.error : 'conexão encerrada'), 'error');
+            return;
+        }
+        const cancelados = fim.conteudo.cancelados.length;
+        status.textContent = `${fim.conteudo.concluidos.length} modelo(s) concluído(s)` +
+            (cancelados ? `, ${cancelados} cancelado(s) por exceder o prazo` : '');
+        showNotification('Comparação concluída!', 'success');
+
+    } catch (error) {
+        console.error('Erro:', error);
+        showNotification('Erro ao comparar modelos. Tente novamente.', 'error');
+    } finally {
+        compararBtn.disabled = false;
+        compararBtn.innerHTML = originalText;
+    }
+}
+
+// Cartão de um modelo na comparação (minuta gerada ou cancelada pelo prazo)
+function criarCartaoComparacao(evento, resultado, formData) {
+    const cartao = document.createElement('div');
+    cartao.className = 'bg-gray-50 border border-gray-200 rounded-lg p-4';
+
+    const titulo = document.createElement('h4');
+    titulo.className = 'text-md font-medium text-gray-900 mb-2';
+    titulo.textContent = resultado.model_id;
+    cartao.appendChild(titulo);
+
+    if (evento === 'timeout') {
+        const aviso = document.createElement('p');
+        aviso.className = 'text-sm text-red-600';
+        aviso.textContent = resultado.error;
+        cartao.appendChild(aviso);
+        return cartao;
+    }
+
+    const tokensInfo = resultado.tokens_info || {};
+    const resumo = document.createElement('p');
+    resumo.className = 'text-xs text-gray-500 mb-2';
+    resumo.textContent = `${tokensInfo.total_tokens || 0} tokens` + (resultado.user_cost ? ` · ${resultado.user_cost}` : '') +
+        (tokensInfo.success ? '' : ' · Erro');
+    cartao.appendChild(resumo);
+
+    const texto = resultado.minuta || resultado.resultado || '';
+    const conteudo = document.createElement('div');
+    conteudo.className = 'prose prose-sm max-w-none bg-white border border-gray-200 rounded p-3 overflow-y-auto';
+    conteudo.style.maxHeight = '24rem';
+    conteudo.innerHTML = formatMinutaToHtml(texto);
+    cartao.appendChild(conteudo);
+
+    const usarBtn = document.createElement('button');
+    usarBtn.className = 'mt-3 inline-flex items-center px-3 py-1 border border-primary-300 shadow-sm text-sm font-medium rounded-md text-primary-700 bg-white hover:bg-primary-50';
+    usarBtn.innerHTML = '<i class="fas fa-check mr-1"></i>Usar esta minuta';
+    usarBtn.onclick = () => usarMinutaComparada(texto, resultado.model_id, formData);
+    cartao.appendChild(usarBtn);
+
+    return cartao;
+}
+
+// Levar a minuta escolhida na comparação para o editor (ajustes usam o modelo que a gerou)
+async function usarMinutaComparada(texto, modelId, formData) {
+    currentFormData = Object.assign({}, formData, { ai_model_id: modelId });
+    delete currentFormData.ai_model_ids;
+
+    document.getElementById('resultado').classList.remove('hidden');
+    if (!editor) {
+        await initializeCKEditor();
+    }
+    if (editor) {
+        editor.setData(formatMinutaToHtml(texto));
+    }
+    document.getElementById('tokens-info').innerHTML = '';
+    document.getElementById('resultado').scrollIntoView({ behavior: 'smooth' });
+}
+
 // Função para copiar minuta
 function copiarMinuta() {
     if (!editor) {
@@ -2042,15 +2347,22 @@ function baixarMinuta() {
 
 // Função para inicializar CKEditor
 function initializeCKEditor() {
+    // Evitar criar dois editores quando chamado de novo antes de terminar
+    if (editor) {
+        return Promise.resolve(editor);
+    }
+    if (editorInicializacao) {
+        return editorInicializacao;
+    }
 
     const editorContainer = document.querySelector('#editor');
 
     if (!editorContainer) {
         console.warn('Container do CKEditor não encontrado. Será inicializado quando o resultado for exibido.');
-        return;
+        return Promise.resolve(null);
     }
 
-    ClassicEditor
+    editorInicializacao = ClassicEditor
         .create(editorContainer, {
             toolbar: {
                 items: [
@@ -2073,10 +2385,14 @@ function initializeCKEditor() {
         })
         .then(newEditor => {
             editor = newEditor;
+            return editor;
         })
         .catch(error => {
             console.error('🔍 [DEBUG] Erro ao inicializar CKEditor:', error);
+            editorInicializacao = null;
+            return null;
         });
+    return editorInicializacao;
 }
 
 // Função para carregar modelos de IA
@@ -2103,6 +2419,7 @@ function loadAIModels() {
                 option.textContent = model.name;
                 modelSelect.appendChild(option);
             });
+            preencherModelosComparacao(activeModels);
 
             // Carregar modelo default
             loadDefaultModel();
@@ -2114,6 +2431,26 @@ function loadAIModels() {
         });
 }
 
+// Opções de modelos para a comparação entre modelos
+function preencherModelosComparacao(models) {
+    const container = document.getElementById('comparar_modelos');
+    if (!container) {
+        return;
+    }
+    container.innerHTML = '';
+    models.forEach(model => {
+        const label = document.createElement('label');
+        label.className = 'inline-flex items-center text-sm text-gray-700';
+        const input = document.createElement('input');
+        input.type = 'checkbox';
+        input.value = model.id;
+        input.className = 'h-4 w-4 text-primary-600 border-gray-300 rounded focus:ring-primary-500 mr-2';
+        label.appendChild(input);
+        label.appendChild(document.createTextNode(model.name));
+        container.appendChild(label);
+    });
+}
+
 // Função para carregar modelo padrão
 function loadDefaultModel() {
     fetch('/api/default_model')
@@ -2584,21 +2921,13 @@ async function requestAdjustment() {
         const controller = new AbortController();
         const timeoutId = setTimeout(() => controller.abort(), 5 * 60 * 1000); // 5 minutos
 
-        const response = await fetch('/adjust_minuta', {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify(adjustmentData),
-            signal: controller.signal
+        const { ok, result } = await consumirStreamGeracao('/adjust_minuta/stream', adjustmentData, controller.signal, textoParcial => {
+            requestBtn.innerHTML = `<i class="fas fa-spinner fa-spin mr-2"></i>Recebendo... (${textoParcial.length} caracteres)`;
         });
 
         clearTimeout(timeoutId);
 
-        const result = await response.json();
-
-
-        if (response.ok) {
+        if (ok) {
             // Obter o resultado (pode ser 'minuta' ou 'resultado')
             const resultado = result.minuta || result.resultado;
 
@@ -2609,6 +2938,9 @@ async function requestAdjustment() {
 
             // Criar nova versão
             createNewVersion(resultado, adjustPrompt, result.tokens_info, result.cost_info, result.user_cost);
+            avisarOrcamentoContexto(result.orcamento_contexto);
+            avisarRespostaEmCache(result.tokens_info);
+            avisarFallbackModelo(result.fallback_modelo);
 
             // Fechar modal
             hideAdjustDialog();
@@ -2700,7 +3032,7 @@ function createNewVersion(content, adjustmentPrompt, tokensInfo, costInfo, user_
             </div>
             <div class="text-center">
                 <div class="font-medium text-blue-600">${tokensInfo.request_tokens || 0}</div>
-                <div class="text-gray-500">Envio</div>
+                <div class="text-gray-500">Envio${tokensInfo.cache_read_tokens ? ` (${tokensInfo.cache_read_tokens} em cache)` : ''}</div>
             </div>
             <div class="text-center">
                 <div class="font-medium text-green-600">${tokensInfo.response_tokens || 0}</div>
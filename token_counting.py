@@ -0,0 +1,141 @@
+"""
+Contagem de tokens por provedor
+Cada família de modelos é mapeada para um tokenizer do tiktoken e um fator de
+calibração (Claude e Gemini não têm tokenizer público: a contagem é uma estimativa
+calibrada com o uso informado pelas próprias APIs). Os encoders são carregados uma
+vez por processo e as contagens são memorizadas pelo hash do texto.
+"""
+
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+import tiktoken
+from models_config import get_provider_for_model
+
+logger = logging.getLogger(__name__)
+
+# (provedor, prefixos do model_id, encoding, fator de calibração inicial)
+# A primeira regra que casar é usada; as mais específicas vêm antes
+TOKENIZER_RULES = [
+    ('openai', ('gpt-4o', 'chatgpt-4o', 'gpt-4.1', 'gpt-4.5', 'gpt-5', 'o1', 'o3', 'o4'), 'o200k_base', 1.0),
+    ('openai', ('gpt-4', 'gpt-3.5'), 'cl100k_base', 1.0),
+    # O tokenizer do Claude gera mais tokens que o cl100k para o mesmo texto
+    ('anthropic', ('',), 'cl100k_base', 1.15),
+    # SentencePiece do Gemini fica próximo do o200k em texto em português
+    ('google', ('',), 'o200k_base', 1.05),
+]
+DEFAULT_ENCODING = 'o200k_base'
+
+# Encodings carregados na inicialização
+PRELOAD_ENCODINGS = ('o200k_base', 'cl100k_base')
+
+# Calibração pelo uso real: só prompts grandes (o overhead de formatação distorce os pequenos)
+CALIBRATION_MIN_TOKENS = 2000
+CALIBRATION_WEIGHT = 0.2  # peso de cada nova amostra na média móvel
+CALIBRATION_LIMITS = (0.7, 1.6)
+
+# Quantidade de contagens memorizadas
+TOKEN_CACHE_SIZE = 1024
+
+class TokenCounter:
+    """Contador de tokens com encoders pré-carregados e contagens memorizadas"""
+
+    def __init__(self):
+        self.encoders = {}
+        self._encoders_lock = threading.Lock()
+        self._counts = OrderedDict()
+        self._counts_lock = threading.Lock()
+        # Fator de calibração atual por provedor (estimativas de Claude e Gemini)
+        self.calibration = {provider: factor for provider, _, _, factor in TOKENIZER_RULES if factor != 1.0}
+
+    def preload(self):
+        """Carrega os encoders usados pelos modelos (chamar na inicialização do processo)"""
+        for encoding_name in PRELOAD_ENCODINGS:
+            self._get_encoding(encoding_name)
+
+    def _get_encoding(self, encoding_name: str):
+        """Retorna o encoding do tiktoken (None se não puder ser carregado)"""
+        if encoding_name in self.encoders:
+            return self.encoders[encoding_name]
+        with self._encoders_lock:
+            if encoding_name not in self.encoders:
+                try:
+                    self.encoders[encoding_name] = tiktoken.get_encoding(encoding_name)
+                except Exception as e:
+                    # Sem o arquivo do encoding (ex.: servidor sem acesso à internet): usar estimativa
+                    logger.warning(f"Erro ao carregar encoding {encoding_name}: {e}")
+                    self.encoders[encoding_name] = None
+            return self.encoders[encoding_name]
+
+    def tokenizer_for_model(self, model: str):
+        """
+        Retorna (provedor, encoding, fator de calibração) usados para o modelo
+        """
+        provider = get_provider_for_model(model)
+        model_id = (model or '').lower()
+        for rule_provider, prefixes, encoding_name, factor in TOKENIZER_RULES:
+            if provider == rule_provider and model_id.startswith(prefixes):
+                return provider, encoding_name, self.calibration.get(provider, factor)
+        return provider, DEFAULT_ENCODING, 1.0
+
+    def get_encoder(self, model: str) -> tiktoken.Encoding:
+        """Obtém o encoder apropriado para o modelo (None se indisponível)"""
+        _, encoding_name, _ = self.tokenizer_for_model(model)
+        return self._get_encoding(encoding_name)
+
+    def _count_raw(self, text: str, encoding_name: str) -> int:
+        """Conta tokens com o encoding, memorizando pelo hash do texto"""
+        key = (encoding_name, hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest())
+        with self._counts_lock:
+            count = self._counts.get(key)
+            if count is not None:
+                self._counts.move_to_end(key)
+                return count
+
+        encoder = self._get_encoding(encoding_name)
+        if encoder is not None:
+            # encode_ordinary: texto de usuário pode conter marcadores como <|endoftext|>
+            count = len(encoder.encode_ordinary(text))
+        else:
+            # Fallback: estimativa aproximada (1 token ≈ 4 caracteres)
+            count = len(text) // 4
+
+        with self._counts_lock:
+            self._counts[key] = count
+            if len(self._counts) > TOKEN_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        return count
+
+    def count_tokens(self, text: str, model: str) -> int:
+        """Conta tokens em um texto para um modelo específico"""
+        if not text:
+            return 0
+        try:
+            _, encoding_name, factor = self.tokenizer_for_model(model)
+            return int(round(self._count_raw(text, encoding_name) * factor))
+        except Exception as e:
+            logger.error(f"Erro ao contar tokens: {e}")
+            return len(text) // 4
+
+    def calibrate(self, model: str, texts: list, actual_tokens: int):
+        """
+        Ajusta o fator de calibração do provedor com a contagem real informada pela API
+
+        Só se aplica a provedores estimados (Claude, Gemini) e a entradas grandes.
+        texts são os textos enviados (instruções e prompt), contados separadamente
+        para aproveitar as contagens já memorizadas
+        """
+        provider, encoding_name, factor = self.tokenizer_for_model(model)
+        if provider not in self.calibration or not actual_tokens:
+            return
+        raw = sum(self._count_raw(text, encoding_name) for text in texts if text)
+        if raw < CALIBRATION_MIN_TOKENS:
+            return
+
+        observed = min(max(actual_tokens / raw, CALIBRATION_LIMITS[0]), CALIBRATION_LIMITS[1])
+        self.calibration[provider] = factor + (observed - factor) * CALIBRATION_WEIGHT
+        logger.debug(f"[TOKENS] Calibração {provider}: {factor:.3f} -> {self.calibration[provider]:.3f}")
+
+# Instância compartilhada pelo processo
+token_counter = TokenCounter()
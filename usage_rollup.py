@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Agregados diários do uso de IA (tabela usage_daily)
+Os painéis de estatísticas leem os totais por (data, usuário, modelo, ação) em vez de
+recalcular tudo a partir de usage_log. A atualização é incremental: cada execução agrega
+só os logs com id acima da marca gravada em app_config (usage_daily_last_log_id). Roda
+antes das páginas de estatísticas e periodicamente nos workers de jobs.
+Uso: python usage_rollup.py [--rebuild] (agrega os logs novos; --rebuild refaz tudo)
+"""
+
+import os
+import sys
+import logging
+import argparse
+from datetime import datetime, timezone
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Intervalo entre atualizações feitas pelos workers de jobs (segundos)
+USAGE_ROLLUP_INTERVAL = int(os.getenv('USAGE_ROLLUP_INTERVAL', '60'))
+
+CHAVE_MARCA = 'usage_daily_last_log_id'
+
+# Datas em UTC; o custo é o gravado no log ou, sem custo gravado, o preço atual do modelo
+SQL_AGREGAR = """
+    INSERT INTO usage_daily (
+        date, user_id, model_used, action, requests, requests_with_tokens, successful_requests,
+        tokens_used, request_tokens, response_tokens, cost_usd
+    )
+    SELECT
+        date(usage_log.created_at),
+        usage_log.user_id,
+        COALESCE(usage_log.model_used, ''),
+        usage_log.action,
+        COUNT(*),
+        SUM(CASE WHEN usage_log.tokens_used > 0 THEN 1 ELSE 0 END),
+        SUM(CASE WHEN usage_log.success THEN 1 ELSE 0 END),
+        SUM(COALESCE(usage_log.tokens_used, 0)),
+        SUM(COALESCE(usage_log.request_tokens, 0)),
+        SUM(COALESCE(usage_log.response_tokens, 0)),
+        SUM(
+            COALESCE(usage_log.input_cost_usd, usage_log.request_tokens * ai_model.price_input / 1000000.0, 0)
+            + COALESCE(usage_log.output_cost_usd, usage_log.response_tokens * ai_model.price_output / 1000000.0, 0)
+        )
+    FROM usage_log
+    LEFT JOIN ai_model ON ai_model.model_id = usage_log.model_used
+    WHERE usage_log.id > :marca AND usage_log.id <= :ate
+    GROUP BY date(usage_log.created_at), usage_log.user_id, COALESCE(usage_log.model_used, ''), usage_log.action
+    ON CONFLICT (date, user_id, model_used, action) DO UPDATE SET
+        requests = requests + excluded.requests,
+        requests_with_tokens = requests_with_tokens + excluded.requests_with_tokens,
+        successful_requests = successful_requests + excluded.successful_requests,
+        tokens_used = tokens_used + excluded.tokens_used,
+        request_tokens = request_tokens + excluded.request_tokens,
+        response_tokens = response_tokens + excluded.response_tokens,
+        cost_usd = cost_usd + excluded.cost_usd
+"""
+
+def atualizar_uso_diario() -> int:
+    """
+    Agrega em usage_daily os logs de uso gravados desde a última atualização
+
+    Returns:
+        int: número de logs agregados
+    """
+    from app import db
+    try:
+        # A escrita na marca vem antes da leitura: reserva o banco para esta transação,
+        # e outro processo atualizando ao mesmo tempo espera e lê a marca já avançada
+        db.session.execute(text(
+            "INSERT OR IGNORE INTO app_config (key, value, description, updated_at) "
+            "VALUES (:chave, '0', 'Último log de uso agregado em usage_daily', :agora)"
+        ), {'chave': CHAVE_MARCA, 'agora': datetime.now(timezone.utc)})
+        marca = int(db.session.execute(text(
+            "SELECT value FROM app_config WHERE key = :chave"
+        ), {'chave': CHAVE_MARCA}).scalar() or 0)
+        ate = db.session.execute(text("SELECT MAX(id) FROM usage_log")).scalar() or 0
+        if ate <= marca:
+            db.session.rollback()
+            return 0
+
+        db.session.execute(text(SQL_AGREGAR), {'marca': marca, 'ate': ate})
+        agregados = db.session.execute(text(
+            "SELECT COUNT(*) FROM usage_log WHERE id > :marca AND id <= :ate"
+        ), {'marca': marca, 'ate': ate}).scalar()
+        db.session.execute(text(
+            "UPDATE app_config SET value = :ate, updated_at = :agora WHERE key = :chave"
+        ), {'chave': CHAVE_MARCA, 'ate': str(ate), 'agora': datetime.now(timezone.utc)})
+        db.session.commit()
+        return agregados
+    except Exception as e:
+        db.session.rollback()
+        logger.warning(f"Erro ao atualizar usage_daily: {e}")
+        return 0
+
+def reconstruir_uso_diario() -> int:
+    """Apaga os agregados e refaz usage_daily a partir de todos os logs de uso"""
+    from app import db
+    db.session.execute(text("DELETE FROM usage_daily"))
+    db.session.execute(text("UPDATE app_config SET value = '0' WHERE key = :chave"), {'chave': CHAVE_MARCA})
+    db.session.commit()
+    return atualizar_uso_diario()
+
+def main():
+    """Função principal"""
+    parser = argparse.ArgumentParser(description='Atualiza os agregados diários de uso do DIRIA')
+    parser.add_argument('--rebuild', action='store_true', help='Refazer os agregados a partir de todos os logs')
+    args = parser.parse_args()
+
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from app import app
+
+    with app.app_context():
+        if args.rebuild:
+            print("🔄 Refazendo os agregados diários de uso...")
+            agregados = reconstruir_uso_diario()
+        else:
+            print("🔄 Atualizando os agregados diários de uso...")
+            agregados = atualizar_uso_diario()
+        print(f"✅ {agregados} log(s) agregado(s) em usage_daily")
+
+if __name__ == '__main__':
+    main()